@@ -0,0 +1,253 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from starlette.routing import Match
+
+from config import settings
+from models import engine
+
+READ = "read"
+WRITE = "write"
+BULK = "bulk"
+EXEMPT = "exempt"
+
+# Paths that must stay responsive while the database is saturated (plus /admin/*)
+EXEMPT_PATHS = {"/", "/health", "/metrics", "/docs", "/redoc", "/openapi.json", "/events"}
+
+
+def admission_class(name):
+    """Put a route in a concurrency class other than the default for its method"""
+    def decorate(func):
+        func.__admission_class__ = name
+        return func
+    return decorate
+
+
+class Rejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ClassLimiter:
+    """Bounded concurrency with a bounded, time-limited wait queue"""
+
+    def __init__(self, name, limit, max_queue, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0, "pool_saturated": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise Rejected("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._leave_queue(waiter)
+                self.rejected["queue_timeout"] += 1
+                raise Rejected("queue_timeout")
+        except BaseException:
+            # Cancelled while queued (the client went away): give up the place
+            # in the queue, or pass on the slot if it was already handed over
+            if waiter.done():
+                self.release()
+            else:
+                self._leave_queue(waiter)
+            raise
+        waited = time.monotonic() - started
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.admitted += 1
+
+    def _leave_queue(self, waiter):
+        waiter.cancel()
+        self._waiters.remove(waiter)
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter so newcomers cannot jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+class PoolMonitor:
+    """Tracks how long requests wait for a pooled connection"""
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.wait_ewma = 0.0
+        self.checkouts = 0
+
+    def record_wait(self, seconds):
+        self.checkouts += 1
+        self.wait_ewma += self.smoothing * (seconds - self.wait_ewma)
+
+    def saturated(self):
+        return self.wait_ewma * 1000 > settings.ADMISSION_MAX_POOL_WAIT_MS
+
+    def stats(self):
+        pool = engine.pool
+        stats = {
+            "wait_ms_ewma": round(self.wait_ewma * 1000, 3),
+            "checkouts": self.checkouts,
+            "saturated": self.saturated(),
+        }
+        for name in ("size", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+
+pool_monitor = PoolMonitor()
+limiters = {
+    name: ClassLimiter(
+        name,
+        settings.get_admission_setting(settings.ADMISSION_LIMITS, name),
+        settings.get_admission_setting(settings.ADMISSION_QUEUES, name),
+        settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000
+    )
+    for name in (READ, WRITE, BULK)
+}
+
+
+def record_pool_wait(seconds):
+    pool_monitor.record_wait(seconds)
+
+
+def classify(scope):
+    """Find the concurrency class of the route a request will hit"""
+    path = scope["path"]
+    if path in EXEMPT_PATHS or path.startswith("/admin/") or scope["method"] == "OPTIONS":
+        return EXEMPT
+    for route in scope["app"].router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            explicit = getattr(child_scope.get("endpoint"), "__admission_class__", None)
+            if explicit:
+                return explicit
+            break
+    return READ if scope["method"] in ("GET", "HEAD") else WRITE
+
+
+class AdmissionMiddleware:
+    """Sheds load with 503 + Retry-After instead of queueing inside the DB pool.
+
+    Requests are limited per class (read / write / bulk). A request waits in a
+    short bounded queue when its class is full and is rejected when the queue
+    is full, the wait times out, or connection checkouts are already slow.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope)
+        limiter = limiters.get(route_class)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Keep letting one request per class through so the wait estimate can recover
+        if pool_monitor.saturated() and limiter.in_flight >= 1:
+            limiter.rejected["pool_saturated"] += 1
+            await self._reject(send, route_class, "pool_saturated")
+            return
+
+        try:
+            await limiter.acquire()
+        except Rejected as exc:
+            await self._reject(send, route_class, exc.reason)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _reject(self, send, route_class, reason):
+        body = json.dumps({"detail": "Server busy, retry later", "class": route_class, "reason": reason}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def stats():
+    return {
+        "classes": {name: limiter.stats() for name, limiter in limiters.items()},
+        "pool": pool_monitor.stats(),
+    }
+
+
+def prometheus_metrics():
+    """Admission metrics in the Prometheus text exposition format"""
+    lines = [
+        "# TYPE netage_admission_in_flight gauge",
+        "# TYPE netage_admission_queue_depth gauge",
+        "# TYPE netage_admission_admitted_total counter",
+        "# TYPE netage_admission_queued_total counter",
+        "# TYPE netage_admission_rejected_total counter",
+        "# TYPE netage_admission_wait_seconds_total counter",
+    ]
+    for name, limiter in limiters.items():
+        lines.append(f'netage_admission_in_flight{{class="{name}"}} {limiter.in_flight}')
+        lines.append(f'netage_admission_queue_depth{{class="{name}"}} {len(limiter._waiters)}')
+        lines.append(f'netage_admission_admitted_total{{class="{name}"}} {limiter.admitted}')
+        lines.append(f'netage_admission_queued_total{{class="{name}"}} {limiter.queued}')
+        for reason, count in limiter.rejected.items():
+            lines.append(f'netage_admission_rejected_total{{class="{name}",reason="{reason}"}} {count}')
+        lines.append(f'netage_admission_wait_seconds_total{{class="{name}"}} {limiter.wait_seconds_total:.6f}')
+
+    pool = pool_monitor.stats()
+    lines.append("# TYPE netage_db_pool_wait_ms_ewma gauge")
+    lines.append(f"netage_db_pool_wait_ms_ewma {pool['wait_ms_ewma']}")
+    if "checkedout" in pool:
+        lines.append("# TYPE netage_db_pool_checked_out gauge")
+        lines.append(f"netage_db_pool_checked_out {pool['checkedout']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,199 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import selectinload
+
+from models import PartyMaster, PartyAddress, ContactPerson, PartyAccountDetails, BankDetails
+import change_feed
+import audit
+import identifiers
+import party_codes
+
+# Child collections of a party: (relationship, model, primary key, change feed entity)
+CHILD_COLLECTIONS = (
+    ("addresses", PartyAddress, "address_id", change_feed.ADDRESS),
+    ("contact_persons", ContactPerson, "contact_id", change_feed.CONTACT),
+    ("account_details", PartyAccountDetails, "account_id", change_feed.ACCOUNT_DETAILS),
+    ("bank_details", BankDetails, "bank_id", change_feed.BANK_DETAILS),
+)
+
+
+class UnknownChild(LookupError):
+    """A child id in an aggregate update does not belong to the party"""
+
+
+class InvalidIdentifier(ValueError):
+    """The update leaves the party with a GSTIN that does not belong to its PAN"""
+
+
+class VersionConflict(Exception):
+    """An update was based on a version of the party or a child that is no longer current"""
+
+
+def create_party_aggregate(db, party):
+    """Add a party with its addresses, contacts, account and bank details.
+
+    Everything is flushed and recorded in the change feed but not committed,
+    so callers can create many parties in one transaction. Parties without a
+    party code get the next one from the party code allocator.
+    """
+    # Create party master
+    values = party.dict(exclude={'addresses', 'contact_persons', 'account_details', 'bank_details'})
+    values["party_code"] = values["party_code"] or party_codes.allocator.next_code(db)
+    db_party = PartyMaster(**values)
+    db.add(db_party)
+    db.flush()
+    
+    # Create addresses
+    db_addresses = []
+    for address_data in party.addresses:
+        db_address = PartyAddress(**address_data.dict(), party_id=db_party.party_id)
+        db.add(db_address)
+        db_addresses.append(db_address)
+    
+    # Create contact persons
+    db_contacts = []
+    for contact_data in party.contact_persons:
+        db_contact = ContactPerson(**contact_data.dict(), party_id=db_party.party_id)
+        db.add(db_contact)
+        db_contacts.append(db_contact)
+    
+    # Create account details
+    db_account = None
+    if party.account_details:
+        db_account = PartyAccountDetails(**party.account_details.dict(), party_id=db_party.party_id)
+        db.add(db_account)
+    
+    # Create bank details
+    db_bank = None
+    if party.bank_details:
+        db_bank = BankDetails(**party.bank_details.dict(), party_id=db_party.party_id)
+        db.add(db_bank)
+    
+    # Record the whole aggregate in the change feed
+    db.flush()
+    party_id = db_party.party_id
+    changes = [(change_feed.PARTY, change_feed.INSERT, party_id, party_id, change_feed.snapshot(db_party))]
+    for db_address in db_addresses:
+        changes.append((change_feed.ADDRESS, change_feed.INSERT, db_address.address_id, party_id, change_feed.snapshot(db_address)))
+    for db_contact in db_contacts:
+        changes.append((change_feed.CONTACT, change_feed.INSERT, db_contact.contact_id, party_id, change_feed.snapshot(db_contact)))
+    if db_account:
+        changes.append((change_feed.ACCOUNT_DETAILS, change_feed.INSERT, db_account.account_id, party_id, change_feed.snapshot(db_account)))
+    if db_bank:
+        changes.append((change_feed.BANK_DETAILS, change_feed.INSERT, db_bank.bank_id, party_id, change_feed.snapshot(db_bank)))
+    change_feed.record_changes(db, changes)
+    for entity, operation, entity_id, party_id, data in changes:
+        audit.record(db, entity, operation, entity_id, party_id, after=data)
+    
+    return db_party
+
+
+def _same(stored, value):
+    if isinstance(stored, Decimal) and value is not None:
+        return stored == Decimal(str(value))
+    return stored == value
+
+
+def _diff(obj, data):
+    return {field: value for field, value in data.items() if not _same(getattr(obj, field), value)}
+
+
+def _diff_children(party, name, pk, items):
+    """Split the submitted children into inserts, updates and deletes against the stored ones"""
+    stored = {getattr(child, pk): child for child in getattr(party, name)}
+    inserts, updates, seen = [], [], set()
+    for item in items:
+        data = item.dict(exclude={pk, "version"})
+        child_id = getattr(item, pk)
+        if child_id is None:
+            inserts.append({**data, "party_id": party.party_id, "tenant_id": party.tenant_id})
+            continue
+        if child_id not in stored or child_id in seen:
+            raise UnknownChild(f"{name} item {child_id} does not belong to party {party.party_id}")
+        seen.add(child_id)
+        if item.version is not None and item.version != stored[child_id].version:
+            raise VersionConflict(f"{name} item {child_id} is at version {stored[child_id].version}, not {item.version}")
+        changed = _diff(stored[child_id], data)
+        if changed:
+            updates.append((stored[child_id], changed))
+    deletes = [child for child_id, child in stored.items() if child_id not in seen]
+    return inserts, updates, deletes
+
+
+def update_party_aggregate(db, party_id, party_update, expected_version=None):
+    """Bring a party and the submitted child collections in line with ``party_update``.
+
+    Collections left out of the update are not touched. For the others, items
+    without an id are inserted, items with an id are updated when a field
+    differs, and stored children missing from the list are deleted. Each kind
+    of change is one statement per collection. Nothing is committed.
+
+    Raises ``InvalidIdentifier`` when the merged GSTIN and PAN disagree, and
+    ``VersionConflict`` when ``expected_version`` or a child's version
+    is not the stored one. Every UPDATE also checks the version it read, so a
+    change committed in between raises ``StaleDataError`` on flush.
+    """
+    names = [name for name, _, _, _ in CHILD_COLLECTIONS if getattr(party_update, name) is not None]
+    db_party = db.execute(
+        select(PartyMaster)
+        .where(PartyMaster.party_id == party_id)
+        .options(*(selectinload(getattr(PartyMaster, name)) for name in names))
+    ).scalar_one_or_none()
+    if db_party is None:
+        return None
+    if expected_version is not None and db_party.version != expected_version:
+        raise VersionConflict(f"Party {party_id} is at version {db_party.version}, not {expected_version}")
+    fields = party_update.dict(exclude_unset=True, exclude={"version", *(name for name, _, _, _ in CHILD_COLLECTIONS)})
+    message = identifiers.merged_gstin_error(db_party, fields)
+    if message:
+        raise InvalidIdentifier(message)
+    
+    changes = []
+    for name, model, pk, entity in CHILD_COLLECTIONS:
+        if name not in names:
+            continue
+        inserts, updates, deletes = _diff_children(db_party, name, pk, getattr(party_update, name))
+        key = getattr(model, pk)
+        
+        if deletes:
+            before = [change_feed.snapshot(child) for child in deletes]
+            db.execute(
+                delete(model)
+                .where(key.in_([data[pk] for data in before]))
+                .execution_options(synchronize_session=False)
+            )
+            for data in before:
+                changes.append((entity, change_feed.DELETE, data[pk], party_id, None))
+                audit.record(db, entity, change_feed.DELETE, data[pk], party_id, before=data)
+        if updates:
+            before = [change_feed.snapshot(child) for child, _ in updates]
+            # ORM bulk UPDATE by primary key: one executemany per set of changed columns,
+            # each row matched on the version read above and moved to the next one
+            db.execute(update(model), [{pk: getattr(child, pk), "version": child.version, **changed} for child, changed in updates])
+            for data, (_, changed) in zip(before, updates):
+                after = {**data, **changed, "version": data["version"] + 1}
+                changes.append((entity, change_feed.UPDATE, data[pk], party_id, after))
+                audit.record(db, entity, change_feed.UPDATE, data[pk], party_id, before=data, after=after)
+        if inserts:
+            rows = db.execute(insert(model).returning(*model.__table__.c), inserts).mappings().all()
+            for row in rows:
+                changes.append((entity, change_feed.INSERT, row[pk], party_id, dict(row)))
+                audit.record(db, entity, change_feed.INSERT, row[pk], party_id, after=dict(row))
+    
+    changed = _diff(db_party, fields)
+    if changed or changes:
+        before = change_feed.snapshot(db_party)
+        for field, value in changed.items():
+            setattr(db_party, field, value)
+        db_party.updated_at = datetime.utcnow()
+        db.flush()
+        after = change_feed.snapshot(db_party)
+        changes.append((change_feed.PARTY, change_feed.UPDATE, party_id, party_id, after))
+        change_feed.record_changes(db, changes)
+        audit.record(db, change_feed.PARTY, change_feed.UPDATE, party_id, party_id, before=before, after=after)
+    
+    # Collections were changed behind the ORM's back
+    db.expire(db_party, names)
+    return db_party
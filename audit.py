@@ -0,0 +1,227 @@
+import contextvars
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event as sa_event, insert, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import SessionLocal, AuditLog
+import change_feed
+
+logger = logging.getLogger(__name__)
+
+# Change feed entities that get an audit trail
+AUDITED = frozenset({
+    change_feed.PARTY,
+    change_feed.BANK_DETAILS,
+    change_feed.PAYMENT_TERM,
+    change_feed.PARTY_PAYMENT_TERM,
+})
+
+_actor = contextvars.ContextVar("audit_actor", default=None)
+
+
+def pending_entries(db):
+    """Audit entries of the session's current transaction, written once it commits"""
+    return db.info.setdefault("pending_audit", [])
+
+
+def _encode(data):
+    if data is None:
+        return None
+    return json.dumps(data, default=str)
+
+
+def record(db, entity, action, entity_id, party_id=None, before=None, after=None):
+    """Note a change with its before/after snapshots in the caller's transaction.
+
+    Nothing is written here: the entry is handed to the background writer when
+    the transaction commits and dropped if it rolls back.
+    """
+    if not settings.AUDIT_ENABLED or entity not in AUDITED:
+        return
+    pending_entries(db).append({
+        "entity": entity,
+        "entity_id": entity_id,
+        "party_id": party_id,
+        "action": action,
+        "actor": _actor.get(),
+        "before": _encode(before),
+        "after": _encode(after),
+        "tenant_id": db.tenant,
+    })
+
+
+class AuditWriter:
+    """Writes committed audit entries in the background with multi-row INSERTs.
+
+    A flusher thread drains the buffer every AUDIT_FLUSH_INTERVAL seconds, or
+    sooner once a full batch is waiting. When AUDIT_MAX_PENDING entries pile up
+    (the database is slow or down) the committing request flushes inline
+    instead, so memory stays bounded and writers slow down rather than entries
+    being lost.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None):
+        self.batch_size = batch_size or settings.AUDIT_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.AUDIT_FLUSH_INTERVAL
+        self.max_pending = max_pending or settings.AUDIT_MAX_PENDING
+        self.written = 0
+        self.dropped = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, entries):
+        with self._lock:
+            self._pending.extend(entries)
+            backlog = len(self._pending)
+        if backlog >= self.max_pending:
+            self.flush()
+        elif backlog >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write the buffered entries in batches; returns how many were written"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return written
+                # One INSERT per tenant, each into the tenant's own database
+                by_tenant = {}
+                for entry in batch:
+                    by_tenant.setdefault(entry["tenant_id"], []).append(entry)
+                done = set()
+                try:
+                    for tenant, entries in by_tenant.items():
+                        with SessionLocal(tenant=tenant) as db:
+                            db.execute(insert(AuditLog), entries)
+                            db.commit()
+                        done.add(tenant)
+                        written += len(entries)
+                        self.written += len(entries)
+                except Exception:
+                    unwritten = [entry for entry in batch if entry["tenant_id"] not in done]
+                    logger.exception("Could not write %d audit entries", len(unwritten))
+                    self._requeue(unwritten)
+                    return written
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._pending.extendleft(reversed(batch))
+            overflow = len(self._pending) - self.max_pending
+            for _ in range(overflow):
+                self._pending.pop()
+        if overflow > 0:
+            self.dropped += overflow
+            logger.error("Audit buffer full, dropped the %d newest entries", overflow)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+writer = AuditWriter()
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _submit_entries(session):
+    entries = session.info.pop("pending_audit", None)
+    if entries:
+        changed_at = datetime.utcnow()
+        for entry in entries:
+            entry["changed_at"] = changed_at
+        writer.submit(entries)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_entries(session):
+    session.info.pop("pending_audit", None)
+
+
+def read_audit(db, entity=None, entity_id=None, party_id=None, before=None, limit=None):
+    """Read one page of audit history, newest first.
+
+    Pages are keyed on ``audit_id``: pass the returned ``next_cursor`` as
+    ``before`` to get the next, older page.
+    """
+    page_size = min(limit or settings.AUDIT_PAGE_SIZE, settings.AUDIT_MAX_PAGE_SIZE)
+    query = select(AuditLog)
+    if entity:
+        query = query.where(AuditLog.entity == entity)
+    if entity_id is not None:
+        query = query.where(AuditLog.entity_id == entity_id)
+    if party_id is not None:
+        query = query.where(AuditLog.party_id == party_id)
+    if before is not None:
+        query = query.where(AuditLog.audit_id < before)
+
+    rows = db.execute(query.order_by(AuditLog.audit_id.desc()).limit(page_size + 1)).scalars().all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    entries = [
+        {
+            "audit_id": row.audit_id,
+            "entity": row.entity,
+            "entity_id": row.entity_id,
+            "party_id": row.party_id,
+            "action": row.action,
+            "actor": row.actor,
+            "before": json.loads(row.before) if row.before else None,
+            "after": json.loads(row.after) if row.after else None,
+            "changed_at": row.changed_at,
+        }
+        for row in rows
+    ]
+    return {"entries": entries, "next_cursor": rows[-1].audit_id if has_more else None}
+
+
+class AuditActorMiddleware:
+    """Remembers who is making the request, from AUDIT_ACTOR_HEADER, for audit entries"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.AUDIT_ACTOR_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        actor = next((value.decode("latin-1") for name, value in scope["headers"] if name == self.header), None)
+        token = _actor.set(actor[:100] if actor else None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _actor.reset(token)
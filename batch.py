@@ -0,0 +1,199 @@
+import json
+import logging
+import re
+from urllib.parse import urlsplit
+
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+
+from models import engines
+from query_guard import QueryGuardMiddleware
+from tenancy import TenantSession
+
+logger = logging.getLogger(__name__)
+
+# Streaming, background-job and nested batch routes cannot run inside a batch
+UNBATCHABLE = ("/batch", "/events", "/exports", "/jobs")
+
+# "${party.party_id}" or "${party.addresses.0.address_id}": a value from an earlier result
+_REFERENCE = re.compile(r"\$\{([A-Za-z0-9_-]+)((?:\.[A-Za-z0-9_]+)*)\}")
+
+# Request scope key holding the session shared by an atomic batch
+SESSION_KEY = "netage.batch_session"
+
+# Request headers not passed on to operations
+_OWN_HEADERS = {b"content-length", b"content-type", b"transfer-encoding"}
+
+
+class BatchSession(TenantSession):
+    """Session shared by the operations of an atomic batch.
+
+    Route handlers commit as usual, but their commits only flush: nothing is
+    committed, and no change is published, until the whole batch succeeds.
+    """
+
+    def commit(self):
+        self.flush()
+
+    def commit_batch(self):
+        super().commit()
+
+
+def shared_session(scope):
+    """The atomic batch session an operation runs in, if any"""
+    return scope.get(SESSION_KEY)
+
+
+class OperationFailed(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def _lookup(results, op_id, fields):
+    result = results.get(op_id)
+    if result is None:
+        raise OperationFailed(400, f"Unknown operation referenced: {op_id}")
+    if not 200 <= result["status"] < 300:
+        raise OperationFailed(424, f"Depends on operation {op_id}, which failed")
+    value = result["body"]
+    for name in fields:
+        try:
+            value = value[int(name)] if isinstance(value, list) else value[name]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise OperationFailed(400, f"Operation {op_id} has no {'.'.join(fields)} in its result")
+    return value
+
+
+def resolve(value, results):
+    """Replace ``${id.field}`` references in a path or body with earlier results.
+
+    A string that is one reference takes the referenced value as is (so ids
+    stay numbers); references inside longer strings are formatted into them.
+    """
+    if isinstance(value, dict):
+        return {key: resolve(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, results) for item in value]
+    if not isinstance(value, str) or "${" not in value:
+        return value
+    match = _REFERENCE.fullmatch(value)
+    if match:
+        return _lookup(results, match.group(1), match.group(2).split(".")[1:])
+    return _REFERENCE.sub(
+        lambda match: str(_lookup(results, match.group(1), match.group(2).split(".")[1:])), value
+    )
+
+
+class BatchRunner:
+    """Runs batch operations through the app's own routes, in this process.
+
+    Each operation goes through the router with the same dependency
+    handling, exception handlers and query guard as a separate request, but
+    skips CORS, admission control and profiling, which the batch request as
+    a whole already went through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._stack = QueryGuardMiddleware(
+            ExceptionMiddleware(AsyncExitStackMiddleware(app.router), handlers=app.exception_handlers)
+        )
+
+    def _scope(self, parent, method, path, body, session):
+        url = urlsplit(path)
+        headers = [(name, value) for name, value in parent["headers"] if name.lower() not in _OWN_HEADERS]
+        if body is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {
+            "type": "http",
+            "asgi": parent.get("asgi", {"version": "3.0"}),
+            "http_version": parent.get("http_version", "1.1"),
+            "method": method.upper(),
+            "scheme": parent.get("scheme", "http"),
+            "server": parent.get("server"),
+            "client": parent.get("client"),
+            "root_path": parent.get("root_path", ""),
+            "path": url.path,
+            "raw_path": url.path.encode(),
+            "query_string": url.query.encode(),
+            "headers": headers,
+            "app": self.app,
+            "state": {},
+        }
+        if session is not None:
+            scope[SESSION_KEY] = session
+        return scope
+
+    async def _call(self, scope, body):
+        messages = [{"type": "http.request", "body": body or b"", "more_body": False}]
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        status, chunks = 500, []
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self._stack(scope, receive, send)
+        except Exception:
+            logger.exception("Batch operation %s %s failed", scope["method"], scope["path"])
+            return 500, {"detail": "Internal Server Error"}
+        payload = b"".join(chunks)
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, payload.decode("utf-8", "replace")
+
+    async def run(self, parent_scope, operations, atomic=False):
+        """Run operations in order; returns ``(committed, results)``.
+
+        With ``atomic`` every operation shares one session and transaction:
+        the first failure stops the batch and rolls everything back.
+        Otherwise each operation commits on its own and later operations
+        still run, unless they reference the result of one that failed.
+        """
+        session = BatchSession(engines=engines, autoflush=False) if atomic else None
+        results, by_id, failed = [], {}, None
+        try:
+            for position, operation in enumerate(operations):
+                op_id = operation.id or str(position)
+                if failed is not None:
+                    result = {"id": op_id, "status": 424, "body": {"detail": f"Not run: operation {failed} failed"}}
+                else:
+                    result = {"id": op_id, **await self._run_one(parent_scope, operation, by_id, session)}
+                    if atomic and not 200 <= result["status"] < 300:
+                        failed = op_id
+                results.append(result)
+                by_id[op_id] = result
+
+            if session is None:
+                return True, results
+            if failed is None:
+                session.commit_batch()
+                return True, results
+            session.rollback()
+            return False, results
+        finally:
+            if session is not None:
+                session.close()
+
+    async def _run_one(self, parent_scope, operation, results, session):
+        try:
+            path = resolve(operation.path, results)
+            body = resolve(operation.body, results)
+        except OperationFailed as exc:
+            return {"status": exc.status, "body": {"detail": exc.detail}}
+        if not path.startswith("/") or path.startswith(UNBATCHABLE):
+            return {"status": 400, "body": {"detail": f"{path} cannot run in a batch"}}
+
+        encoded = None if body is None else json.dumps(body).encode()
+        status, payload = await self._call(self._scope(parent_scope, operation.method, path, encoded, session), encoded)
+        return {"status": status, "body": payload}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the payment schedule engine at 100,000 invoices per call.
+
+Builds a synthetic term map (no database) of 50,000 parties over a handful
+of payment terms and times ``billing.payment_schedule`` on its own and with
+the JSON encoding the ``POST /billing/payment-schedule`` route adds.
+
+    python benchmark_billing.py
+    python benchmark_billing.py 500000
+"""
+
+import json
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import billing
+
+ROUNDS = 5
+PARTIES = 50_000
+
+
+def synthetic_terms(rng):
+    # Shaped like the sample payment terms in init_db.py
+    party_ids = np.arange(1, PARTIES + 1, dtype=np.int64)
+    with_default = rng.random(PARTIES) < 0.8
+    return {
+        "term_ids": np.array([1, 2, 3, 4], dtype=np.int64),
+        "payment_days": np.array([2, 8, 3, 7], dtype=np.int64),
+        "discount_bp": np.array([50, 20, 200, 300], dtype=np.int64),
+        "variable_days": np.array([3, 5, 21, -1], dtype=np.int64),
+        "sms_days": np.array([1, 6, -1, 5], dtype=np.int64),
+        "default_index": 0,
+        "party_ids": party_ids[with_default],
+        "party_terms": rng.integers(0, 4, with_default.sum()),
+    }
+
+
+def best_of(function):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = np.random.default_rng(42)
+    terms = synthetic_terms(rng)
+
+    party_ids = rng.integers(1, PARTIES * 1.1, count).tolist()
+    start = date(2025, 1, 1)
+    invoice_dates = [start + timedelta(days=int(offset)) for offset in rng.integers(0, 365, count)]
+    amounts = np.round(rng.uniform(100, 500_000, count), 2).tolist()
+    known = np.ones(count, dtype=bool)
+
+    def compute():
+        return billing.payment_schedule(party_ids, invoice_dates, amounts, terms=terms, known=known)
+
+    def compute_and_encode():
+        columns = compute()
+        names = list(columns)
+        return json.dumps({"schedule": [dict(zip(names, row)) for row in zip(*columns.values())]})
+
+    print(f"{count} invoices, best of {ROUNDS}")
+    print(f"payment_schedule:        {best_of(compute):8.1f} ms")
+    print(f"with row JSON encoding:  {best_of(compute_and_encode):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the batch credit check against 1,000,000 parties.
+
+Builds a synthetic credit table (no database) with an overlay of recent
+changes and times ``credit.check_credit`` on its own and with the JSON
+encoding the ``POST /credit/check`` route adds, then the cost of folding the
+overlay into the main arrays.
+
+    python benchmark_credit.py            # 10,000 checks per call
+    python benchmark_credit.py 100000
+"""
+
+import json
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import credit
+
+ROUNDS = 5
+PARTIES = 1_000_000
+CHANGED = 5_000
+
+
+def synthetic_parties(rng, party_ids):
+    limits = rng.integers(1, 50, len(party_ids)) * 10_000_000  # 1 to 49 lakh, in paise
+    days = rng.choice([15, 30, 45, 60], len(party_ids))
+    no_limit = rng.random(len(party_ids)) < 0.2
+    return sorted(
+        (party_id, None if unlimited else limit, days_)
+        for party_id, limit, days_, unlimited in zip(party_ids.tolist(), limits.tolist(), days.tolist(), no_limit.tolist())
+    )
+
+
+def best_of(function):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    rng = np.random.default_rng(42)
+    main_table = credit._limits(synthetic_parties(rng, np.arange(1, PARTIES + 1)))
+    changed = synthetic_parties(rng, rng.choice(PARTIES, CHANGED, replace=False) + 1)
+    overlay = credit._limits(changed)
+    overlay["removed"] = overlay["party_ids"]
+    tables = (main_table, overlay)
+
+    party_ids = rng.integers(1, PARTIES * 1.01, count).tolist()
+    outstanding = np.round(rng.uniform(0, 4_000_000, count), 2).tolist()
+    order_amounts = np.round(rng.uniform(100, 500_000, count), 2).tolist()
+    start = date(2025, 1, 1)
+    due_dates = [start + timedelta(days=int(offset)) for offset in rng.integers(0, 90, count)]
+
+    def compute():
+        return credit.check_credit(party_ids, outstanding, order_amounts, due_dates, as_of=date(2025, 3, 1), tables=tables)
+
+    def compute_and_encode():
+        columns = compute()
+        names = list(columns)
+        return json.dumps({"decisions": [dict(zip(names, row)) for row in zip(*columns.values())]})
+
+    pending = {party_id: (limit, days) for party_id, limit, days in changed}
+    started = time.perf_counter()
+    credit.CreditTable._merge(main_table, pending)
+    fold = (time.perf_counter() - started) * 1000
+
+    print(f"{count} checks against {PARTIES} parties ({CHANGED} in the overlay), best of {ROUNDS}")
+    print(f"check_credit:            {best_of(compute):8.1f} ms")
+    print(f"with row JSON encoding:  {best_of(compute_and_encode):8.1f} ms")
+    print(f"overlay fold:            {fold:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Latency and memory benchmark of the PIN code gazetteer.
+
+Builds a synthetic gazetteer the size of India Post's directory (about
+19,000 PIN codes over 750 districts), opens it through ``mmap`` and reports
+lookup percentiles and the growth of the process's resident memory.
+
+    python benchmark_gazetteer.py
+    python benchmark_gazetteer.py 100000
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+
+import gazetteer
+
+LOOKUPS = 100_000
+DISTRICTS = 750
+
+
+def resident_kb():
+    """Resident set size from /proc, or None off Linux"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def percentile(samples, fraction):
+    return sorted(samples)[int(len(samples) * fraction) - 1]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 19_000
+    rng = random.Random(42)
+    pins = sorted(rng.sample(range(110001, 855118), count))
+    rows = [
+        (pin, f"Taluk {pin // 100}", f"District {pin % DISTRICTS}", f"State {pin // 30000}")
+        for pin in pins
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "pincodes.gaz")
+        gazetteer.build(rows, path)
+        print(f"{count} PIN codes, file of {os.path.getsize(path) / 1024:.0f} KB")
+
+        # Allocated up front so the memory figure only covers the gazetteer
+        queries = [str(rng.choice(pins) if rng.random() < 0.9 else rng.randrange(110001, 855118)) for _ in range(LOOKUPS)]
+        samples = array("d", bytes(8 * LOOKUPS))
+
+        before = resident_kb()
+        started = time.perf_counter()
+        index = gazetteer.Gazetteer(path)
+        print(f"Opened in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        for position, query in enumerate(queries):
+            started = time.perf_counter()
+            index.lookup(query)
+            samples[position] = (time.perf_counter() - started) * 1000
+        after = resident_kb()
+        print(f"Lookups: p50 {percentile(samples, 0.5):.4f} ms, p99 {percentile(samples, 0.99):.4f} ms, "
+              f"max {max(samples):.3f} ms")
+
+        if before is not None and after is not None:
+            print(f"Resident memory grew by {after - before} KB (pages of the mapped file touched by lookups)")
+
+
+if __name__ == "__main__":
+    main()
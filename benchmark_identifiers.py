@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the identifier validation engine on one core.
+
+Generates synthetic onboarding records (GSTIN, PAN, IFSC, FSSAI and state,
+about one in ten with a corrupted identifier) and times
+``identifiers.validate_record`` over all of them, without the HTTP layer.
+
+    python benchmark_identifiers.py            # 100,000 records
+    python benchmark_identifiers.py 500000
+"""
+
+import random
+import string
+import sys
+import time
+
+import identifiers
+
+ROUNDS = 3
+STATES = [(code, name) for code, name in identifiers.GST_STATES.items() if code not in ("97", "99")]
+BANKS = list(identifiers.IFSC_BANKS)
+
+
+def record(rng):
+    pan = (
+        "".join(rng.choices(string.ascii_uppercase, k=3)) + rng.choice("PCHF") + rng.choice(string.ascii_uppercase)
+        + f"{rng.randrange(10000):04d}" + rng.choice(string.ascii_uppercase)
+    )
+    state_code, state = rng.choice(STATES)
+    gstin = f"{state_code}{pan}{rng.choice('123')}Z"
+    gstin += identifiers.gstin_check_character(gstin)
+    values = {
+        "gst_number": gstin,
+        "pan_number": pan,
+        "ifsc_code": f"{rng.choice(BANKS)}0{rng.randrange(10**6):06d}",
+        "fssai_number": f"{rng.choice('12')}{rng.randrange(10**13):013d}",
+        "state": state,
+    }
+    if rng.random() < 0.1:
+        field = rng.choice(list(identifiers.CHECKS))
+        value = values[field]
+        position = rng.randrange(len(value))
+        values[field] = value[:position] + rng.choice(string.ascii_uppercase + string.digits) + value[position + 1:]
+    return values
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(42)
+    records = [record(rng) for _ in range(count)]
+
+    best, invalid = None, 0
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        invalid = sum(1 for values in records if identifiers.validate_record(values))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    checked = count * len(identifiers.CHECKS)
+    print(f"{count} records ({checked} identifiers, {invalid} records invalid), best of {ROUNDS}")
+    print(f"validate_record: {best * 1000:.1f} ms, {checked / best:,.0f} identifiers/s, {count / best:,.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark of the typeahead prefix index.
+
+Loads synthetic parties straight into ``typeahead.PrefixIndex`` (no database)
+and reports lookup percentiles for prefixes of 1 to 8 characters, then the
+cost of indexing new and renamed parties.
+
+    python benchmark_typeahead.py            # 1,000,000 parties
+    python benchmark_typeahead.py 100000
+"""
+
+import random
+import sys
+import time
+
+from typeahead import PrefixIndex
+
+LOOKUPS = 20000
+WRITES = 20000
+
+FIRST_NAMES = ["SHREE", "JAI", "NEW", "OM", "SAI", "MAA", "RAJ", "GANESH", "LAXMI", "KRISHNA", "LALIT", "MAHAVIR"]
+TRADE_NAMES = ["KIRANA", "TRADERS", "ENTERPRISE", "STORES", "AGENCY", "SUPERMART", "DISTRIBUTORS", "FOODS"]
+CITIES = ["SURAT", "MUMBAI", "PUNE", "AHMEDABAD", "INDORE", "JAIPUR", "MOTALA", "RAJKOT"]
+
+
+def party(rng, n):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}{rng.randrange(1000)} {rng.choice(TRADE_NAMES)} ({rng.choice(CITIES)})"
+    return n, f"SNET{1000000 + n}", name
+
+
+def percentile(samples, fraction):
+    return sorted(samples)[int(len(samples) * fraction) - 1]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(42)
+    index = PrefixIndex()
+
+    started = time.perf_counter()
+    index.load(party(rng, n) for n in range(count))
+    print(f"Loaded {count} parties in {time.perf_counter() - started:.1f} s")
+
+    names = [party(rng, n)[2] for n in range(1000)] + [f"SNET{1000000 + rng.randrange(count)}" for _ in range(1000)]
+    samples = []
+    for _ in range(LOOKUPS):
+        text = rng.choice(names)
+        prefix = text[:rng.randint(1, 8)]
+        started = time.perf_counter()
+        index.suggest(prefix, limit=10)
+        samples.append((time.perf_counter() - started) * 1000)
+    print(f"Lookups: p50 {percentile(samples, 0.5):.3f} ms, p99 {percentile(samples, 0.99):.3f} ms, "
+          f"max {max(samples):.3f} ms")
+
+    started = time.perf_counter()
+    for n in range(WRITES):
+        if n % 2:
+            index.upsert(count + n, *party(rng, count + n)[1:])
+        else:
+            index.upsert(rng.randrange(count), *party(rng, n)[1:])
+    elapsed = time.perf_counter() - started
+    print(f"Writes: {elapsed / WRITES * 1000:.3f} ms per party (merges run in the background)")
+
+    started = time.perf_counter()
+    index.merge()
+    print(f"Merge of the remaining delta: {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Columnar snapshot of the party × product matrix for BI tools.
+
+Needs pyarrow, which is in requirements.txt; an install without it reports
+the export unavailable and the rest of the API is unaffected.
+"""
+from sqlalchemy import select, func
+
+from config import settings
+from models import SessionLocal, PartyMaster, PartyAddress, Products, PartyProducts
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# format -> (file extension, media type)
+FORMATS = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+# Output columns in query order with their Arrow types
+COLUMNS = (
+    ("party_product_id", "int64"),
+    ("party_id", "int64"),
+    ("party_code", "string"),
+    ("party_name", "string"),
+    ("city", "string"),
+    ("state", "string"),
+    ("zip_code", "string"),
+    ("product_id", "int64"),
+    ("product_code", "string"),
+    ("product_name", "string"),
+    ("group_name", "string"),
+    ("sub_group", "string"),
+    ("item", "string"),
+    ("stock_keeping_unit", "string"),
+    ("quantity", "int64"),
+    ("created_at", "timestamp[us]"),
+)
+
+
+class ExportUnavailable(RuntimeError):
+    """pyarrow is not installed"""
+
+
+def schema():
+    if pa is None:
+        raise ExportUnavailable("Columnar export needs pyarrow: pip install pyarrow")
+    return pa.schema([
+        (name, pa.timestamp("us") if type_name == "timestamp[us]" else pa.type_for_alias(type_name))
+        for name, type_name in COLUMNS
+    ])
+
+
+def snapshot_query():
+    """Every party-product link joined with its product and its party's primary address"""
+    primary = (
+        select(PartyAddress.party_id, func.min(PartyAddress.address_id).label("address_id"))
+        .where(PartyAddress.is_primary == True)
+        .group_by(PartyAddress.party_id)
+        .subquery()
+    )
+    return (
+        select(
+            PartyProducts.party_product_id, PartyProducts.party_id,
+            PartyMaster.party_code, PartyMaster.party_name,
+            PartyAddress.city, PartyAddress.state, PartyAddress.zip_code,
+            PartyProducts.product_id, Products.product_code, Products.product_name,
+            Products.group_name, Products.sub_group, Products.item, Products.stock_keeping_unit,
+            PartyProducts.quantity, PartyProducts.created_at,
+        )
+        .join(PartyMaster, PartyMaster.party_id == PartyProducts.party_id)
+        .join(Products, Products.product_id == PartyProducts.product_id)
+        .outerjoin(primary, primary.c.party_id == PartyProducts.party_id)
+        .outerjoin(PartyAddress, PartyAddress.address_id == primary.c.address_id)
+        .order_by(PartyProducts.party_product_id)
+    )
+
+
+def record_batches(db, batch_size=None):
+    """Yield the snapshot as Arrow record batches.
+
+    The whole export is one statement streamed with a server-side cursor, so
+    it reads a single consistent snapshot. The driver still returns rows of
+    Python objects: each fetched partition is transposed into one list per
+    column, which Arrow converts into an array a column at a time.
+    """
+    arrow_schema = schema()
+    result = db.execute(snapshot_query().execution_options(yield_per=batch_size or settings.BI_EXPORT_BATCH_SIZE))
+    for rows in result.partitions():
+        columns = zip(*rows)
+        yield pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, arrow_schema)],
+            schema=arrow_schema
+        )
+
+
+def _writer(sink, fmt, arrow_schema):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, arrow_schema, compression=settings.BI_EXPORT_COMPRESSION)
+    options = pa.ipc.IpcWriteOptions(compression=settings.BI_EXPORT_IPC_COMPRESSION or None)
+    return pa.ipc.new_file(sink, arrow_schema, options=options)
+
+
+def write_snapshot(sink, fmt, progress=None):
+    """Write the snapshot to a path or binary file object; returns the row count.
+
+    ``progress(rows)`` is called after every batch and may raise to stop.
+    """
+    arrow_schema = schema()
+    rows = 0
+    with SessionLocal() as db:
+        writer = _writer(sink, fmt, arrow_schema)
+        try:
+            for batch in record_batches(db):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+                if progress:
+                    progress(rows)
+        finally:
+            writer.close()
+    return rows
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are taken out chunk by chunk"""
+
+    def __init__(self):
+        self._chunks = []
+        self.closed = False
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_snapshot(fmt, tenant=None):
+    """Yield the encoded snapshot of a tenant piece by piece, for a streaming response"""
+    arrow_schema = schema()
+    sink = _ChunkSink()
+    with SessionLocal(tenant=tenant) as db:
+        writer = _writer(pa.PythonFile(sink, mode="w"), fmt, arrow_schema)
+        try:
+            for batch in record_batches(db):
+                writer.write_batch(batch)
+                yield sink.take()
+        finally:
+            # Also when the client goes away (GeneratorExit) or the query fails
+            writer.close()
+    yield sink.take()
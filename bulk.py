@@ -0,0 +1,164 @@
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, exists, func
+
+from models import (
+    PartyMaster, PartyAddress, ContactPerson, PartyAccountDetails, BankDetails, PartyProducts, PartyPaymentTerms,
+)
+from config import settings
+import change_feed
+import dialect
+import audit
+
+
+def party_filter_clause(party_filter):
+    """Build the WHERE clause selecting the parties matched by a ``PartyFilter``"""
+    conditions = []
+    if party_filter.search:
+        conditions.append(
+            dialect.contains(PartyMaster.party_name, party_filter.search) |
+            dialect.contains(PartyMaster.party_code, party_filter.search) |
+            dialect.contains(PartyMaster.gst_number, party_filter.search)
+        )
+    if party_filter.type_of_firm:
+        conditions.append(func.lower(PartyMaster.type_of_firm) == party_filter.type_of_firm.lower())
+    if party_filter.state or party_filter.city:
+        address_conditions = [PartyAddress.party_id == PartyMaster.party_id]
+        if party_filter.state:
+            address_conditions.append(func.lower(PartyAddress.state) == party_filter.state.lower())
+        if party_filter.city:
+            address_conditions.append(func.lower(PartyAddress.city) == party_filter.city.lower())
+        conditions.append(exists(PartyAddress.party_id).where(*address_conditions))
+    return conditions
+
+
+def chunked_party_ids(db, party_ids=None, party_filter=None, chunk_size=1000):
+    """Yield the targeted party ids in ascending chunks.
+
+    Explicit ids are split as given; a filter is paged by keyset so each chunk
+    is one indexed range scan even while earlier chunks are being changed.
+    """
+    if party_ids is not None:
+        ordered = sorted(set(party_ids))
+        for start in range(0, len(ordered), chunk_size):
+            yield ordered[start:start + chunk_size]
+        return
+
+    conditions = party_filter_clause(party_filter)
+    last_id = 0
+    while True:
+        chunk = db.execute(
+            select(PartyMaster.party_id)
+            .where(PartyMaster.party_id > last_id, *conditions)
+            .order_by(PartyMaster.party_id)
+            .limit(chunk_size)
+        ).scalars().all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+# Child rows the database deletes with their party through ON DELETE CASCADE
+CASCADED_CHILDREN = (
+    (change_feed.ADDRESS, PartyAddress),
+    (change_feed.CONTACT, ContactPerson),
+    (change_feed.ACCOUNT_DETAILS, PartyAccountDetails),
+    (change_feed.BANK_DETAILS, BankDetails),
+    (change_feed.PARTY_PRODUCT, PartyProducts),
+    (change_feed.PARTY_PAYMENT_TERM, PartyPaymentTerms),
+)
+
+
+def cascaded_children(db, party_ids):
+    """``(entity, entity_id, party_id, row)`` of every child row deleted with ``party_ids``.
+
+    Full rows are only read for audited entities, which keep a before image.
+    """
+    children = []
+    for entity, model in CASCADED_CHILDREN:
+        key = model.__mapper__.primary_key[0].name
+        if settings.AUDIT_ENABLED and entity in audit.AUDITED:
+            columns = [getattr(model, column.key) for column in model.__table__.c]
+        else:
+            columns = [getattr(model, key), model.party_id]
+        rows = db.execute(select(*columns).where(model.party_id.in_(party_ids)).order_by(getattr(model, key))).mappings()
+        children.extend((entity, row[key], row["party_id"], dict(row)) for row in rows)
+    return children
+
+
+def delete_parties(db, party_ids):
+    """Delete parties with one statement; the database cascades to their children.
+
+    Each cascaded child still gets its own tombstone in the change feed (and
+    audit trail), read just before the delete, so feed consumers drop them
+    without having to know the cascade rules.
+    """
+    children = cascaded_children(db, party_ids)
+    deleted = db.execute(
+        delete(PartyMaster)
+        .where(PartyMaster.party_id.in_(party_ids))
+        .returning(*PartyMaster.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).mappings().all()
+    deleted_ids = {row["party_id"] for row in deleted}
+    children = [child for child in children if child[2] in deleted_ids]
+    change_feed.record_changes(db, [
+        (entity, change_feed.DELETE, entity_id, party_id, None) for entity, entity_id, party_id, _ in children
+    ] + [
+        (change_feed.PARTY, change_feed.DELETE, row["party_id"], row["party_id"], None) for row in deleted
+    ])
+    for entity, entity_id, party_id, row in children:
+        audit.record(db, entity, change_feed.DELETE, entity_id, party_id, before=row)
+    for row in deleted:
+        audit.record(db, change_feed.PARTY, change_feed.DELETE, row["party_id"], row["party_id"], before=dict(row))
+    return [row["party_id"] for row in deleted]
+
+
+def bulk_delete_parties(db, party_ids=None, party_filter=None, chunk_size=1000):
+    """Delete the targeted parties chunk by chunk, committing after each chunk"""
+    total = 0
+    for chunk in chunked_party_ids(db, party_ids, party_filter, chunk_size):
+        total += len(delete_parties(db, chunk))
+        db.commit()
+    return total
+
+
+def update_parties(db, party_ids, values):
+    """Apply the same column values to many parties with one UPDATE"""
+    before = {}
+    if settings.AUDIT_ENABLED:
+        before = {
+            row["party_id"]: dict(row)
+            for row in db.execute(
+                # ORM attributes rather than table columns, so the select is tenant scoped
+                select(*[getattr(PartyMaster, column.key) for column in PartyMaster.__table__.c])
+                .where(PartyMaster.party_id.in_(party_ids))
+            ).mappings()
+        }
+    
+    updated = db.execute(
+        update(PartyMaster)
+        .where(PartyMaster.party_id.in_(party_ids))
+        .values(**values, updated_at=datetime.utcnow(), version=PartyMaster.version + 1)
+        .returning(*PartyMaster.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).mappings().all()
+    change_feed.record_changes(db, [
+        (change_feed.PARTY, change_feed.UPDATE, row["party_id"], row["party_id"], dict(row)) for row in updated
+    ])
+    for row in updated:
+        audit.record(
+            db, change_feed.PARTY, change_feed.UPDATE, row["party_id"], row["party_id"],
+            before=before.get(row["party_id"]), after=dict(row)
+        )
+    return len(updated)
+
+
+def bulk_update_parties(db, values, party_ids=None, party_filter=None, chunk_size=1000):
+    """Update the targeted parties chunk by chunk, committing after each chunk"""
+    total = 0
+    for chunk in chunked_party_ids(db, party_ids, party_filter, chunk_size):
+        total += update_parties(db, chunk, values)
+        db.commit()
+    return total
@@ -0,0 +1,168 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect, insert, delete, select, func
+from sqlalchemy.orm import Session
+
+from models import ChangeLog
+from config import settings
+
+# Entity names used in the change log
+PARTY = "party"
+ADDRESS = "address"
+CONTACT = "contact"
+ACCOUNT_DETAILS = "account_details"
+BANK_DETAILS = "bank_details"
+PRODUCT = "product"
+PARTY_PRODUCT = "party_product"
+PAYMENT_TERM = "payment_term"
+PARTY_PAYMENT_TERM = "party_payment_term"
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+
+# Columns of a change kept on the session until it commits
+PENDING_COLUMNS = (
+    ChangeLog.change_id,
+    ChangeLog.entity,
+    ChangeLog.entity_id,
+    ChangeLog.party_id,
+    ChangeLog.operation,
+    ChangeLog.payload,
+    ChangeLog.tenant_id,
+)
+
+
+def pending_changes(db):
+    """Changes written by the session's current transaction, as column tuples"""
+    return db.info.setdefault("pending_changes", [])
+
+
+def snapshot(obj):
+    """Return the column values of an ORM object as a plain dictionary"""
+    mapper = inspect(obj).mapper
+    return {attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs}
+
+
+def _encode(data):
+    if data is None:
+        return None
+    return json.dumps(data, default=str)
+
+
+def record_change(db, entity, operation, entity_id, party_id=None, data=None):
+    """Append a change to the log inside the caller's transaction.
+
+    The row is written when the caller commits (see ``_write_changes``) and
+    only visible to readers once it has, so a rolled back write never shows
+    up in the feed.
+    """
+    record_changes(db, [(entity, operation, entity_id, party_id, data)])
+
+
+def record_object(db, entity, operation, obj, entity_id, party_id=None):
+    """Record a change for an ORM object, snapshotting it unless it was deleted"""
+    data = None if operation == DELETE else snapshot(obj)
+    record_change(db, entity, operation, entity_id, party_id=party_id, data=data)
+
+
+def record_changes(db, changes):
+    """Append many changes, written with one multi-row INSERT when the caller commits.
+
+    ``changes`` is an iterable of ``(entity, operation, entity_id, party_id, data)``
+    tuples.
+    """
+    db.info.setdefault("unwritten_changes", []).extend(
+        {
+            "entity": entity,
+            "entity_id": entity_id,
+            "party_id": party_id,
+            "operation": operation,
+            "payload": _encode(data),
+            "tenant_id": db.tenant,
+        }
+        for entity, operation, entity_id, party_id, data in changes
+    )
+
+
+@event.listens_for(Session, "before_commit")
+def _write_changes(session):
+    # Change ids come from a sequence handed out at insert time. Inserting the
+    # rows right before COMMIT keeps ids in commit order however long the
+    # transaction ran; only the INSERT and the COMMIT itself can interleave
+    values = session.info.pop("unwritten_changes", None)
+    if not values:
+        return
+    session.flush()
+    now = datetime.utcnow()
+    result = session.execute(insert(ChangeLog).returning(*PENDING_COLUMNS), [{**row, "created_at": now} for row in values])
+    pending_changes(session).extend(tuple(row) for row in result)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("unwritten_changes", None)
+
+
+def read_changes(db, since=0, limit=None, entity=None):
+    """Read one page of changes after the ``since`` cursor, in commit order.
+
+    Change rows are inserted just before their transaction commits, so ids
+    follow commit order except between that INSERT and the COMMIT, where a
+    concurrent transaction can commit a higher id first. Rows younger than
+    CHANGE_FEED_SETTLE_SECONDS are held back to cover that interval; a reader
+    would otherwise move its cursor past the lower id for good.
+    """
+    page_size = min(limit or settings.CHANGE_FEED_PAGE_SIZE, settings.CHANGE_FEED_MAX_PAGE_SIZE)
+    settled_before = datetime.utcnow() - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+
+    query = select(ChangeLog).where(
+        ChangeLog.change_id > since,
+        ChangeLog.created_at <= settled_before
+    )
+    if entity:
+        query = query.where(ChangeLog.entity == entity)
+
+    rows = db.execute(query.order_by(ChangeLog.change_id).limit(page_size + 1)).scalars().all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = rows[-1].change_id if rows else since
+
+    changes = [
+        {
+            "change_id": row.change_id,
+            "entity": row.entity,
+            "entity_id": row.entity_id,
+            "party_id": row.party_id,
+            "operation": row.operation,
+            "data": json.loads(row.payload) if row.payload else None,
+            "created_at": row.created_at,
+        }
+        for row in rows
+    ]
+    return {"changes": changes, "next_cursor": next_cursor, "has_more": has_more}
+
+
+def compact_changes(db, retention_days=None):
+    """Drop superseded entries older than the retention window.
+
+    For every entity only the newest entry is kept once it falls outside the
+    window, so a consumer replaying from any cursor still converges on the
+    current state (including deletes) without reading every intermediate
+    update.
+    """
+    if retention_days is None:
+        retention_days = settings.CHANGE_FEED_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    latest = select(func.max(ChangeLog.change_id)).group_by(ChangeLog.entity, ChangeLog.entity_id)
+    result = db.execute(
+        delete(ChangeLog).where(
+            ChangeLog.created_at < cutoff,
+            ChangeLog.change_id.not_in(latest)
+        )
+    )
+    db.commit()
+    return result.rowcount
@@ -1,52 +1,267 @@
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file if it exists
-load_dotenv()
-
-class Settings:
-    # Database Configuration
-    DATABASE_HOST = os.getenv("DATABASE_HOST", "dpg-d2g31b75r7bs73eiedhg-a.oregon-postgres.render.com")
-    DATABASE_PORT = os.getenv("DATABASE_PORT", "5432")
-    DATABASE_NAME = os.getenv("DATABASE_NAME", "netage_testing")
-    DATABASE_USER = os.getenv("DATABASE_USER", "netage_testing_user")
-    DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD", "AxnL2z8PiJWfOn6YEmj4TxGum0qn37ry")
-    
-    # Construct DATABASE_URL
-    DATABASE_URL = f"postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
-    
-    # Application Configuration
-    DEBUG = os.getenv("DEBUG", "True").lower() == "true"
-    HOST = os.getenv("HOST", "0.0.0.0")
-    PORT = int(os.getenv("PORT", "8000"))
-    SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
-    
-    # API Configuration
-    API_TITLE = "NETAGE BI - Party Master API"
-    API_DESCRIPTION = "Complete Party Master management system for NETAGE BI"
-    API_VERSION = "1.0.0"
-    
-    # CORS Configuration
-    CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
-    
-    # Logging Configuration
-    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-    
-    @classmethod
-    def get_database_url(cls):
-        """Get the database URL for SQLAlchemy"""
-        return cls.DATABASE_URL
-    
-    @classmethod
-    def get_database_config(cls):
-        """Get database configuration as a dictionary"""
-        return {
-            "host": cls.DATABASE_HOST,
-            "port": cls.DATABASE_PORT,
-            "database": cls.DATABASE_NAME,
-            "user": cls.DATABASE_USER,
-            "password": cls.DATABASE_PASSWORD
-        }
-
-# Create a settings instance
-settings = Settings()
+import hmac
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file if it exists
+load_dotenv()
+
+class Settings:
+    # Database Configuration
+    DATABASE_HOST = os.getenv("DATABASE_HOST", "dpg-d2g31b75r7bs73eiedhg-a.oregon-postgres.render.com")
+    DATABASE_PORT = os.getenv("DATABASE_PORT", "5432")
+    DATABASE_NAME = os.getenv("DATABASE_NAME", "netage_testing")
+    DATABASE_USER = os.getenv("DATABASE_USER", "netage_testing_user")
+    DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD", "AxnL2z8PiJWfOn6YEmj4TxGum0qn37ry")
+    # "postgresql" uses psycopg2, "postgresql+psycopg" uses psycopg 3
+    DATABASE_DRIVER = os.getenv("DATABASE_DRIVER", "postgresql")
+    
+    # Construct DATABASE_URL unless it is given in full (e.g. "sqlite:///./netage.db")
+    DATABASE_URL = os.getenv("DATABASE_URL") or f"{DATABASE_DRIVER}://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
+    
+    # Server-side prepared statements (psycopg 3 driver, "postgresql+psycopg://" URLs only):
+    # statements are prepared after running this many times on a connection, empty turns it off
+    DATABASE_PREPARE_THRESHOLD = os.getenv("DATABASE_PREPARE_THRESHOLD", "5")
+    
+    # SQLite Configuration (only used with sqlite:// URLs)
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+    
+    # Application Configuration
+    DEBUG = os.getenv("DEBUG", "True").lower() == "true"
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8000"))
+    SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
+    
+    # API Configuration
+    API_TITLE = "NETAGE BI - Party Master API"
+    API_DESCRIPTION = "Complete Party Master management system for NETAGE BI"
+    API_VERSION = "1.0.0"
+    
+    # CORS Configuration
+    CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
+    
+    # Logging Configuration
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    
+    # Admin Configuration (admin endpoints are open in DEBUG mode when no token is set)
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    
+    # Change Feed Configuration
+    CHANGE_FEED_PAGE_SIZE = int(os.getenv("CHANGE_FEED_PAGE_SIZE", "500"))
+    CHANGE_FEED_MAX_PAGE_SIZE = int(os.getenv("CHANGE_FEED_MAX_PAGE_SIZE", "5000"))
+    CHANGE_FEED_SETTLE_SECONDS = int(os.getenv("CHANGE_FEED_SETTLE_SECONDS", "2"))
+    CHANGE_FEED_RETENTION_DAYS = int(os.getenv("CHANGE_FEED_RETENTION_DAYS", "30"))
+    
+    # Audit Configuration
+    AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "True").lower() == "true"
+    AUDIT_ACTOR_HEADER = os.getenv("AUDIT_ACTOR_HEADER", "X-User")
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+    AUDIT_MAX_PENDING = int(os.getenv("AUDIT_MAX_PENDING", "10000"))
+    AUDIT_PAGE_SIZE = int(os.getenv("AUDIT_PAGE_SIZE", "100"))
+    AUDIT_MAX_PAGE_SIZE = int(os.getenv("AUDIT_MAX_PAGE_SIZE", "1000"))
+    
+    # Event Stream Configuration
+    EVENT_BROKER = os.getenv("EVENT_BROKER", "local")
+    EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+    EVENT_REPLAY_BUFFER = int(os.getenv("EVENT_REPLAY_BUFFER", "10000"))
+    EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+    EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "0.5"))
+    EVENT_RETRY_MS = int(os.getenv("EVENT_RETRY_MS", "3000"))
+    
+    # Background Job Configuration
+    JOB_OUTPUT_DIR = os.getenv("JOB_OUTPUT_DIR", "job_output")
+    JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "500"))
+    JOB_DEFAULT_CONCURRENCY = int(os.getenv("JOB_DEFAULT_CONCURRENCY", "2"))
+    JOB_CONCURRENCY = os.getenv("JOB_CONCURRENCY", "")  # e.g. "import_parties=1,export_parties=2"
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+    
+    # Query Guard Configuration (off / log / raise)
+    QUERY_GUARD = os.getenv("QUERY_GUARD", "off").lower()
+    QUERY_GUARD_REPEAT_THRESHOLD = int(os.getenv("QUERY_GUARD_REPEAT_THRESHOLD", "3"))
+    
+    # Slow Query Log Configuration
+    SLOW_QUERY_ENABLED = os.getenv("SLOW_QUERY_ENABLED", "True").lower() == "true"
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+    SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+    SLOW_QUERY_MAX_STATEMENTS = int(os.getenv("SLOW_QUERY_MAX_STATEMENTS", "500"))
+    SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+    
+    # Profiling Configuration
+    PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "True").lower() == "true"
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+    
+    # Admission Control Configuration
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "True").lower() == "true"
+    ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "read=64,write=16,bulk=2")
+    ADMISSION_QUEUES = os.getenv("ADMISSION_QUEUES", "read=128,write=32,bulk=4")
+    ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+    ADMISSION_MAX_POOL_WAIT_MS = int(os.getenv("ADMISSION_MAX_POOL_WAIT_MS", "500"))
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+    
+    # Bulk Operation Configuration
+    BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+    
+    # Billing Configuration
+    BILLING_MAX_INVOICES = int(os.getenv("BILLING_MAX_INVOICES", "200000"))
+    
+    # Identifier Validation Configuration
+    VALIDATION_MAX_RECORDS = int(os.getenv("VALIDATION_MAX_RECORDS", "100000"))
+    IFSC_BANK_CODES_FILE = os.getenv("IFSC_BANK_CODES_FILE", "")  # "code,name" CSV; unknown bank codes are rejected when set
+    
+    # PIN Code Gazetteer Configuration
+    GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "")  # file built with "python gazetteer.py pincodes.csv pincodes.gaz"
+    GAZETTEER_NORMALIZE = os.getenv("GAZETTEER_NORMALIZE", "False").lower() == "true"
+    GAZETTEER_REJECT_UNKNOWN = os.getenv("GAZETTEER_REJECT_UNKNOWN", "False").lower() == "true"
+    
+    # Batch Configuration
+    BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+    
+    # Snapshot Configuration (python snapshot.py create|restore DIR)
+    SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "4"))
+    SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "500000"))
+    SNAPSHOT_COMPRESSION_LEVEL = int(os.getenv("SNAPSHOT_COMPRESSION_LEVEL", "1"))  # gzip, 1 (fastest) to 9
+    
+    # Tenant Configuration (see tenancy.py)
+    DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")  # tenant of requests without TENANT_HEADER
+    TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant-ID")
+    TENANTS = os.getenv("TENANTS", "")  # other tenants kept in the main database, "acme,globex"
+    TENANT_DATABASES = os.getenv("TENANT_DATABASES", "")  # "bigco=postgresql://...,acme=schema:acme"
+    TENANT_POOL_SIZE = int(os.getenv("TENANT_POOL_SIZE", "5"))
+    TENANT_MAX_OVERFLOW = int(os.getenv("TENANT_MAX_OVERFLOW", "5"))
+    TENANT_POOL_TIMEOUT = int(os.getenv("TENANT_POOL_TIMEOUT", "10"))
+    
+    # Credit Check Configuration
+    CREDIT_MAX_CHECKS = int(os.getenv("CREDIT_MAX_CHECKS", "100000"))
+    CREDIT_MERGE_THRESHOLD = int(os.getenv("CREDIT_MERGE_THRESHOLD", "10000"))
+    CREDIT_RELOAD_SECONDS = int(os.getenv("CREDIT_RELOAD_SECONDS", "300"))
+    
+    # BI Export Configuration (needs pyarrow)
+    BI_EXPORT_BATCH_SIZE = int(os.getenv("BI_EXPORT_BATCH_SIZE", "50000"))
+    BI_EXPORT_COMPRESSION = os.getenv("BI_EXPORT_COMPRESSION", "zstd")  # Parquet codec
+    BI_EXPORT_IPC_COMPRESSION = os.getenv("BI_EXPORT_IPC_COMPRESSION", "")  # Arrow files: "", "zstd" or "lz4"
+    
+    # Product Facet Configuration
+    FACET_CACHE_SIZE = int(os.getenv("FACET_CACHE_SIZE", "256"))
+    FACET_CACHE_TTL = int(os.getenv("FACET_CACHE_TTL", "300"))
+    FACET_PAGE_SIZE = int(os.getenv("FACET_PAGE_SIZE", "50"))
+    FACET_MAX_PAGE_SIZE = int(os.getenv("FACET_MAX_PAGE_SIZE", "500"))
+    
+    # Typeahead Configuration
+    TYPEAHEAD_ENABLED = os.getenv("TYPEAHEAD_ENABLED", "True").lower() == "true"
+    TYPEAHEAD_LIMIT = int(os.getenv("TYPEAHEAD_LIMIT", "10"))
+    TYPEAHEAD_MAX_LIMIT = int(os.getenv("TYPEAHEAD_MAX_LIMIT", "50"))
+    TYPEAHEAD_MAX_WORDS = int(os.getenv("TYPEAHEAD_MAX_WORDS", "4"))
+    TYPEAHEAD_MERGE_THRESHOLD = int(os.getenv("TYPEAHEAD_MERGE_THRESHOLD", "20000"))
+    
+    # Party Code Configuration (block size must not change once codes have been issued)
+    PARTY_CODE_PREFIX = os.getenv("PARTY_CODE_PREFIX", "SNET")
+    PARTY_CODE_START = int(os.getenv("PARTY_CODE_START", "1000000"))
+    PARTY_CODE_BLOCK_SIZE = int(os.getenv("PARTY_CODE_BLOCK_SIZE", "100"))
+    
+    # Party Version Configuration
+    PARTY_REQUIRE_VERSION = os.getenv("PARTY_REQUIRE_VERSION", "False").lower() == "true"  # 428 for updates without If-Match or version
+    
+    @classmethod
+    def get_database_url(cls):
+        """Get the database URL for SQLAlchemy"""
+        return cls.DATABASE_URL
+    
+    @classmethod
+    def is_sqlite(cls):
+        return cls.get_database_url().startswith("sqlite")
+    
+    @classmethod
+    def get_engine_options(cls, url=None):
+        """Get driver specific keyword arguments for create_engine"""
+        url = url or cls.get_database_url()
+        if url.startswith("postgresql+psycopg://"):
+            threshold = cls.DATABASE_PREPARE_THRESHOLD
+            return {"connect_args": {"prepare_threshold": int(threshold) if threshold != "" else None}}
+        if url.startswith("sqlite"):
+            # Requests, job workers and the audit writer share connections across threads
+            options = {"connect_args": {"check_same_thread": False, "timeout": cls.SQLITE_BUSY_TIMEOUT_MS / 1000}}
+            if url in ("sqlite://", "sqlite:///:memory:"):
+                from sqlalchemy.pool import StaticPool
+                # Every connection to :memory: is a separate, empty database
+                options["poolclass"] = StaticPool
+            return options
+        return {}
+    
+    @classmethod
+    def get_sqlite_pragmas(cls):
+        """PRAGMA statements run on every new SQLite connection"""
+        return [
+            f"journal_mode={cls.SQLITE_JOURNAL_MODE}",
+            f"synchronous={cls.SQLITE_SYNCHRONOUS}",
+            f"busy_timeout={cls.SQLITE_BUSY_TIMEOUT_MS}",
+            f"cache_size=-{cls.SQLITE_CACHE_SIZE_KB}",
+            f"mmap_size={cls.SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+            "temp_store=MEMORY",
+            # Party deletes rely on ON DELETE CASCADE, which SQLite ignores by default
+            "foreign_keys=ON",
+        ]
+    
+    @classmethod
+    def get_database_config(cls):
+        """Get database configuration as a dictionary"""
+        return {
+            "host": cls.DATABASE_HOST,
+            "port": cls.DATABASE_PORT,
+            "database": cls.DATABASE_NAME,
+            "user": cls.DATABASE_USER,
+            "password": cls.DATABASE_PASSWORD
+        }
+    
+    @classmethod
+    def get_job_concurrency(cls, job_type):
+        """Get the maximum number of concurrently running jobs of a type"""
+        for entry in cls.JOB_CONCURRENCY.split(","):
+            name, _, limit = entry.partition("=")
+            if name.strip() == job_type and limit.strip():
+                return int(limit)
+        return cls.JOB_DEFAULT_CONCURRENCY
+    
+    @classmethod
+    def get_tenant_databases(cls):
+        """Get the tenants with their own database URL or "schema:<name>" from TENANT_DATABASES"""
+        databases = {}
+        for entry in cls.TENANT_DATABASES.split(","):
+            tenant, _, target = entry.partition("=")
+            if tenant.strip() and target.strip():
+                databases[tenant.strip()] = target.strip()
+        return databases
+    
+    @classmethod
+    def get_tenants(cls):
+        """Get every known tenant, the default one first"""
+        tenants = [cls.DEFAULT_TENANT]
+        for tenant in [*cls.TENANTS.split(","), *cls.get_tenant_databases()]:
+            if tenant.strip() and tenant.strip() not in tenants:
+                tenants.append(tenant.strip())
+        return tenants
+    
+    @classmethod
+    def get_admission_setting(cls, spec, route_class):
+        """Get the value for a route class from a "read=64,write=16,bulk=2" style setting"""
+        for entry in spec.split(","):
+            name, _, value = entry.partition("=")
+            if name.strip() == route_class and value.strip():
+                return int(value)
+        raise ValueError(f"No admission setting for route class '{route_class}' in '{spec}'")
+    
+    @classmethod
+    def check_admin_token(cls, token):
+        """Check a token supplied by a client against ADMIN_TOKEN"""
+        if not cls.ADMIN_TOKEN:
+            return cls.DEBUG
+        return token is not None and hmac.compare_digest(token, cls.ADMIN_TOKEN)
+
+# Create a settings instance
+settings = Settings()
@@ -0,0 +1,29 @@
+"""Runs test_api.py under pytest against the app in this process (see use_in_process_app)"""
+import pytest
+
+import test_api
+
+
+@pytest.fixture(scope="session", autouse=True)
+def in_process_app():
+    test_api.use_in_process_app()
+    yield
+    test_api.stop_in_process_app()
+
+
+@pytest.fixture(scope="session")
+def party_id(in_process_app):
+    # test_create_party uses a fixed party code, so reuse its party once it exists
+    response = test_api.requests.get(f"{test_api.BASE_URL}/parties/?search=SNET345")
+    parties = response.json() if response.status_code == 200 else []
+    return parties[0]["party_id"] if parties else test_api.test_create_party()
+
+
+@pytest.fixture(autouse=True)
+def fail_on_reported_errors(capsys):
+    """The tests report problems by printing ❌ lines rather than asserting"""
+    yield
+    output = capsys.readouterr().out
+    print(output, end="")
+    failures = [line for line in output.splitlines() if "❌" in line]
+    assert not failures, "\n".join(failures)
@@ -0,0 +1,231 @@
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from sqlalchemy import select
+
+from config import settings
+from models import SessionLocal, PartyMaster
+import change_feed
+import events
+import tenancy
+
+_NO_DAYS = -1  # stands in for a NULL credit_days
+
+# Denial reasons, one bit each in the per-row reason mask
+UNKNOWN_PARTY = "unknown_party"
+CREDIT_LIMIT_EXCEEDED = "credit_limit_exceeded"
+CREDIT_DAYS_EXCEEDED = "credit_days_exceeded"
+REASONS = (UNKNOWN_PARTY, CREDIT_LIMIT_EXCEEDED, CREDIT_DAYS_EXCEEDED)
+
+# Reason list for every combination of bits, shared between rows
+_REASON_LISTS = [
+    [reason for bit, reason in enumerate(REASONS) if mask & (1 << bit)]
+    for mask in range(1 << len(REASONS))
+]
+
+
+def _paise(value):
+    return None if value is None else int((Decimal(str(value)) * 100).to_integral_value())
+
+
+def _limits(parties):
+    """party_id, credit limit in paise (0 if none), has-limit and credit days arrays"""
+    ids = np.array([party[0] for party in parties], dtype=np.int64)
+    limits = [party[1] for party in parties]
+    return {
+        "party_ids": ids,
+        "limits": np.array([limit or 0 for limit in limits], dtype=np.int64),
+        "has_limit": np.array([limit is not None for limit in limits], dtype=bool),
+        "days": np.array([_NO_DAYS if party[2] is None else party[2] for party in parties], dtype=np.int64),
+    }
+
+
+class CreditTable:
+    """Every party's credit limit and credit days as sorted NumPy arrays.
+
+    A batch of checks is matched with one ``searchsorted``. Committed party
+    inserts, updates and deletes arrive from the event broker and go into a
+    small overlay that is looked up the same way and folded into the main
+    arrays once it grows past CREDIT_MERGE_THRESHOLD parties, so a credit
+    change is visible to the next check without reloading the table. With
+    the local event broker, changes made by other workers are picked up when
+    the table is reloaded after CREDIT_RELOAD_SECONDS. A reload reads the
+    table without holding the lock, so checks keep using the old arrays and
+    committing writers are not held up; changes that arrive meanwhile stay in
+    the overlay.
+    """
+
+    def __init__(self, tenant=None, merge_threshold=None, reload_seconds=None):
+        self.tenant = tenant
+        self.merge_threshold = merge_threshold or settings.CREDIT_MERGE_THRESHOLD
+        self.reload_seconds = settings.CREDIT_RELOAD_SECONDS if reload_seconds is None else reload_seconds
+        self._main = None
+        self._loaded_at = 0.0
+        self._pending = {}  # party_id -> (limit in paise or None, credit days) or None once deleted
+        self._overlay = None
+        self._during_load = None  # changes that arrived while a reload was reading
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def apply_events(self, batch):
+        """Follow committed party changes (an event broker listener)"""
+        changes = {}
+        for event in batch:
+            if event.entity != change_feed.PARTY:
+                continue
+            if event.operation == change_feed.DELETE:
+                changes[event.entity_id] = None
+            elif event.data and "credit_limit" in event.data:
+                changes[event.entity_id] = (_paise(event.data["credit_limit"]), event.data.get("credit_days"))
+        if changes:
+            with self._lock:
+                # Kept even before the first load; replaying a change the load already saw is harmless
+                self._pending.update(changes)
+                if self._during_load is not None:
+                    self._during_load.update(changes)
+                self._overlay = None
+
+    def _stale(self):
+        return self._main is None or time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def _reload(self):
+        # Only the first load is waited for; later ones leave checks on the old arrays
+        if not self._load_lock.acquire(blocking=self._main is None):
+            return
+        try:
+            with self._lock:
+                if not self._stale():
+                    return
+                self._during_load = {}
+            try:
+                main = self._load()
+            except BaseException:
+                with self._lock:
+                    self._during_load = None
+                raise
+            with self._lock:
+                # Changes from before the load are in it; later ones may not be
+                self._main, self._loaded_at = main, time.monotonic()
+                self._pending, self._during_load, self._overlay = self._during_load, None, None
+        finally:
+            self._load_lock.release()
+
+    def get(self):
+        """(main, overlay) arrays; the overlay holds changes not yet folded into main"""
+        with self._lock:
+            stale = self._stale()
+        if stale:
+            self._reload()
+        with self._lock:
+            if len(self._pending) > self.merge_threshold:
+                self._main = self._merge(self._main, self._pending)
+                self._pending, self._overlay = {}, None
+            if self._overlay is None:
+                self._overlay = _limits(sorted(
+                    (party_id, *change) for party_id, change in self._pending.items() if change is not None
+                ))
+                self._overlay["removed"] = np.array(sorted(self._pending), dtype=np.int64)
+            return self._main, self._overlay
+
+    def _load(self):
+        with SessionLocal(tenant=self.tenant) as db:
+            rows = db.execute(
+                select(PartyMaster.party_id, PartyMaster.credit_limit, PartyMaster.credit_days)
+                .order_by(PartyMaster.party_id)
+                .execution_options(yield_per=50000)
+            )
+            return _limits([(party_id, _paise(limit), days) for party_id, limit, days in rows])
+
+    @staticmethod
+    def _merge(main, pending):
+        keep = ~np.isin(main["party_ids"], np.fromiter(pending, dtype=np.int64, count=len(pending)))
+        changed = _limits(sorted(
+            (party_id, *change) for party_id, change in pending.items() if change is not None
+        ))
+        merged = {name: np.concatenate([values[keep], changed[name]]) for name, values in main.items()}
+        order = np.argsort(merged["party_ids"], kind="stable")
+        return {name: values[order] for name, values in merged.items()}
+
+
+# One table per tenant, loaded on the tenant's first check
+tenant_tables = tenancy.PerTenant(CreditTable)
+events.broker.add_listener(tenant_tables.listener("apply_events"))
+
+
+def _lookup(party_ids, sorted_ids):
+    """Position of each party in non-empty ``sorted_ids`` and whether it is there"""
+    position = np.searchsorted(sorted_ids, party_ids)
+    position[position == len(sorted_ids)] = 0
+    return position, sorted_ids[position] == party_ids
+
+
+def party_limits(party_ids, tables=None):
+    """Known flag, credit limit (paise), has-limit flag and credit days for each party"""
+    main, overlay = tables or tenant_tables.get().get()
+    known = np.zeros(len(party_ids), dtype=bool)
+    limits = np.zeros(len(party_ids), dtype=np.int64)
+    has_limit = np.zeros(len(party_ids), dtype=bool)
+    days = np.full(len(party_ids), _NO_DAYS, dtype=np.int64)
+
+    # Parties changed since the last fold take their overlay row (or deletion) instead
+    for arrays, skip in ((main, overlay["removed"]), (overlay, None)):
+        if not len(arrays["party_ids"]):
+            continue
+        position, found = _lookup(party_ids, arrays["party_ids"])
+        if skip is not None and len(skip):
+            found &= ~_lookup(party_ids, skip)[1]
+        known |= found
+        limits = np.where(found, arrays["limits"][position], limits)
+        has_limit = np.where(found, arrays["has_limit"][position], has_limit)
+        days = np.where(found, arrays["days"][position], days)
+    return known, limits, has_limit, days
+
+
+def check_credit(party_ids, outstanding, order_amounts, oldest_due_dates, as_of=None, tables=None):
+    """Allow or deny each order against its party's credit limit and credit days.
+
+    An order is denied when:
+
+    - the party does not exist (``unknown_party``)
+    - outstanding + order amount is above ``credit_limit`` (``credit_limit_exceeded``);
+      parties without a credit limit are not limited
+    - the oldest due date is more than ``credit_days`` days before ``as_of``
+      (``credit_days_exceeded``); skipped without ``credit_days`` or a due date
+
+    Every check is whole-array NumPy arithmetic; money is compared in integer
+    paise. Returns a dict of equal-length lists in input order.
+    """
+    party_ids = np.asarray(party_ids, dtype=np.int64)
+    count = len(party_ids)
+    exposure = (
+        np.rint(np.asarray(outstanding, dtype=np.float64) * 100).astype(np.int64)
+        + np.rint(np.asarray(order_amounts, dtype=np.float64) * 100).astype(np.int64)
+    )
+    has_due = np.fromiter((due is not None for due in oldest_due_dates), dtype=bool, count=count)
+    due_ordinals = np.fromiter((due.toordinal() if due else 0 for due in oldest_due_dates), dtype=np.int64, count=count)
+
+    known, limits, has_limit, days = party_limits(party_ids, tables)
+    overdue_days = (as_of or date.today()).toordinal() - due_ordinals
+
+    over_limit = has_limit & (exposure > limits)
+    over_days = known & has_due & (days != _NO_DAYS) & (overdue_days > days)
+    reasons = (~known).astype(np.int64) | (over_limit.astype(np.int64) << 1) | (over_days.astype(np.int64) << 2)
+
+    available = ((limits - exposure) / 100).astype(object)
+    available[~has_limit] = None
+    credit_limit = (limits / 100).astype(object)
+    credit_limit[~has_limit] = None
+    overdue = np.maximum(overdue_days, 0).astype(object)
+    overdue[~has_due] = None
+
+    return {
+        "party_id": party_ids.tolist(),
+        "allowed": (reasons == 0).tolist(),
+        "reasons": [_REASON_LISTS[mask] for mask in reasons.tolist()],
+        "credit_limit": credit_limit.tolist(),
+        "available_credit": available.tolist(),
+        "overdue_days": overdue.tolist(),
+    }
@@ -0,0 +1,47 @@
+"""Statements that differ between PostgreSQL and SQLite."""
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import engine
+
+
+def name(db):
+    """Dialect name of the database a session or connection talks to"""
+    return db.get_bind().dialect.name if hasattr(db, "get_bind") else db.dialect.name
+
+
+def contains(column, term):
+    """Case-insensitive substring match.
+
+    PostgreSQL gets ILIKE. SQLite's LIKE is already case-insensitive for
+    ASCII, so the lower() calls SQLAlchemy wraps around ILIKE there are left
+    out.
+    """
+    if engine.dialect.name == "sqlite":
+        return column.like(f"%{term}%")
+    return column.ilike(f"%{term}%")
+
+
+def insert_ignore(db, model, rows, index_elements):
+    """Insert rows, skipping those that clash with a unique key, in one statement.
+
+    Uses INSERT ... ON CONFLICT DO NOTHING on PostgreSQL and SQLite; other
+    databases fall back to a plain INSERT of the rows not found first.
+    Returns the number of rows inserted.
+    """
+    if not rows:
+        return 0
+    dialect_name = name(db)
+    if dialect_name in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+        statement = dialect_insert(model).values(rows).on_conflict_do_nothing(index_elements=index_elements)
+        return db.execute(statement).rowcount
+
+    columns = [getattr(model, column) for column in index_elements]
+    new_rows = [
+        row for row in rows
+        if db.query(model).filter(*(column == row[column.key] for column in columns)).first() is None
+    ]
+    if new_rows:
+        db.execute(insert(model), new_rows)
+    return len(new_rows)
@@ -0,0 +1,384 @@
+import asyncio
+import importlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event as sa_event, or_, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import SessionLocal, ChangeLog, engines
+import change_feed
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# Change feed entities grouped into the topics clients subscribe to
+ENTITY_TOPICS = {
+    change_feed.PARTY: "parties",
+    change_feed.ADDRESS: "parties",
+    change_feed.CONTACT: "parties",
+    change_feed.ACCOUNT_DETAILS: "parties",
+    change_feed.BANK_DETAILS: "parties",
+    change_feed.PRODUCT: "products",
+    change_feed.PAYMENT_TERM: "payment-terms",
+    change_feed.PARTY_PRODUCT: "links",
+    change_feed.PARTY_PAYMENT_TERM: "links",
+}
+TOPICS = frozenset(ENTITY_TOPICS.values())
+
+
+@dataclass
+class Event:
+    id: int
+    topic: str
+    entity: str
+    entity_id: int
+    party_id: Optional[int]
+    operation: str
+    data: Optional[dict] = None
+    tenant_id: Optional[str] = None
+
+    @classmethod
+    def from_change(cls, change_id, entity, entity_id, party_id, operation, payload, tenant_id=None):
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        return cls(
+            id=change_id,
+            topic=ENTITY_TOPICS.get(entity, entity),
+            entity=entity,
+            entity_id=entity_id,
+            party_id=party_id,
+            operation=operation,
+            data=payload,
+            tenant_id=tenant_id
+        )
+
+    def to_sse(self, with_id=True):
+        body = json.dumps({
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "party_id": self.party_id,
+            "operation": self.operation,
+            "data": self.data,
+        }, default=str)
+        # Without an id line the client's Last-Event-ID stays where it was
+        id_line = f"id: {self.id}\n" if with_id else ""
+        return f"{id_line}event: {self.topic}\ndata: {body}\n\n"
+
+
+# Sentinel queued when a subscriber falls too far behind
+OVERFLOW = object()
+
+# Sent instead of a replay when events after the client's Last-Event-ID are no longer available
+RESET = "event: reset\ndata: {}\n\n"
+
+
+@dataclass(eq=False)
+class Subscription:
+    topics: frozenset
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue
+    tenant: Optional[str] = None
+    overflowed: bool = False
+
+    def wants(self, event):
+        return event.tenant_id == self.tenant and (not self.topics or event.topic in self.topics)
+
+    def deliver(self, event):
+        """Queue an event on the subscriber's loop, dropping it if it lags"""
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Never block the publisher on a slow client: cut it off and let it
+            # reconnect with Last-Event-ID to replay what it missed
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class EventBroker:
+    """Fans committed changes out to in-process subscribers.
+
+    Subclasses decide where events come from and how far back a
+    reconnecting client can replay.
+    """
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.EVENT_QUEUE_SIZE
+        self._subscriptions = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, topics=None, tenant=None):
+        subscription = Subscription(
+            topics=frozenset(topics or ()),
+            loop=asyncio.get_running_loop(),
+            queue=asyncio.Queue(self.queue_size),
+            tenant=tenant or tenancy.current()
+        )
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def add_listener(self, callback):
+        """Call ``callback(events)`` with every batch of events this broker dispatches.
+
+        Listeners run synchronously in the dispatching thread, so they must be
+        quick; in-memory caches use them to follow committed changes.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def publish(self, events):
+        """Hand over events committed by this process"""
+        raise NotImplementedError
+
+    def replay(self, last_event_id, topics=None, tenant=None):
+        """Return a tenant's events after ``last_event_id``, oldest first.
+
+        ``None`` means some of them can no longer be replayed, and the client
+        has to resync from the change feed.
+        """
+        raise NotImplementedError
+
+    def _dispatch(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(events)
+            except Exception:
+                logger.exception("Event listener %r failed", listener)
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.loop.is_closed():
+                    continue
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+
+
+class LocalBroker(EventBroker):
+    """Single-process broker that replays from a bounded in-memory buffer"""
+
+    def __init__(self, queue_size=None, buffer_size=None):
+        super().__init__(queue_size)
+        self._buffer = deque(maxlen=buffer_size or settings.EVENT_REPLAY_BUFFER)
+        self._evicted_through = 0  # newest event id pushed out of the buffer
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._evicted_through = max(self._evicted_through, self._buffer[0].id)
+                self._buffer.append(event)
+        self._dispatch(events)
+
+    def replay(self, last_event_id, topics=None, tenant=None):
+        tenant = tenant or tenancy.current()
+        with self._lock:
+            if last_event_id < self._evicted_through:
+                return None
+            buffered = list(self._buffer)
+        return [
+            event for event in buffered
+            if event.id > last_event_id and event.tenant_id == tenant and (not topics or event.topic in topics)
+        ]
+
+
+class ChangeLogBroker(EventBroker):
+    """Broker shared by several workers through the change_log table.
+
+    Local commits are not dispatched directly; every worker tails the change
+    log instead, so a change made by any worker reaches subscribers on all of
+    them, and replay after a reconnect reads straight from the table. The
+    main database's log is tailed for all the tenants in it, and the log of
+    each tenant with its own database or schema separately.
+
+    Change ids are handed out at insert time, so a slow transaction can
+    commit a lower id after a higher one was read. Ids skipped that way are
+    re-read on every poll until they are CHANGE_FEED_SETTLE_SECONDS old, the
+    window ``GET /changes`` waits out for the same reason.
+    """
+
+    def __init__(self, queue_size=None, poll_interval=None):
+        super().__init__(queue_size)
+        self.poll_interval = poll_interval or settings.EVENT_POLL_INTERVAL
+        self._last_seen = {}  # change log source (a session tenant) -> highest change id read
+        self._gaps = {}  # change log source -> {skipped change id: monotonic time it was noticed}
+        self._task = None
+
+    async def start(self):
+        for source in [tenancy.ALL_TENANTS, *engines.databases]:
+            await asyncio.to_thread(self.read_new, source)
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, events):
+        pass
+
+    def replay(self, last_event_id, topics=None, tenant=None):
+        events = self._read_after(tenant or tenancy.current(), last_event_id, settings.EVENT_REPLAY_BUFFER + 1, topics)
+        return events if len(events) <= settings.EVENT_REPLAY_BUFFER else None
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for source in list(self._last_seen):
+                events = await asyncio.to_thread(self.read_new, source)
+                if events:
+                    self._dispatch(events)
+
+    def read_new(self, source):
+        """Changes of ``source`` committed since the previous call, including late commits of skipped ids.
+
+        The first call only notes where the log ends.
+        """
+        if source not in self._last_seen:
+            self._last_seen[source] = self._latest_id(source)
+            self._gaps[source] = {}
+            return []
+
+        now = time.monotonic()
+        gaps = self._gaps[source]
+        for change_id, noticed in list(gaps.items()):
+            if now - noticed > settings.CHANGE_FEED_SETTLE_SECONDS:
+                del gaps[change_id]
+
+        last_seen = self._last_seen[source]
+        events = self._read_after(source, last_seen, settings.CHANGE_FEED_MAX_PAGE_SIZE, also=list(gaps))
+        read = {event.id for event in events}
+        for change_id in read:
+            gaps.pop(change_id, None)
+        newest = max(read, default=last_seen)
+        if newest > last_seen:
+            skipped = [change_id for change_id in range(last_seen + 1, newest) if change_id not in read]
+            if len(skipped) > settings.CHANGE_FEED_MAX_PAGE_SIZE:
+                # A jump this large is a sequence reset or restore, not transactions in flight
+                logger.warning("Not waiting for %d skipped change ids of %s", len(skipped), source)
+            else:
+                gaps.update((change_id, now) for change_id in skipped)
+            self._last_seen[source] = newest
+        return events
+
+    def _latest_id(self, source):
+        with SessionLocal(tenant=source) as db:
+            return db.execute(select(ChangeLog.change_id).order_by(ChangeLog.change_id.desc()).limit(1)).scalar() or 0
+
+    def _read_after(self, source, last_event_id, limit, topics=None, also=()):
+        """Change log rows after ``last_event_id`` (and the ids in ``also``) as events, oldest first"""
+        after = ChangeLog.change_id > last_event_id
+        query = select(ChangeLog).where(or_(after, ChangeLog.change_id.in_(also)) if also else after)
+        if topics:
+            entities = [entity for entity, topic in ENTITY_TOPICS.items() if topic in topics]
+            query = query.where(ChangeLog.entity.in_(entities))
+        with SessionLocal(tenant=source) as db:
+            rows = db.execute(query.order_by(ChangeLog.change_id).limit(limit)).scalars().all()
+            return [
+                Event.from_change(
+                    row.change_id, row.entity, row.entity_id, row.party_id, row.operation, row.payload, row.tenant_id
+                )
+                for row in rows
+            ]
+
+
+BROKERS = {
+    "local": LocalBroker,
+    "database": ChangeLogBroker,
+}
+
+
+def create_broker(name):
+    """Build a broker by registry name or ``module:ClassName`` path"""
+    if ":" in name:
+        module_name, class_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)()
+    return BROKERS[name]()
+
+
+broker = create_broker(settings.EVENT_BROKER)
+
+
+# Publish change log rows once the transaction that wrote them commits
+@sa_event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, ChangeLog):
+            change_feed.pending_changes(session).append((
+                obj.change_id, obj.entity, obj.entity_id, obj.party_id, obj.operation, obj.payload, obj.tenant_id
+            ))
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    changes = session.info.pop("pending_changes", None)
+    if changes:
+        events = sorted((Event.from_change(*change) for change in changes), key=lambda event: event.id)
+        broker.publish(events)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("pending_changes", None)
+
+
+async def stream(request, topics=None, last_event_id=None, tenant=None):
+    """Yield a tenant's server-sent events for a client until it disconnects"""
+    subscription = broker.subscribe(topics, tenant)
+    try:
+        yield f"retry: {settings.EVENT_RETRY_MS}\n\n"
+
+        last_sent = last_event_id or 0
+        replayed = set()
+        if last_event_id is not None:
+            backlog = await asyncio.to_thread(broker.replay, last_event_id, subscription.topics, subscription.tenant)
+            if backlog is None:
+                # Too far behind to replay: the client reloads (or catches up through GET /changes)
+                yield RESET
+            else:
+                for event in backlog:
+                    replayed.add(event.id)
+                    last_sent = max(last_sent, event.id)
+                    yield event.to_sse()
+
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is OVERFLOW:
+                yield "event: overflow\ndata: {}\n\n"
+                break
+            if event.id in replayed:
+                continue
+            if event.id <= last_sent:
+                # Committed late with a lower id; sent without moving the client's resume point back
+                yield event.to_sse(with_id=False)
+                continue
+            last_sent = event.id
+            yield event.to_sse()
+    finally:
+        broker.unsubscribe(subscription)
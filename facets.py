@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from sqlalchemy import event as sa_event, inspect, select, func
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Products
+import tenancy
+
+# Product hierarchy, outermost level first
+FACETS = ("group_name", "sub_group", "item", "stock_keeping_unit")
+
+
+def _matches(values, filters):
+    return all(values[facet] == value for facet, value in filters)
+
+
+class FacetCache:
+    """Facet counts per filter combination, kept current by product commits.
+
+    Each entry holds, for one set of filters, the number of matching products
+    and the count of every value of the facets not filtered on. Committed
+    product inserts, updates and deletes adjust the cached entries in place,
+    so a cached sidebar never goes back to the database. Writes this process
+    does not see (other workers, seeding scripts) are picked up once an entry
+    is older than FACET_CACHE_TTL seconds.
+    """
+
+    def __init__(self, size=None, ttl=None):
+        self.size = size or settings.FACET_CACHE_SIZE
+        self.ttl = settings.FACET_CACHE_TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, filters):
+        """Cached (total, counts) for a filter key, or None"""
+        with self._lock:
+            entry = self._entries.get(filters)
+            if entry is None or time.monotonic() - entry["loaded_at"] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(filters)
+            self.hits += 1
+            return entry["total"], {facet: dict(counts) for facet, counts in entry["counts"].items()}
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def put(self, filters, total, counts, generation):
+        """Store counts read from the database, unless a commit applied since they were read"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[filters] = {"loaded_at": time.monotonic(), "total": total, "counts": counts}
+            self._entries.move_to_end(filters)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def apply(self, changes):
+        """Adjust cached counts for committed ``(old_values, new_values)`` pairs"""
+        with self._lock:
+            self._generation += 1
+            for filters, entry in self._entries.items():
+                for old, new in changes:
+                    if old is not None and _matches(old, filters):
+                        self._count(entry, old, -1)
+                    if new is not None and _matches(new, filters):
+                        self._count(entry, new, 1)
+
+    @staticmethod
+    def _count(entry, values, step):
+        entry["total"] += step
+        for facet, counts in entry["counts"].items():
+            value = values[facet]
+            if value is None:
+                continue
+            counts[value] += step
+            if counts[value] <= 0:
+                del counts[value]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+# One cache per tenant
+caches = tenancy.PerTenant(lambda tenant: FacetCache())
+
+
+def filter_key(filters):
+    """Normalise ``{facet: value}`` filters into a hashable cache key"""
+    return tuple((facet, filters[facet]) for facet in FACETS if filters.get(facet) is not None)
+
+
+def _load_counts(db, key):
+    # One grouped scan of the matching hierarchy rows, served by ix_products_tenant_hierarchy
+    columns = [getattr(Products, facet) for facet in FACETS]
+    query = select(*columns, func.count()).group_by(*columns)
+    for facet, value in key:
+        query = query.where(getattr(Products, facet) == value)
+
+    total = 0
+    counts = {facet: Counter() for facet in FACETS if facet not in dict(key)}
+    for *values, count in db.execute(query):
+        total += count
+        for facet, value in zip(FACETS, values):
+            if facet in counts and value is not None:
+                counts[facet][value] += count
+    return total, counts
+
+
+def facet_counts(db, filters):
+    """Number of products matching ``filters`` and value counts of the other facets"""
+    key = filter_key(filters)
+    cache = caches.get(db.tenant)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    generation = cache.generation()
+    total, counts = _load_counts(db, key)
+    cache.put(key, total, counts, generation)
+    return total, {facet: dict(values) for facet, values in counts.items()}
+
+
+def browse(db, filters, after=None, limit=None):
+    """One page of products matching the facet filters, with facet counts.
+
+    Pages are keyed on ``product_id``: pass the returned ``next_cursor`` as
+    ``after`` to get the next page.
+    """
+    page_size = min(limit or settings.FACET_PAGE_SIZE, settings.FACET_MAX_PAGE_SIZE)
+    key = filter_key(filters)
+    query = select(Products)
+    for facet, value in key:
+        query = query.where(getattr(Products, facet) == value)
+    if after is not None:
+        query = query.where(Products.product_id > after)
+
+    products = db.execute(query.order_by(Products.product_id).limit(page_size + 1)).scalars().all()
+    has_more = len(products) > page_size
+    products = products[:page_size]
+
+    total, counts = facet_counts(db, filters)
+    facets = {
+        facet: [{"value": value, "count": count} for value, count in sorted(values.items(), key=lambda item: (-item[1], item[0]))]
+        for facet, values in counts.items()
+    }
+    return {
+        "products": products,
+        "next_cursor": products[-1].product_id if has_more else None,
+        "total": total,
+        "facets": facets,
+    }
+
+
+def _facet_values(obj, history=False):
+    state = inspect(obj)
+    if not history:
+        return {facet: getattr(obj, facet) for facet in FACETS}
+    values = {}
+    for facet in FACETS:
+        changes = state.attrs[facet].history
+        values[facet] = changes.deleted[0] if changes.deleted else getattr(obj, facet)
+    return values
+
+
+# Collect product changes as they are flushed, apply them once they commit
+@sa_event.listens_for(Session, "after_flush")
+def _collect_products(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Products):
+            changes.append((None, _facet_values(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, Products) and session.is_modified(obj):
+            old, new = _facet_values(obj, history=True), _facet_values(obj)
+            if old != new:
+                changes.append((old, new))
+    for obj in session.deleted:
+        if isinstance(obj, Products):
+            changes.append((_facet_values(obj, history=True), None))
+    if changes:
+        session.info.setdefault("pending_facets", []).extend(changes)
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _apply_products(session):
+    changes = session.info.pop("pending_facets", None)
+    if changes:
+        caches.get(getattr(session, "tenant", None)).apply(changes)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_products(session):
+    session.info.pop("pending_facets", None)
@@ -0,0 +1,216 @@
+"""PIN code gazetteer: PIN -> (city, district, state) from a memory-mapped file.
+
+The file is built once from a CSV such as India Post's all-India PIN code
+directory:
+
+    python gazetteer.py pincodes.csv pincodes.gaz
+
+and served by pointing GAZETTEER_PATH at the built file. Layout (little
+endian): a header, the sorted PIN codes as uint32, three uint16 string ids
+(city, district, state) per PIN, and a deduplicated string table. A lookup
+is a binary search over the mapped PIN array, so only the pages it touches
+are ever read into memory.
+"""
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NETAGPIN"
+_HEADER = struct.Struct("<8sIII")  # magic, PIN count, string count, string bytes
+
+# Accepted CSV headers for each column, first match wins (lower case)
+COLUMNS = {
+    "pin": ("pincode", "pin", "zip_code", "pin_code"),
+    "city": ("city", "taluk", "divisionname"),
+    "district": ("district", "districtname"),
+    "state": ("state", "statename"),
+}
+
+_LOWER_WORDS = {"and", "of"}
+
+
+class GazetteerUnavailable(RuntimeError):
+    """GAZETTEER_PATH is not set, or its file cannot be opened"""
+
+
+def _title(name):
+    """``"JAMMU AND KASHMIR"`` -> ``"Jammu and Kashmir"``"""
+    words = name.strip().lower().split()
+    return " ".join(word if index and word in _LOWER_WORDS else word.capitalize() for index, word in enumerate(words))
+
+
+def _aligned(size):
+    return (size + 3) & ~3
+
+
+def read_csv(path):
+    """``(pin, city, district, state)`` rows from a PIN code CSV.
+
+    A PIN with several post offices gets its most common place.
+    """
+    places = {}
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        reader = csv.DictReader(handle)
+        headers = {name.strip().lower(): name for name in reader.fieldnames or ()}
+        columns = {}
+        for column, aliases in COLUMNS.items():
+            found = next((headers[alias] for alias in aliases if alias in headers), None)
+            if found is None:
+                raise ValueError(f"{path} has no {column} column (one of {', '.join(aliases)})")
+            columns[column] = found
+        for row in reader:
+            pin = row[columns["pin"]].strip()
+            if not pin.isdigit() or len(pin) != 6:
+                continue
+            place = tuple(_title(row[columns[column]] or "") for column in ("city", "district", "state"))
+            places.setdefault(int(pin), Counter())[place] += 1
+    return [(pin, *counts.most_common(1)[0][0]) for pin, counts in sorted(places.items())]
+
+
+def build(rows, path):
+    """Write sorted ``(pin, city, district, state)`` rows as a gazetteer file"""
+    strings, ids = [], {}
+
+    def string_id(text):
+        if text not in ids:
+            ids[text] = len(strings)
+            strings.append(text.encode("utf-8"))
+        return ids[text]
+
+    pins, places = array("I"), array("H")
+    for pin, city, district, state in rows:
+        pins.append(pin)
+        places.extend((string_id(city), string_id(district), string_id(state)))
+    if len(strings) > 0xFFFF:
+        raise ValueError("Too many distinct place names for 16-bit ids")
+
+    offsets = array("I", [0])
+    for text in strings:
+        offsets.append(offsets[-1] + len(text))
+    string_bytes = offsets[-1]
+    if sys.byteorder != "little":
+        for values in (pins, places, offsets):
+            values.byteswap()
+
+    with open(path, "wb") as handle:
+        handle.write(_HEADER.pack(MAGIC, len(pins), len(strings), string_bytes))
+        for values in (pins, places, offsets):
+            data = values.tobytes()
+            handle.write(data + b"\0" * (_aligned(len(data)) - len(data)))
+        handle.write(b"".join(strings))
+    return len(pins)
+
+
+class Gazetteer:
+    """Read-only view of a gazetteer file through ``mmap``"""
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("Gazetteer files are little endian")
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"{path} is not a gazetteer file")
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, string_count, string_bytes = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+        size = _HEADER.size + _aligned(4 * count) + _aligned(6 * count) + _aligned(4 * (string_count + 1)) + string_bytes
+        if len(self._map) < size:
+            raise ValueError(f"{path} is truncated: {len(self._map)} bytes of {size}")
+
+        view = memoryview(self._map)
+        position = _HEADER.size
+        self._pins = view[position:position + 4 * count].cast("I")
+        position += _aligned(4 * count)
+        self._places = view[position:position + 6 * count].cast("H")
+        position += _aligned(6 * count)
+        self._offsets = view[position:position + 4 * (string_count + 1)].cast("I")
+        position += _aligned(4 * (string_count + 1))
+        self._strings = view[position:position + string_bytes]
+        if self._offsets[-1] != string_bytes or max(self._places, default=-1) >= string_count:
+            raise ValueError(f"{path} has a corrupt string table")
+
+    def __len__(self):
+        return len(self._pins)
+
+    def _string(self, string_id):
+        return str(self._strings[self._offsets[string_id]:self._offsets[string_id + 1]], "utf-8")
+
+    def lookup(self, pin):
+        """``(city, district, state)`` for a PIN code, or None"""
+        pin = str(pin).strip()
+        if not pin.isdigit() or len(pin) != 6:
+            return None
+        pin = int(pin)
+        index = bisect_left(self._pins, pin)
+        if index == len(self._pins) or self._pins[index] != pin:
+            return None
+        return tuple(self._string(string_id) for string_id in self._places[3 * index:3 * index + 3])
+
+
+_gazetteer = None
+_error = None  # why the gazetteer could not be opened; not retried until restart
+_lock = threading.Lock()
+
+
+def get():
+    """The gazetteer at GAZETTEER_PATH, opened and checked on first use.
+
+    The API opens it on startup, so a missing or broken file stops it there.
+    """
+    global _gazetteer, _error
+    if not settings.GAZETTEER_PATH:
+        raise GazetteerUnavailable("No PIN code gazetteer configured (GAZETTEER_PATH)")
+    with _lock:
+        if _gazetteer is None and _error is None:
+            try:
+                _gazetteer = Gazetteer(settings.GAZETTEER_PATH)
+            except (OSError, ValueError, TypeError) as exc:
+                _error = GazetteerUnavailable(f"PIN code gazetteer {settings.GAZETTEER_PATH} cannot be used: {exc}")
+                logger.warning("%s; addresses are not normalized", _error)
+                raise _error from exc
+            logger.info("PIN code gazetteer opened with %d PIN codes", len(_gazetteer))
+        if _error is not None:
+            raise _error
+        return _gazetteer
+
+
+def normalize_address(address):
+    """Replace an Indian address's district and state with the gazetteer's, and fill a blank city.
+
+    Does nothing unless GAZETTEER_NORMALIZE is on. Unknown PIN codes are left
+    alone, or rejected with ValueError under GAZETTEER_REJECT_UNKNOWN. Without
+    a usable gazetteer file addresses are left alone too.
+    """
+    if not (settings.GAZETTEER_NORMALIZE and settings.GAZETTEER_PATH) or (address.country or "").strip().lower() not in ("india", "in"):
+        return address
+    try:
+        place = get().lookup(address.zip_code)
+    except GazetteerUnavailable:
+        return address
+    if place is None:
+        if settings.GAZETTEER_REJECT_UNKNOWN:
+            raise ValueError(f"PIN code {address.zip_code} is not in the gazetteer")
+        return address
+    city, address.district, address.state = place
+    if not address.city:
+        address.city = city
+    return address
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python gazetteer.py PINCODES.csv OUTPUT.gaz")
+    count = build(read_csv(sys.argv[1]), sys.argv[2])
+    print(f"Wrote {count} PIN codes to {sys.argv[2]}")
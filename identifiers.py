@@ -0,0 +1,199 @@
+"""Format and consistency checks for Indian tax, bank and food licence identifiers.
+
+Every check takes an already normalised value (see ``normalize``) and returns
+an error message, or None when the value is valid. Patterns are compiled and
+the GSTIN checksum weights tabulated once at import, so a check is a regex
+match plus at most a 14-character table walk.
+"""
+import csv
+import re
+
+from config import settings
+
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Fourth PAN character: individual, company, HUF, firm, AOP, trust, BOI,
+# local authority, artificial juridical person, government, LLP
+PAN_HOLDER_TYPES = "PCHFATBLJGE"
+
+_PAN = re.compile(rf"[A-Z]{{3}}[{PAN_HOLDER_TYPES}][A-Z][0-9]{{4}}[A-Z]")
+_GSTIN = re.compile(rf"([0-9]{{2}})([A-Z]{{3}}[{PAN_HOLDER_TYPES}][A-Z][0-9]{{4}}[A-Z])[1-9A-Z]Z[0-9A-Z]")
+_IFSC = re.compile(r"[A-Z]{4}0[A-Z0-9]{6}")
+_FSSAI = re.compile(r"[12][0-9]{13}")
+_NON_LETTERS = re.compile(r"[^a-z]+")
+
+# GST state codes
+GST_STATES = {
+    "01": "Jammu and Kashmir", "02": "Himachal Pradesh", "03": "Punjab", "04": "Chandigarh",
+    "05": "Uttarakhand", "06": "Haryana", "07": "Delhi", "08": "Rajasthan", "09": "Uttar Pradesh",
+    "10": "Bihar", "11": "Sikkim", "12": "Arunachal Pradesh", "13": "Nagaland", "14": "Manipur",
+    "15": "Mizoram", "16": "Tripura", "17": "Meghalaya", "18": "Assam", "19": "West Bengal",
+    "20": "Jharkhand", "21": "Odisha", "22": "Chhattisgarh", "23": "Madhya Pradesh", "24": "Gujarat",
+    "25": "Daman and Diu", "26": "Dadra and Nagar Haveli and Daman and Diu", "27": "Maharashtra",
+    "28": "Andhra Pradesh", "29": "Karnataka", "30": "Goa", "31": "Lakshadweep", "32": "Kerala",
+    "33": "Tamil Nadu", "34": "Puducherry", "35": "Andaman and Nicobar Islands", "36": "Telangana",
+    "37": "Andhra Pradesh", "38": "Ladakh", "97": "Other Territory", "99": "Centre Jurisdiction",
+}
+
+# Older and alternative spellings of state names
+_STATE_ALIASES = {
+    "Orissa": "Odisha", "Pondicherry": "Puducherry", "Uttaranchal": "Uttarakhand",
+    "NCT of Delhi": "Delhi", "New Delhi": "Delhi", "Dadra and Nagar Haveli": "Dadra and Nagar Haveli and Daman and Diu",
+}
+
+# IFSC bank codes (first four characters) of the larger banks; IFSC_BANK_CODES_FILE replaces them
+IFSC_BANKS = {
+    "SBIN": "State Bank of India", "PUNB": "Punjab National Bank", "BARB": "Bank of Baroda",
+    "CNRB": "Canara Bank", "UBIN": "Union Bank of India", "BKID": "Bank of India",
+    "IOBA": "Indian Overseas Bank", "IDIB": "Indian Bank", "UCBA": "UCO Bank",
+    "CBIN": "Central Bank of India", "MAHB": "Bank of Maharashtra", "PSIB": "Punjab and Sind Bank",
+    "HDFC": "HDFC Bank", "ICIC": "ICICI Bank", "UTIB": "Axis Bank", "KKBK": "Kotak Mahindra Bank",
+    "YESB": "Yes Bank", "INDB": "IndusInd Bank", "IDFB": "IDFC First Bank", "FDRL": "Federal Bank",
+    "KARB": "Karnataka Bank", "KVBL": "Karur Vysya Bank", "SIBL": "South Indian Bank",
+    "CIUB": "City Union Bank", "TMBL": "Tamilnad Mercantile Bank", "DLXB": "Dhanlaxmi Bank",
+    "RATN": "RBL Bank", "DCBL": "DCB Bank", "BDBL": "Bandhan Bank", "CSBK": "CSB Bank",
+    "JAKA": "Jammu and Kashmir Bank", "AUBL": "AU Small Finance Bank", "ESFB": "Equitas Small Finance Bank",
+    "UJVN": "Ujjivan Small Finance Bank", "IPOS": "India Post Payments Bank", "AIRP": "Airtel Payments Bank",
+    "CITI": "Citibank", "SCBL": "Standard Chartered Bank", "HSBC": "HSBC", "DBSS": "DBS Bank India",
+    "DEUT": "Deutsche Bank", "SRCB": "Saraswat Co-operative Bank", "COSB": "Cosmos Co-operative Bank",
+}
+
+# GSTIN checksum: the weighted value of each character at each of the first 14 positions
+_GSTIN_WEIGHTS = [
+    {char: (value * factor) // 36 + (value * factor) % 36 for value, char in enumerate(_ALPHABET)}
+    for factor in (1, 2) * 7
+]
+
+
+def _state_key(name):
+    return _NON_LETTERS.sub("", name.lower().replace("&", "and"))
+
+
+_STATE_CODES = {}
+for _code, _name in GST_STATES.items():
+    _STATE_CODES.setdefault(_state_key(_name), set()).add(_code)
+for _alias, _name in _STATE_ALIASES.items():
+    _STATE_CODES[_state_key(_alias)] = _STATE_CODES[_state_key(_name)]
+# Daman and Diu merged into Dadra and Nagar Haveli; GSTINs under either code stay valid
+_STATE_CODES[_state_key("Daman and Diu")].add("26")
+_STATE_CODES[_state_key("Dadra and Nagar Haveli and Daman and Diu")].add("25")
+
+
+def load_bank_codes(path):
+    """Replace the IFSC bank table with ``code,name`` rows from a CSV file"""
+    with open(path, newline="", encoding="utf-8") as handle:
+        banks = {row[0].strip().upper(): row[1].strip() for row in csv.reader(handle) if len(row) >= 2}
+    IFSC_BANKS.clear()
+    IFSC_BANKS.update(banks)
+
+
+if settings.IFSC_BANK_CODES_FILE:
+    load_bank_codes(settings.IFSC_BANK_CODES_FILE)
+
+
+def normalize(value):
+    """Strip and upper-case an identifier; blank values become None"""
+    if value is None:
+        return None
+    value = value.strip().upper()
+    return value or None
+
+
+def gstin_check_character(gstin):
+    """Check character for the first 14 characters of a GSTIN"""
+    total = sum(weights[char] for weights, char in zip(_GSTIN_WEIGHTS, gstin))
+    return _ALPHABET[(36 - total % 36) % 36]
+
+
+def pan_error(pan):
+    if not _PAN.fullmatch(pan):
+        return "PAN must be 5 letters (4th a valid holder type), 4 digits and a letter"
+    return None
+
+
+def gstin_error(gstin, pan=None, state=None):
+    """Errors in a GSTIN, and whether it belongs to ``pan`` and ``state`` when given"""
+    match = _GSTIN.fullmatch(gstin)
+    if not match:
+        return "GSTIN must be a 2-digit state code, a PAN, an entity code, 'Z' and a check character"
+    state_code, gstin_pan = match.groups()
+    if state_code not in GST_STATES:
+        return f"GSTIN state code {state_code} does not exist"
+    if gstin[14] != gstin_check_character(gstin):
+        return "GSTIN check character does not match"
+    if pan and pan != gstin_pan:
+        return f"GSTIN is registered to PAN {gstin_pan}, not {pan}"
+    if state:
+        codes = _STATE_CODES.get(_state_key(state))
+        if codes is not None and state_code not in codes:
+            return f"GSTIN state code {state_code} ({GST_STATES[state_code]}) does not match {state}"
+    return None
+
+
+def ifsc_error(ifsc):
+    if not _IFSC.fullmatch(ifsc):
+        return "IFSC must be a 4-letter bank code, '0' and a 6-character branch code"
+    if settings.IFSC_BANK_CODES_FILE and ifsc[:4] not in IFSC_BANKS:
+        return f"IFSC bank code {ifsc[:4]} is not a known bank"
+    return None
+
+
+def bank_name(ifsc):
+    return IFSC_BANKS.get(ifsc[:4]) if ifsc else None
+
+
+def fssai_error(fssai):
+    if not _FSSAI.fullmatch(fssai):
+        return "FSSAI licence number must be 14 digits starting with 1 (licence) or 2 (registration)"
+    return None
+
+
+def merged_gstin_error(party, changes):
+    """Errors in the GSTIN ``party`` has once ``changes`` are applied, checked against its PAN.
+
+    The update schemas only compare the two when both are sent, so a GSTIN or
+    PAN sent alone is checked here against the stored other half.
+    """
+    if "gst_number" not in changes and "pan_number" not in changes:
+        return None
+    gstin = changes.get("gst_number", party.gst_number)
+    pan = changes.get("pan_number", party.pan_number)
+    if not gstin or not pan:
+        return None
+    return gstin_error(gstin, pan)
+
+
+# Field name -> check, for the schemas that write these fields
+CHECKS = {
+    "pan_number": pan_error,
+    "gst_number": gstin_error,
+    "ifsc_code": ifsc_error,
+    "fssai_number": fssai_error,
+}
+
+
+def validate_record(record):
+    """``(field, message)`` errors for a dict holding any of the identifier fields.
+
+    The GSTIN is also checked against the record's PAN and, when given, its
+    ``state``.
+    """
+    errors = []
+    pan = normalize(record.get("pan_number"))
+    if pan is not None:
+        message = pan_error(pan)
+        if message:
+            errors.append(("pan_number", message))
+            pan = None  # an invalid PAN is not compared with the GSTIN
+    gstin = normalize(record.get("gst_number"))
+    if gstin is not None:
+        message = gstin_error(gstin, pan, record.get("state"))
+        if message:
+            errors.append(("gst_number", message))
+    for field, check in (("ifsc_code", ifsc_error), ("fssai_number", fssai_error)):
+        value = normalize(record.get(field))
+        if value is not None:
+            message = check(value)
+            if message:
+                errors.append((field, message))
+    return errors
@@ -1,5 +1,3 @@
-import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import os
 import sys
 
@@ -9,29 +7,22 @@ from config import settings
 DATABASE_URL = settings.get_database_url()
 
 def create_database():
-    """Create the database if it doesn't exist"""
+    """Check that the configured database is reachable (SQLite creates the file on first connect)"""
     try:
-        # Connect to PostgreSQL server (not to a specific database)
-        db_config = settings.get_database_config()
-        conn = psycopg2.connect(
-            host=db_config["host"],
-            port=db_config["port"],
-            user=db_config["user"],
-            password=db_config["password"],
-            database=db_config["database"]  # Connect directly to the target database
-        )
-        cursor = conn.cursor()
-        
-        # Test the connection to the database
-        cursor.execute("SELECT version();")
-        version = cursor.fetchone()
-        print(f"Connected to PostgreSQL: {version[0]}")
-        print(f"Database '{settings.DATABASE_NAME}' is accessible!")
-        
-        cursor.close()
-        conn.close()
-        
-    except psycopg2.Error as e:
+        from sqlalchemy import text
+        from models import engine
+        
+        with engine.connect() as conn:
+            if engine.dialect.name == "sqlite":
+                version = conn.execute(text("SELECT sqlite_version()")).scalar()
+                print(f"Connected to SQLite {version}")
+                print(f"Database '{engine.url.database or ':memory:'}' is accessible!")
+            else:
+                version = conn.execute(text("SELECT version()")).scalar()
+                print(f"Connected to PostgreSQL: {version}")
+                print(f"Database '{engine.url.database}' is accessible!")
+        
+    except Exception as e:
         print(f"Error creating database: {e}")
         sys.exit(1)
 
@@ -40,21 +31,164 @@ def create_database():
 def create_tables():
     """Create all tables using SQLAlchemy"""
     try:
-        from models import Base, engine
+        from models import Base, engine, engines
         Base.metadata.create_all(bind=engine)
+        # Tenants with their own database or schema
+        engines.create_all(Base)
         print("All tables created successfully!")
         return True
     except Exception as e:
         print(f"Error creating tables: {e}")
         return False
 
-def insert_sample_data():
-    """Insert sample data for testing"""
+def apply_cascade_constraints():
+    """Upgrade party child foreign keys of an existing database to ON DELETE CASCADE"""
+    try:
+        from sqlalchemy import inspect, text
+        from models import Base, engine
+        
+        # New SQLite databases get the cascading keys from create_all, and SQLite cannot alter them
+        if engine.dialect.name != "postgresql":
+            return True
+        
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if "party_id" not in table.c or table.name == "party_master":
+                    continue
+                if not any(fk.column.table.name == "party_master" for fk in table.c.party_id.foreign_keys):
+                    continue
+                
+                for fk in inspector.get_foreign_keys(table.name):
+                    if fk["referred_table"] != "party_master":
+                        continue
+                    if (fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE":
+                        continue
+                    conn.execute(text(
+                        f'ALTER TABLE {table.name} DROP CONSTRAINT {fk["name"]}, '
+                        f'ADD CONSTRAINT {fk["name"]} FOREIGN KEY (party_id) '
+                        f'REFERENCES party_master (party_id) ON DELETE CASCADE'
+                    ))
+                    print(f"Foreign key {fk['name']} now cascades deletes")
+                
+                # Cascades look children up by party_id
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+        return True
+    except Exception as e:
+        print(f"Error applying cascade constraints: {e}")
+        return False
+
+def apply_tenant_columns():
+    """Add the tenant key to tables created before tenants existed.
+
+    Existing rows go to DEFAULT_TENANT, and unique keys on codes and names
+    are replaced by their per-tenant versions from the models.
+    """
+    try:
+        from sqlalchemy import inspect, text, UniqueConstraint
+        from sqlalchemy.schema import AddConstraint
+        from models import Base, engine
+        from tenancy import TenantScoped
+        
+        inspector = inspect(engine)
+        scoped = {mapper.local_table for mapper in Base.registry.mappers if issubclass(mapper.class_, TenantScoped)}
+        default = settings.DEFAULT_TENANT.replace("'", "''")
+        sqlite = engine.dialect.name == "sqlite"
+        
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table not in scoped or not inspector.has_table(table.name):
+                    continue
+                if "tenant_id" in {column["name"] for column in inspector.get_columns(table.name)}:
+                    continue
+                
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN tenant_id VARCHAR(50) NOT NULL DEFAULT '{default}'"))
+                
+                # Drop unique keys without the tenant and indexes the models no longer have
+                model_indexes = {index.name for index in table.indexes}
+                rebuild = False
+                for index in inspector.get_indexes(table.name):
+                    if index.get("duplicates_constraint"):
+                        continue
+                    if index["name"] not in model_indexes or (index["unique"] and "tenant_id" not in index["column_names"]):
+                        conn.execute(text(f"DROP INDEX {index['name']}"))
+                for constraint in inspector.get_unique_constraints(table.name):
+                    if "tenant_id" in constraint["column_names"]:
+                        continue
+                    if sqlite:
+                        # SQLite only drops a table's own UNIQUE by rebuilding the table
+                        rebuild = True
+                    else:
+                        conn.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT {constraint['name']}"))
+                
+                if rebuild:
+                    # Lookup tables no foreign key points at: copy into a fresh table
+                    columns = ", ".join(column["name"] for column in inspector.get_columns(table.name)) + ", tenant_id"
+                    for index in inspector.get_indexes(table.name):
+                        conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+                    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_pre_tenant"))
+                    table.create(bind=conn)
+                    conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_pre_tenant"))
+                    conn.execute(text(f"DROP TABLE {table.name}_pre_tenant"))
+                else:
+                    for constraint in table.constraints:
+                        if isinstance(constraint, UniqueConstraint):
+                            if sqlite:
+                                # SQLite cannot add constraints; a unique index enforces the same
+                                names = ", ".join(column.name for column in constraint.columns)
+                                conn.execute(text(f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({names})"))
+                            else:
+                                conn.execute(AddConstraint(constraint))
+                print(f"Table {table.name} now has a tenant key")
+        return True
+    except Exception as e:
+        print(f"Error adding tenant columns: {e}")
+        return False
+
+def apply_version_columns():
+    """Add the optimistic concurrency version to tables created without it"""
+    try:
+        from sqlalchemy import inspect, text
+        from models import Base, engine
+        
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for mapper in Base.registry.mappers:
+                table = mapper.local_table
+                if mapper.version_id_col is None or not inspector.has_table(table.name):
+                    continue
+                if "version" in {column["name"] for column in inspector.get_columns(table.name)}:
+                    continue
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+        return True
+    except Exception as e:
+        print(f"Error adding version columns: {e}")
+        return False
+
+def apply_indexes():
+    """Create indexes added to the models after their tables already existed"""
+    try:
+        from models import Base, engine
+        
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+        return True
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        return False
+
+def insert_sample_data(tenant=None):
+    """Insert sample data for testing, for one tenant (DEFAULT_TENANT unless given)"""
     try:
         from models import SessionLocal, MasterTypes, AccountGroups, PaymentTerms, Products
         from datetime import datetime
+        import dialect
         
-        db = SessionLocal()
+        tenant = tenant or settings.DEFAULT_TENANT
+        db = SessionLocal(tenant=tenant)
         
         # Insert master types
         master_types = [
@@ -65,11 +199,8 @@ def insert_sample_data():
             {"type_name": "Public Limited Company", "description": "Public limited company"},
         ]
         
-        for mt_data in master_types:
-            existing = db.query(MasterTypes).filter(MasterTypes.type_name == mt_data["type_name"]).first()
-            if not existing:
-                mt = MasterTypes(**mt_data)
-                db.add(mt)
+        now = datetime.utcnow()
+        dialect.insert_ignore(db, MasterTypes, [{**mt_data, "created_at": now, "tenant_id": tenant} for mt_data in master_types], ["tenant_id", "type_name"])
         
         # Insert account groups
         account_groups = [
@@ -83,14 +214,7 @@ def insert_sample_data():
             {"main_group": "Short Term Investments", "group_name": "Current Assets", "from_account_no": "100800000", "to_account_no": "100899999"},
         ]
         
-        for ag_data in account_groups:
-            existing = db.query(AccountGroups).filter(
-                AccountGroups.main_group == ag_data["main_group"],
-                AccountGroups.group_name == ag_data["group_name"]
-            ).first()
-            if not existing:
-                ag = AccountGroups(**ag_data)
-                db.add(ag)
+        dialect.insert_ignore(db, AccountGroups, [{**ag_data, "created_at": now, "tenant_id": tenant} for ag_data in account_groups], ["tenant_id", "main_group", "group_name"])
         
         # Insert payment terms
         payment_terms = [
@@ -114,14 +238,10 @@ def insert_sample_data():
             {"product_code": "RM001", "product_name": "RM WHEAT LOKWAN", "group_name": "CHANA", "sub_group": "CHANA", "item": "BESAN SINGLE", "stock_keeping_unit": "25 KG"},
         ]
         
-        for p_data in products:
-            existing = db.query(Products).filter(Products.product_code == p_data["product_code"]).first()
-            if not existing:
-                p = Products(**p_data)
-                db.add(p)
+        dialect.insert_ignore(db, Products, [{**p_data, "created_at": now, "tenant_id": tenant} for p_data in products], ["tenant_id", "product_code"])
         
         db.commit()
-        print("Sample data inserted successfully!")
+        print(f"Sample data inserted successfully for tenant {tenant}!")
         db.close()
         return True
         
@@ -130,7 +250,7 @@ def insert_sample_data():
         return False
 
 if __name__ == "__main__":
-    print("Setting up NETAGE BI PostgreSQL database...")
+    print("Setting up NETAGE BI database...")
     print("=" * 60)
     
     # Step 1: Test database connection
@@ -146,11 +266,32 @@ if __name__ == "__main__":
     if create_tables():
         print("✅ Tables created successfully!")
         
-        # Step 3: Insert sample data
-        if insert_sample_data():
-            print("✅ Sample data inserted successfully!")
+        if apply_cascade_constraints():
+            print("✅ Foreign keys cascade party deletes!")
+        else:
+            print("⚠️ Could not upgrade foreign keys to ON DELETE CASCADE!")
+        
+        if apply_tenant_columns():
+            print("✅ Tables carry the tenant key!")
         else:
-            print("⚠️ Sample data insertion failed!")
+            print("⚠️ Could not add tenant columns!")
+        
+        if apply_version_columns():
+            print("✅ Tables carry the party version!")
+        else:
+            print("⚠️ Could not add version columns!")
+        
+        if apply_indexes():
+            print("✅ Indexes up to date!")
+        else:
+            print("⚠️ Could not create missing indexes!")
+        
+        # Step 3: Insert sample data for every tenant
+        for tenant in settings.get_tenants():
+            if insert_sample_data(tenant):
+                print(f"✅ Sample data inserted for tenant {tenant}!")
+            else:
+                print(f"⚠️ Sample data insertion failed for tenant {tenant}!")
     else:
         print("❌ Table creation failed!")
         sys.exit(1)
@@ -0,0 +1,425 @@
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from pydantic import ValidationError
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.orm import selectinload
+
+from config import settings
+from models import SessionLocal, engines, Job, PartyMaster, PartyProducts
+from schemas import PartyMasterCreate, PartyMasterResponse
+import aggregates
+import party_codes
+import bi_export
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+# Registered job types: name -> (handler, executor kind)
+HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(name, executor="thread"):
+    """Register a job type.
+
+    The handler receives a ``JobContext`` and returns a JSON-serialisable
+    result. It must work in chunks and call ``ctx.checkpoint`` after each one
+    so a restarted job continues from ``ctx.cursor``. Handlers registered with
+    ``executor="process"`` run in a process pool and must be module level.
+    """
+    def register(func):
+        HANDLERS[name] = (func, executor)
+        return func
+    return register
+
+
+class JobContext:
+    def __init__(self, job):
+        self.job_id = job.job_id
+        self.job_type = job.job_type
+        self.tenant_id = job.tenant_id
+        self.params = json.loads(job.params) if job.params else {}
+        self.cursor = json.loads(job.cursor) if job.cursor else None
+        self.processed = job.processed or 0
+        self.total = job.total
+
+    def output_path(self, name):
+        os.makedirs(settings.JOB_OUTPUT_DIR, exist_ok=True)
+        return os.path.join(settings.JOB_OUTPUT_DIR, f"job-{self.job_id}-{name}")
+
+    def checkpoint(self, db, cursor, processed, total=None):
+        """Save progress and commit it together with the chunk's writes.
+
+        Raises ``JobCancelled`` once a cancellation has been requested.
+        """
+        self.cursor = cursor
+        self.processed = processed
+        values = {"cursor": json.dumps(cursor), "processed": processed, "heartbeat_at": datetime.utcnow()}
+        if total is not None:
+            self.total = total
+            values["total"] = total
+        db.execute(update(Job).where(Job.job_id == self.job_id).values(**values))
+        db.commit()
+        if db.execute(select(Job.cancel_requested).where(Job.job_id == self.job_id)).scalar():
+            raise JobCancelled()
+
+
+def job_to_dict(job):
+    return {
+        "job_id": job.job_id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "params": json.loads(job.params) if job.params else {},
+        "processed": job.processed or 0,
+        "total": job.total,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "cancel_requested": bool(job.cancel_requested),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def create_job(db, job_type, params):
+    job = Job(job_type=job_type, status=QUEUED, params=json.dumps(params or {}))
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def cancel_job(db, job):
+    """Cancel a queued job at once, or ask a running one to stop at its next checkpoint"""
+    if job.status in FINISHED:
+        return job
+    job.cancel_requested = True
+    if job.status == QUEUED:
+        job.status = CANCELLED
+        job.finished_at = datetime.utcnow()
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _claim(db, job_id):
+    """Atomically take a queued job, or a running one whose worker stopped heartbeating"""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    claimed = db.execute(
+        update(Job)
+        .where(
+            Job.job_id == job_id,
+            Job.cancel_requested == False,
+            or_(Job.status == QUEUED, and_(Job.status == RUNNING, Job.heartbeat_at < stale))
+        )
+        .values(status=RUNNING, started_at=func.coalesce(Job.started_at, now), heartbeat_at=now)
+    )
+    db.commit()
+    if claimed.rowcount != 1:
+        return None
+    return db.get(Job, job_id)
+
+
+def _finish(job_id, status, result=None, error=None):
+    with SessionLocal(tenant=tenancy.ALL_TENANTS) as db:
+        db.execute(
+            update(Job)
+            .where(Job.job_id == job_id)
+            .values(
+                status=status,
+                result=json.dumps(result, default=str) if result is not None else None,
+                error=error,
+                finished_at=datetime.utcnow()
+            )
+        )
+        db.commit()
+
+
+def run_job(job_id):
+    """Run one job to completion; safe to call for a job another worker already took"""
+    with SessionLocal(tenant=tenancy.ALL_TENANTS) as db:
+        job = _claim(db, job_id)
+        if job is None:
+            return
+        ctx = JobContext(job)
+
+    handler, _ = HANDLERS[ctx.job_type]
+    try:
+        # The handler's sessions work for the tenant that created the job
+        with tenancy.use(ctx.tenant_id):
+            result = handler(ctx)
+    except JobCancelled:
+        _finish(job_id, CANCELLED)
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed", job_id, ctx.job_type)
+        _finish(job_id, FAILED, error=str(exc))
+    else:
+        _finish(job_id, COMPLETED, result=result)
+
+
+def _init_process():
+    # Connections inherited from the parent must not be shared with it
+    engines.dispose(close=False)
+
+
+class JobRunner:
+    """Runs jobs on one executor per job type, sized by its concurrency limit"""
+
+    def __init__(self):
+        self._executors = {}
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reaper = None
+
+    def _executor(self, job_type):
+        with self._lock:
+            executor = self._executors.get(job_type)
+            if executor is None:
+                _, kind = HANDLERS[job_type]
+                workers = settings.get_job_concurrency(job_type)
+                if kind == "process":
+                    executor = ProcessPoolExecutor(workers, initializer=_init_process)
+                else:
+                    executor = ThreadPoolExecutor(workers, thread_name_prefix=f"job-{job_type}")
+                self._executors[job_type] = executor
+            return executor
+
+    def submit(self, job_id, job_type):
+        with self._lock:
+            if job_id in self._inflight:
+                return
+            self._inflight.add(job_id)
+        future = self._executor(job_type).submit(run_job, job_id)
+        future.add_done_callback(lambda _: self._done(job_id))
+
+    def _done(self, job_id):
+        with self._lock:
+            self._inflight.discard(job_id)
+
+    def resume_pending(self):
+        """Submit queued jobs and running jobs whose worker went away"""
+        stale = datetime.utcnow() - timedelta(seconds=settings.JOB_STALE_SECONDS)
+        with SessionLocal(tenant=tenancy.ALL_TENANTS) as db:
+            pending = db.execute(
+                select(Job.job_id, Job.job_type).where(
+                    Job.job_type.in_(list(HANDLERS)),
+                    or_(Job.status == QUEUED, and_(Job.status == RUNNING, Job.heartbeat_at < stale))
+                ).order_by(Job.job_id)
+            ).all()
+        for job_id, job_type in pending:
+            self.submit(job_id, job_type)
+
+    def start(self):
+        self._stopped.clear()
+        self.resume_pending()
+        self._reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while not self._stopped.wait(settings.JOB_STALE_SECONDS / 2):
+            try:
+                self.resume_pending()
+            except Exception:
+                logger.exception("Could not resume pending jobs")
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+runner = JobRunner()
+
+
+# Built-in job types
+@job_handler("export_parties")
+def export_parties(ctx):
+    """Write every party with its child records to a JSON Lines file"""
+    path = ctx.output_path("parties.jsonl")
+    cursor = ctx.cursor or {"last_party_id": 0, "offset": 0}
+    processed = ctx.processed
+
+    with SessionLocal() as db:
+        total = db.execute(select(func.count()).select_from(PartyMaster)).scalar()
+        with open(path, "r+b" if os.path.exists(path) else "wb") as out:
+            # Drop anything written after the last checkpoint
+            out.truncate(cursor["offset"])
+            out.seek(cursor["offset"])
+            while True:
+                parties = db.execute(
+                    select(PartyMaster)
+                    .options(
+                        selectinload(PartyMaster.addresses),
+                        selectinload(PartyMaster.contact_persons),
+                        selectinload(PartyMaster.account_details),
+                        selectinload(PartyMaster.bank_details)
+                    )
+                    .where(PartyMaster.party_id > cursor["last_party_id"])
+                    .order_by(PartyMaster.party_id)
+                    .limit(settings.JOB_CHUNK_SIZE)
+                ).scalars().all()
+                if not parties:
+                    break
+                for party in parties:
+                    out.write(PartyMasterResponse.model_validate(party).model_dump_json().encode() + b"\n")
+                out.flush()
+                os.fsync(out.fileno())
+                processed += len(parties)
+                cursor = {"last_party_id": parties[-1].party_id, "offset": out.tell()}
+                db.expunge_all()
+                ctx.checkpoint(db, cursor, processed, total)
+
+    return {"path": path, "rows": processed}
+
+
+@job_handler("export_party_products")
+def export_party_products(ctx):
+    """Write the party × product matrix to a Parquet or Arrow file.
+
+    The snapshot is one streamed statement, so there is no cursor to resume
+    from: a restarted job writes the file again from the start.
+    """
+    fmt = ctx.params.get("format", "parquet")
+    if fmt not in bi_export.FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    path = ctx.output_path(f"party_products.{bi_export.FORMATS[fmt][0]}")
+
+    with SessionLocal() as db:
+        total = db.execute(select(func.count()).select_from(PartyProducts)).scalar()
+
+        def progress(rows):
+            ctx.checkpoint(db, None, rows, total)
+
+        try:
+            rows = bi_export.write_snapshot(path, fmt, progress=progress)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    return {"path": path, "rows": rows, "format": fmt}
+
+
+@job_handler("import_parties")
+def import_parties(ctx):
+    """Create parties from a JSON Lines file of ``PartyMasterCreate`` records.
+
+    Each chunk is committed together with its checkpoint, so a restarted
+    import never creates a party twice. Rows whose party code already exists
+    are skipped, and rows without one get codes from the party code allocator;
+    rows with a code from the allocator's range are rejected.
+    """
+    path = ctx.params["path"]
+    cursor = ctx.cursor or {"line": 0, "created": 0, "skipped": 0, "errors": []}
+
+    total = ctx.total
+    if total is None:
+        with open(path) as source:
+            total = sum(1 for line in source if line.strip())
+
+    def import_chunk(db, chunk):
+        parties = []
+        for line_no, line in chunk:
+            try:
+                party = PartyMasterCreate.model_validate_json(line)
+                if party.party_code and party_codes.allocator.owns(party.party_code):
+                    raise ValueError(f"Party code {party.party_code} is in the range assigned automatically")
+                parties.append((line_no, party))
+            except (ValidationError, ValueError) as exc:
+                if len(cursor["errors"]) < 100:
+                    cursor["errors"].append({"line": line_no, "error": str(exc)})
+                cursor["skipped"] += 1
+
+        uncoded = [party for _, party in parties if not party.party_code]
+        for party, code in zip(uncoded, party_codes.allocator.take(len(uncoded), db)):
+            party.party_code = code
+        
+        codes = [party.party_code for _, party in parties]
+        existing = set(db.execute(select(PartyMaster.party_code).where(PartyMaster.party_code.in_(codes))).scalars())
+        for line_no, party in parties:
+            if party.party_code in existing:
+                cursor["skipped"] += 1
+                continue
+            existing.add(party.party_code)
+            aggregates.create_party_aggregate(db, party)
+            cursor["created"] += 1
+
+        cursor["line"] = chunk[-1][0]
+        db.expunge_all()
+        ctx.checkpoint(db, cursor, cursor["created"] + cursor["skipped"], total)
+
+    with SessionLocal() as db, open(path) as source:
+        chunk = []
+        for line_no, line in enumerate(source, 1):
+            if line_no <= cursor["line"] or not line.strip():
+                continue
+            chunk.append((line_no, line))
+            if len(chunk) >= settings.JOB_CHUNK_SIZE:
+                import_chunk(db, chunk)
+                chunk = []
+        if chunk:
+            import_chunk(db, chunk)
+
+    return {"created": cursor["created"], "skipped": cursor["skipped"], "errors": cursor["errors"]}
+
+
+FIRST_NAMES = ["SHREE", "JAI", "NEW", "OM", "SAI", "MAA", "RAJ", "GANESH", "LAXMI", "KRISHNA"]
+TRADE_NAMES = ["KIRANA", "TRADERS", "ENTERPRISE", "STORES", "AGENCY", "SUPERMART", "DISTRIBUTORS", "FOODS"]
+CITIES = [("Surat", "Gujarat", "395001"), ("Mumbai", "Maharashtra", "400001"), ("Pune", "Maharashtra", "411001"),
+          ("Ahmedabad", "Gujarat", "380001"), ("Indore", "Madhya Pradesh", "452001"), ("Jaipur", "Rajasthan", "302001")]
+
+
+@job_handler("generate_parties")
+def generate_parties(ctx):
+    """Create ``count`` synthetic parties for load and search testing"""
+    count = int(ctx.params.get("count", 1000))
+    prefix = ctx.params.get("prefix", f"GEN{ctx.job_id}-")
+    generated = (ctx.cursor or {}).get("generated", 0)
+
+    with SessionLocal() as db:
+        while generated < count:
+            stop = min(generated + settings.JOB_CHUNK_SIZE, count)
+            for n in range(generated, stop):
+                # Seeded per row so a resumed job produces the same data
+                rng = random.Random(f"{ctx.job_id}:{n}")
+                city, state, zip_code = rng.choice(CITIES)
+                party = PartyMasterCreate(
+                    party_code=f"{prefix}{n}",
+                    party_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(TRADE_NAMES)} ({city.upper()})",
+                    type_of_firm="Sole Proprietorship",
+                    email_id=f"party{n}@example.com",
+                    mobile_number=f"9{rng.randrange(10**8, 10**9)}",
+                    pan_number="AABCU9603R",
+                    credit_limit=rng.choice([100000, 250000, 500000]),
+                    credit_days=rng.choice([15, 30, 45]),
+                    addresses=[{"shipping_address": f"{n}, Main Road, {city}", "country": "India",
+                                "state": state, "district": city, "city": city, "zip_code": zip_code}],
+                    contact_persons=[{"name": f"Contact {n}", "mobile_number": f"8{rng.randrange(10**8, 10**9)}"}]
+                )
+                aggregates.create_party_aggregate(db, party)
+            generated = stop
+            db.expunge_all()
+            ctx.checkpoint(db, {"generated": generated}, generated, count)
+
+    return {"generated": generated}
@@ -1,424 +1,880 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import sessionmaker, Session
-from datetime import datetime
-import os
-from typing import List, Optional
-import uuid
-
-from models import Base, engine, PartyMaster, PartyAddress, ContactPerson, PartyAccountDetails, BankDetails, Products, PartyProducts, PaymentTerms, PartyPaymentTerms, MasterTypes, AccountGroups
-from schemas import *
-
-# Create session maker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-from config import settings
-
-# FastAPI app
-app = FastAPI(
-    title=settings.API_TITLE,
-    description=settings.API_DESCRIPTION,
-    version=settings.API_VERSION
-)
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# Utility function to generate party code
-def generate_party_code():
-    return f"SNET{str(uuid.uuid4().int)[:6]}"
-
-# Routes
-@app.get("/")
-async def root():
-    return {"message": "Welcome to NETAGE BI Party Master API!"}
-
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
-
-# Party Master Routes
-@app.post("/parties/", response_model=PartyMasterResponse)
-async def create_party(party: PartyMasterCreate, db: Session = Depends(get_db)):
-    # Check if party code already exists
-    existing_party = db.query(PartyMaster).filter(PartyMaster.party_code == party.party_code).first()
-    if existing_party:
-        raise HTTPException(status_code=400, detail="Party code already exists")
-    
-    # Create party master
-    db_party = PartyMaster(**party.dict(exclude={'addresses', 'contact_persons', 'account_details', 'bank_details'}))
-    db.add(db_party)
-    db.commit()
-    db.refresh(db_party)
-    
-    # Create addresses
-    for address_data in party.addresses:
-        db_address = PartyAddress(**address_data.dict(), party_id=db_party.party_id)
-        db.add(db_address)
-    
-    # Create contact persons
-    for contact_data in party.contact_persons:
-        db_contact = ContactPerson(**contact_data.dict(), party_id=db_party.party_id)
-        db.add(db_contact)
-    
-    # Create account details
-    if party.account_details:
-        db_account = PartyAccountDetails(**party.account_details.dict(), party_id=db_party.party_id)
-        db.add(db_account)
-    
-    # Create bank details
-    if party.bank_details:
-        db_bank = BankDetails(**party.bank_details.dict(), party_id=db_party.party_id)
-        db.add(db_bank)
-    
-    db.commit()
-    db.refresh(db_party)
-    return db_party
-
-@app.get("/parties/", response_model=List[PartyMasterListResponse])
-async def get_parties(
-    skip: int = 0, 
-    limit: int = 10, 
-    search: Optional[str] = None,
-    db: Session = Depends(get_db)
-):
-    query = db.query(PartyMaster)
-    
-    if search:
-        query = query.filter(
-            (PartyMaster.party_name.ilike(f"%{search}%")) |
-            (PartyMaster.party_code.ilike(f"%{search}%")) |
-            (PartyMaster.gst_number.ilike(f"%{search}%"))
-        )
-    
-    parties = query.offset(skip).limit(limit).all()
-    
-    # Transform to list response format
-    result = []
-    for party in parties:
-        # Get primary contact person
-        primary_contact = db.query(ContactPerson).filter(
-            ContactPerson.party_id == party.party_id,
-            ContactPerson.is_primary == True
-        ).first()
-        
-        # Get primary address for location
-        primary_address = db.query(PartyAddress).filter(
-            PartyAddress.party_id == party.party_id,
-            PartyAddress.is_primary == True
-        ).first()
-        
-        result.append(PartyMasterListResponse(
-            party_id=party.party_id,
-            party_code=party.party_code,
-            party_name=party.party_name,
-            gst_number=party.gst_number,
-            fssai_number=party.fssai_number,
-            contact_person=primary_contact.name if primary_contact else None,
-            mobile_number=party.mobile_number,
-            location=primary_address.city if primary_address else None
-        ))
-    
-    return result
-
-@app.get("/parties/{party_id}", response_model=PartyMasterResponse)
-async def get_party(party_id: int, db: Session = Depends(get_db)):
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if party is None:
-        raise HTTPException(status_code=404, detail="Party not found")
-    return party
-
-@app.put("/parties/{party_id}", response_model=PartyMasterResponse)
-async def update_party(party_id: int, party_update: PartyMasterUpdate, db: Session = Depends(get_db)):
-    db_party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if db_party is None:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    # Update only provided fields
-    update_data = party_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_party, field, value)
-    
-    db_party.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_party)
-    return db_party
-
-@app.delete("/parties/{party_id}")
-async def delete_party(party_id: int, db: Session = Depends(get_db)):
-    db_party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if db_party is None:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    db.delete(db_party)
-    db.commit()
-    return {"message": "Party deleted successfully"}
-
-# Address Routes
-@app.post("/parties/{party_id}/addresses/", response_model=PartyAddressResponse)
-async def create_party_address(
-    party_id: int, 
-    address: PartyAddressCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    db_address = PartyAddress(**address.dict(), party_id=party_id)
-    db.add(db_address)
-    db.commit()
-    db.refresh(db_address)
-    return db_address
-
-@app.get("/parties/{party_id}/addresses/", response_model=List[PartyAddressResponse])
-async def get_party_addresses(party_id: int, db: Session = Depends(get_db)):
-    addresses = db.query(PartyAddress).filter(PartyAddress.party_id == party_id).all()
-    return addresses
-
-# Contact Person Routes
-@app.post("/parties/{party_id}/contacts/", response_model=ContactPersonResponse)
-async def create_contact_person(
-    party_id: int, 
-    contact: ContactPersonCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    db_contact = ContactPerson(**contact.dict(), party_id=party_id)
-    db.add(db_contact)
-    db.commit()
-    db.refresh(db_contact)
-    return db_contact
-
-@app.get("/parties/{party_id}/contacts/", response_model=List[ContactPersonResponse])
-async def get_contact_persons(party_id: int, db: Session = Depends(get_db)):
-    contacts = db.query(ContactPerson).filter(ContactPerson.party_id == party_id).all()
-    return contacts
-
-# Account Details Routes
-@app.post("/parties/{party_id}/account-details/", response_model=PartyAccountDetailsResponse)
-async def create_account_details(
-    party_id: int, 
-    account: PartyAccountDetailsCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    # Check if account details already exist
-    existing_account = db.query(PartyAccountDetails).filter(
-        PartyAccountDetails.party_id == party_id
-    ).first()
-    if existing_account:
-        raise HTTPException(status_code=400, detail="Account details already exist for this party")
-    
-    db_account = PartyAccountDetails(**account.dict(), party_id=party_id)
-    db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
-    return db_account
-
-@app.get("/parties/{party_id}/account-details/", response_model=PartyAccountDetailsResponse)
-async def get_account_details(party_id: int, db: Session = Depends(get_db)):
-    account = db.query(PartyAccountDetails).filter(PartyAccountDetails.party_id == party_id).first()
-    if not account:
-        raise HTTPException(status_code=404, detail="Account details not found")
-    return account
-
-# Bank Details Routes
-@app.post("/parties/{party_id}/bank-details/", response_model=BankDetailsResponse)
-async def create_bank_details(
-    party_id: int, 
-    bank: BankDetailsCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    # Validate account numbers match
-    if bank.account_number != bank.confirm_account_number:
-        raise HTTPException(status_code=400, detail="Account numbers do not match")
-    
-    db_bank = BankDetails(**bank.dict(), party_id=party_id)
-    db.add(db_bank)
-    db.commit()
-    db.refresh(db_bank)
-    return db_bank
-
-@app.get("/parties/{party_id}/bank-details/", response_model=List[BankDetailsResponse])
-async def get_bank_details(party_id: int, db: Session = Depends(get_db)):
-    bank_details = db.query(BankDetails).filter(BankDetails.party_id == party_id).all()
-    return bank_details
-
-# Products Routes
-@app.post("/products/", response_model=ProductsResponse)
-async def create_product(product: ProductsCreate, db: Session = Depends(get_db)):
-    # Check if product code already exists
-    existing_product = db.query(Products).filter(Products.product_code == product.product_code).first()
-    if existing_product:
-        raise HTTPException(status_code=400, detail="Product code already exists")
-    
-    db_product = Products(**product.dict())
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
-
-@app.get("/products/", response_model=List[ProductsResponse])
-async def get_products(
-    skip: int = 0, 
-    limit: int = 100, 
-    search: Optional[str] = None,
-    db: Session = Depends(get_db)
-):
-    query = db.query(Products)
-    
-    if search:
-        query = query.filter(
-            (Products.product_name.ilike(f"%{search}%")) |
-            (Products.product_code.ilike(f"%{search}%"))
-        )
-    
-    products = query.offset(skip).limit(limit).all()
-    return products
-
-# Party Products Routes
-@app.post("/parties/{party_id}/products/", response_model=PartyProductsResponse)
-async def add_party_product(
-    party_id: int, 
-    party_product: PartyProductsCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    # Check if product exists
-    product = db.query(Products).filter(Products.product_id == party_product.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Check if product already assigned to party
-    existing = db.query(PartyProducts).filter(
-        PartyProducts.party_id == party_id,
-        PartyProducts.product_id == party_product.product_id
-    ).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Product already assigned to party")
-    
-    db_party_product = PartyProducts(**party_product.dict(), party_id=party_id)
-    db.add(db_party_product)
-    db.commit()
-    db.refresh(db_party_product)
-    return db_party_product
-
-@app.get("/parties/{party_id}/products/", response_model=List[PartyProductsResponse])
-async def get_party_products(party_id: int, db: Session = Depends(get_db)):
-    party_products = db.query(PartyProducts).filter(PartyProducts.party_id == party_id).all()
-    return party_products
-
-@app.delete("/parties/{party_id}/products/{product_id}")
-async def remove_party_product(party_id: int, product_id: int, db: Session = Depends(get_db)):
-    party_product = db.query(PartyProducts).filter(
-        PartyProducts.party_id == party_id,
-        PartyProducts.product_id == product_id
-    ).first()
-    if not party_product:
-        raise HTTPException(status_code=404, detail="Party product not found")
-    
-    db.delete(party_product)
-    db.commit()
-    return {"message": "Product removed from party successfully"}
-
-# Payment Terms Routes
-@app.post("/payment-terms/", response_model=PaymentTermsResponse)
-async def create_payment_term(term: PaymentTermsCreate, db: Session = Depends(get_db)):
-    db_term = PaymentTerms(**term.dict())
-    db.add(db_term)
-    db.commit()
-    db.refresh(db_term)
-    return db_term
-
-@app.get("/payment-terms/", response_model=List[PaymentTermsResponse])
-async def get_payment_terms(db: Session = Depends(get_db)):
-    terms = db.query(PaymentTerms).all()
-    return terms
-
-# Party Payment Terms Routes
-@app.post("/parties/{party_id}/payment-terms/", response_model=PartyPaymentTermsResponse)
-async def add_party_payment_term(
-    party_id: int, 
-    party_term: PartyPaymentTermsCreate, 
-    db: Session = Depends(get_db)
-):
-    # Check if party exists
-    party = db.query(PartyMaster).filter(PartyMaster.party_id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    
-    # Check if payment term exists
-    payment_term = db.query(PaymentTerms).filter(PaymentTerms.term_id == party_term.term_id).first()
-    if not payment_term:
-        raise HTTPException(status_code=404, detail="Payment term not found")
-    
-    # Check if term already assigned to party
-    existing = db.query(PartyPaymentTerms).filter(
-        PartyPaymentTerms.party_id == party_id,
-        PartyPaymentTerms.term_id == party_term.term_id
-    ).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Payment term already assigned to party")
-    
-    db_party_term = PartyPaymentTerms(**party_term.dict(), party_id=party_id)
-    db.add(db_party_term)
-    db.commit()
-    db.refresh(db_party_term)
-    return db_party_term
-
-@app.get("/parties/{party_id}/payment-terms/", response_model=List[PartyPaymentTermsResponse])
-async def get_party_payment_terms(party_id: int, db: Session = Depends(get_db)):
-    party_terms = db.query(PartyPaymentTerms).filter(PartyPaymentTerms.party_id == party_id).all()
-    return party_terms
-
-# Account Groups Routes
-@app.get("/account-groups/")
-async def get_account_groups(db: Session = Depends(get_db)):
-    groups = db.query(AccountGroups).all()
-    return groups
-
-# Master Types Routes
-@app.get("/master-types/")
-async def get_master_types(db: Session = Depends(get_db)):
-    types = db.query(MasterTypes).all()
-    return types
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host=settings.HOST, port=settings.PORT)
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, JSONResponse
+from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime
+import os
+import time
+from typing import List, Optional
+
+from models import Base, engine, engines, SessionLocal, PartyMaster, PartyAddress, ContactPerson, PartyAccountDetails, BankDetails, Products, PartyProducts, PaymentTerms, PartyPaymentTerms, MasterTypes, AccountGroups, Job
+from schemas import *
+import change_feed
+import aggregates
+import repository
+import facets
+import typeahead
+import bi_export
+import billing
+import credit
+import identifiers
+import gazetteer
+import batch
+import dialect
+import audit
+import slow_query
+import profiling
+import bulk
+import party_codes
+import jobs
+from query_guard import QueryGuardMiddleware, query_budget
+import admission
+import events
+import tenancy
+
+# Create tables, including in the databases and schemas of dedicated tenants
+Base.metadata.create_all(bind=engine)
+engines.create_all(Base)
+
+from config import settings
+
+# FastAPI app
+app = FastAPI(
+    title=settings.API_TITLE,
+    description=settings.API_DESCRIPTION,
+    version=settings.API_VERSION
+)
+
+# Per-request statement tracking (see QUERY_GUARD)
+app.add_middleware(QueryGuardMiddleware)
+
+# Route context for slow statement entries (see SLOW_QUERY_*)
+app.add_middleware(slow_query.SlowQueryMiddleware)
+
+# Who made the request, for the audit trail (see AUDIT_ACTOR_HEADER)
+app.add_middleware(audit.AuditActorMiddleware)
+
+# Which tenant the request works for (see TENANT_*)
+app.add_middleware(tenancy.TenantMiddleware)
+
+# Per-class concurrency limits and load shedding (see ADMISSION_*)
+app.add_middleware(admission.AdmissionMiddleware)
+
+# Sampling profiler for flagged or randomly picked requests (see PROFILE_*)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# CORS middleware (added last so it also wraps load-shedding responses)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.on_event("startup")
+async def start_event_broker():
+    await events.broker.start()
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    await events.broker.stop()
+
+@app.on_event("startup")
+async def start_job_runner():
+    jobs.runner.start()
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    jobs.runner.shutdown()
+
+@app.on_event("startup")
+async def start_audit_writer():
+    audit.writer.start()
+
+# Registered after the job runner so entries committed by stopping jobs are flushed too
+@app.on_event("shutdown")
+async def stop_audit_writer():
+    audit.writer.stop()
+
+@app.on_event("startup")
+async def start_typeahead():
+    if settings.TYPEAHEAD_ENABLED:
+        typeahead.start()
+
+@app.on_event("startup")
+async def profile_threadpool_routes():
+    profiling.follow_threadpool(app)
+
+@app.on_event("startup")
+async def open_gazetteer():
+    # A missing or broken file stops the API here rather than failing requests
+    if settings.GAZETTEER_PATH:
+        gazetteer.get()
+
+# Dependency to get database session
+def get_db(request: Request):
+    # Operations of an atomic batch share the batch's session
+    shared = batch.shared_session(request.scope)
+    if shared is not None:
+        yield shared
+        return
+    
+    db = SessionLocal()
+    try:
+        # Check out the connection here, in the threadpool, so a saturated pool
+        # never blocks the event loop and its wait time feeds admission control
+        started = time.monotonic()
+        db.connection()
+        admission.record_pool_wait(time.monotonic() - started)
+        yield db
+    finally:
+        db.close()
+
+# Dependency to guard admin endpoints
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not settings.check_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Optimistic concurrency for party updates
+def expected_version(if_match, version):
+    """Party version an update is based on, from If-Match ("3", W/"3") or the body"""
+    if if_match and if_match.strip() != "*":
+        try:
+            return int(if_match.strip().removeprefix("W/").strip('"'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="If-Match must be a party version")
+    if version is None and if_match is None and settings.PARTY_REQUIRE_VERSION:
+        raise HTTPException(status_code=428, detail="Send If-Match or version to update a party")
+    return version
+
+def party_etag(party):
+    return f'"{party.version}"'
+
+def version_conflict(db, party_id):
+    """409 with the party as it is now, for an update based on an older version"""
+    db.rollback()
+    party = repository.get_party(db, party_id)
+    if party is None:
+        raise HTTPException(status_code=404, detail="Party not found")
+    return JSONResponse(
+        status_code=409,
+        content={
+            "detail": "Party was changed by another request",
+            "current": jsonable_encoder(PartyMasterResponse.model_validate(party)),
+        },
+        headers={"ETag": party_etag(party)}
+    )
+
+# Routes
+@app.get("/")
+async def root():
+    return {"message": "Welcome to NETAGE BI Party Master API!"}
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "timestamp": datetime.utcnow()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return admission.prometheus_metrics()
+
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries():
+    return slow_query.log.snapshot()
+
+@app.delete("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def reset_slow_queries():
+    slow_query.log.reset()
+    return {"message": "Slow query log cleared"}
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    return profiling.list_profiles()
+
+@app.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def download_profile(name: str):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name, media_type="text/plain")
+
+@app.get("/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission_stats():
+    return admission.stats()
+
+# Party Master Routes
+@app.post("/parties/", response_model=PartyMasterResponse)
+@query_budget(15)
+async def create_party(party: PartyMasterCreate, db: Session = Depends(get_db)):
+    # Check if party code already exists; the allocator's range is left to the allocator
+    if party.party_code and party_codes.allocator.owns(party.party_code):
+        raise HTTPException(status_code=400, detail=f"Party codes from {party_codes.allocator.prefix}{party_codes.allocator.start} up are assigned automatically")
+    if party.party_code and repository.party_code_exists(db, party.party_code):
+        raise HTTPException(status_code=400, detail="Party code already exists")
+    
+    try:
+        db_party = aggregates.create_party_aggregate(db, party)
+        db.commit()
+    except IntegrityError:
+        # Another request took the code between the check and the insert
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Party code already exists")
+    db.refresh(db_party)
+    return db_party
+
+@app.get("/parties/", response_model=List[PartyMasterListResponse])
+@query_budget(3)
+async def get_parties(
+    skip: int = 0, 
+    limit: int = 10, 
+    search: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    query = db.query(PartyMaster)
+    
+    if search:
+        query = query.filter(
+            dialect.contains(PartyMaster.party_name, search) |
+            dialect.contains(PartyMaster.party_code, search) |
+            dialect.contains(PartyMaster.gst_number, search)
+        )
+    
+    parties = query.offset(skip).limit(limit).all()
+    party_ids = [party.party_id for party in parties]
+    
+    # Get primary contact persons and addresses for the whole page at once
+    primary_contacts = {}
+    for contact in db.query(ContactPerson).filter(
+        ContactPerson.party_id.in_(party_ids),
+        ContactPerson.is_primary == True
+    ).order_by(ContactPerson.contact_id.desc()):
+        primary_contacts[contact.party_id] = contact
+    
+    primary_addresses = {}
+    for address in db.query(PartyAddress).filter(
+        PartyAddress.party_id.in_(party_ids),
+        PartyAddress.is_primary == True
+    ).order_by(PartyAddress.address_id.desc()):
+        primary_addresses[address.party_id] = address
+    
+    # Transform to list response format
+    result = []
+    for party in parties:
+        primary_contact = primary_contacts.get(party.party_id)
+        primary_address = primary_addresses.get(party.party_id)
+        
+        result.append(PartyMasterListResponse(
+            party_id=party.party_id,
+            party_code=party.party_code,
+            party_name=party.party_name,
+            gst_number=party.gst_number,
+            fssai_number=party.fssai_number,
+            contact_person=primary_contact.name if primary_contact else None,
+            mobile_number=party.mobile_number,
+            location=primary_address.city if primary_address else None
+        ))
+    
+    return result
+
+# Declared before /parties/{party_id} so "suggest" is not taken for a party id
+@app.get("/parties/suggest", response_model=List[PartySuggestion])
+@query_budget(0)
+async def suggest_parties(q: str, limit: Optional[int] = None):
+    if not settings.TYPEAHEAD_ENABLED:
+        raise HTTPException(status_code=404, detail="Typeahead is disabled")
+    index = typeahead.indexes.get()
+    if not index.ready:
+        raise HTTPException(status_code=503, detail="Typeahead index is loading", headers={"Retry-After": "1"})
+    return index.suggest(q, limit=limit)
+
+@app.get("/parties/{party_id}", response_model=PartyMasterResponse)
+@query_budget(5)
+async def get_party(party_id: int, response: Response, db: Session = Depends(get_db)):
+    party = repository.get_party(db, party_id)
+    if party is None:
+        raise HTTPException(status_code=404, detail="Party not found")
+    response.headers["ETag"] = party_etag(party)
+    return party
+
+@app.put("/parties/{party_id}", response_model=PartyMasterResponse)
+@query_budget(8)
+async def update_party(
+    party_id: int,
+    party_update: PartyMasterUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    version = expected_version(if_match, party_update.version)
+    db_party = repository.get_party(db, party_id)
+    if db_party is None:
+        raise HTTPException(status_code=404, detail="Party not found")
+    if version is not None and db_party.version != version:
+        return version_conflict(db, party_id)
+    
+    before = change_feed.snapshot(db_party)
+    
+    # Update only provided fields
+    update_data = party_update.dict(exclude_unset=True, exclude={"version"})
+    message = identifiers.merged_gstin_error(db_party, update_data)
+    if message:
+        raise HTTPException(status_code=422, detail=message)
+    for field, value in update_data.items():
+        setattr(db_party, field, value)
+    
+    db_party.updated_at = datetime.utcnow()
+    try:
+        # UPDATE ... WHERE version = <version read>; no row matches if another update committed first
+        db.flush()
+    except StaleDataError:
+        return version_conflict(db, party_id)
+    change_feed.record_object(db, change_feed.PARTY, change_feed.UPDATE, db_party, party_id, party_id)
+    audit.record(db, change_feed.PARTY, change_feed.UPDATE, party_id, party_id, before=before, after=change_feed.snapshot(db_party))
+    db.commit()
+    db.refresh(db_party)
+    response.headers["ETag"] = party_etag(db_party)
+    return db_party
+
+@app.delete("/parties/{party_id}")
+@query_budget(8)
+async def delete_party(party_id: int, db: Session = Depends(get_db)):
+    # One DELETE; the database cascades to the children, which still get their own tombstones
+    if not bulk.delete_parties(db, [party_id]):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    db.commit()
+    return {"message": "Party deleted successfully"}
+
+@app.post("/parties/bulk-delete", response_model=BulkOperationResponse)
+@admission.admission_class(admission.BULK)
+async def bulk_delete_parties(request: PartyBulkDelete, db: Session = Depends(get_db)):
+    if request.party_ids is None and (request.filter is None or not bulk.party_filter_clause(request.filter)):
+        raise HTTPException(status_code=400, detail="Provide party_ids or a non-empty filter")
+    
+    affected = bulk.bulk_delete_parties(db, request.party_ids, request.filter, settings.BULK_CHUNK_SIZE)
+    return {"affected": affected}
+
+# Declared before PATCH /parties/{party_id} so "bulk" is not taken for an id
+@app.patch("/parties/bulk", response_model=BulkOperationResponse)
+@admission.admission_class(admission.BULK)
+async def bulk_update_parties(request: PartyBulkUpdate, db: Session = Depends(get_db)):
+    if request.party_ids is None and (request.filter is None or not bulk.party_filter_clause(request.filter)):
+        raise HTTPException(status_code=400, detail="Provide party_ids or a non-empty filter")
+    
+    values = request.changes.dict(exclude_unset=True, exclude={"version"})
+    if not values:
+        raise HTTPException(status_code=400, detail="No changes given")
+    
+    affected = bulk.bulk_update_parties(db, values, request.party_ids, request.filter, settings.BULK_CHUNK_SIZE)
+    return {"affected": affected}
+
+@app.patch("/parties/{party_id}", response_model=PartyMasterResponse)
+@query_budget(24)
+async def update_party_aggregate(
+    party_id: int,
+    party_update: PartyAggregateUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    version = expected_version(if_match, party_update.version)
+    try:
+        db_party = aggregates.update_party_aggregate(db, party_id, party_update, version)
+    except aggregates.UnknownChild as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except aggregates.InvalidIdentifier as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    except (aggregates.VersionConflict, StaleDataError):
+        return version_conflict(db, party_id)
+    if db_party is None:
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    db.commit()
+    response.headers["ETag"] = party_etag(db_party)
+    return db_party
+
+# Address Routes
+@app.post("/parties/{party_id}/addresses/", response_model=PartyAddressResponse)
+@query_budget(4)
+async def create_party_address(
+    party_id: int, 
+    address: PartyAddressCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    db_address = PartyAddress(**address.dict(), party_id=party_id)
+    db.add(db_address)
+    db.flush()
+    change_feed.record_object(db, change_feed.ADDRESS, change_feed.INSERT, db_address, db_address.address_id, party_id)
+    db.commit()
+    db.refresh(db_address)
+    return db_address
+
+@app.get("/pincodes/{zip_code}", response_model=PinCodeResponse)
+@query_budget(0)
+async def lookup_pin_code(zip_code: str):
+    try:
+        place = gazetteer.get().lookup(zip_code)
+    except gazetteer.GazetteerUnavailable as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    if place is None:
+        raise HTTPException(status_code=404, detail="PIN code not found")
+    city, district, state = place
+    return {"zip_code": zip_code.strip(), "city": city, "district": district, "state": state}
+
+@app.get("/parties/{party_id}/addresses/", response_model=List[PartyAddressResponse])
+@query_budget(1)
+async def get_party_addresses(party_id: int, db: Session = Depends(get_db)):
+    addresses = db.query(PartyAddress).filter(PartyAddress.party_id == party_id).all()
+    return addresses
+
+# Contact Person Routes
+@app.post("/parties/{party_id}/contacts/", response_model=ContactPersonResponse)
+@query_budget(4)
+async def create_contact_person(
+    party_id: int, 
+    contact: ContactPersonCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    db_contact = ContactPerson(**contact.dict(), party_id=party_id)
+    db.add(db_contact)
+    db.flush()
+    change_feed.record_object(db, change_feed.CONTACT, change_feed.INSERT, db_contact, db_contact.contact_id, party_id)
+    db.commit()
+    db.refresh(db_contact)
+    return db_contact
+
+@app.get("/parties/{party_id}/contacts/", response_model=List[ContactPersonResponse])
+@query_budget(1)
+async def get_contact_persons(party_id: int, db: Session = Depends(get_db)):
+    contacts = db.query(ContactPerson).filter(ContactPerson.party_id == party_id).all()
+    return contacts
+
+# Account Details Routes
+@app.post("/parties/{party_id}/account-details/", response_model=PartyAccountDetailsResponse)
+@query_budget(5)
+async def create_account_details(
+    party_id: int, 
+    account: PartyAccountDetailsCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    # Check if account details already exist
+    if repository.account_details_exist(db, party_id):
+        raise HTTPException(status_code=400, detail="Account details already exist for this party")
+    
+    db_account = PartyAccountDetails(**account.dict(), party_id=party_id)
+    db.add(db_account)
+    db.flush()
+    change_feed.record_object(db, change_feed.ACCOUNT_DETAILS, change_feed.INSERT, db_account, db_account.account_id, party_id)
+    db.commit()
+    db.refresh(db_account)
+    return db_account
+
+@app.get("/parties/{party_id}/account-details/", response_model=PartyAccountDetailsResponse)
+@query_budget(1)
+async def get_account_details(party_id: int, db: Session = Depends(get_db)):
+    account = db.query(PartyAccountDetails).filter(PartyAccountDetails.party_id == party_id).first()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account details not found")
+    return account
+
+# Bank Details Routes
+@app.post("/parties/{party_id}/bank-details/", response_model=BankDetailsResponse)
+@query_budget(4)
+async def create_bank_details(
+    party_id: int, 
+    bank: BankDetailsCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    # Validate account numbers match
+    if bank.account_number != bank.confirm_account_number:
+        raise HTTPException(status_code=400, detail="Account numbers do not match")
+    
+    db_bank = BankDetails(**bank.dict(), party_id=party_id)
+    db.add(db_bank)
+    db.flush()
+    change_feed.record_object(db, change_feed.BANK_DETAILS, change_feed.INSERT, db_bank, db_bank.bank_id, party_id)
+    audit.record(db, change_feed.BANK_DETAILS, change_feed.INSERT, db_bank.bank_id, party_id, after=change_feed.snapshot(db_bank))
+    db.commit()
+    db.refresh(db_bank)
+    return db_bank
+
+@app.get("/parties/{party_id}/bank-details/", response_model=List[BankDetailsResponse])
+@query_budget(1)
+async def get_bank_details(party_id: int, db: Session = Depends(get_db)):
+    bank_details = db.query(BankDetails).filter(BankDetails.party_id == party_id).all()
+    return bank_details
+
+# Products Routes
+@app.post("/products/", response_model=ProductsResponse)
+@query_budget(4)
+async def create_product(product: ProductsCreate, db: Session = Depends(get_db)):
+    # Check if product code already exists
+    if repository.product_code_exists(db, product.product_code):
+        raise HTTPException(status_code=400, detail="Product code already exists")
+    
+    db_product = Products(**product.dict())
+    db.add(db_product)
+    db.flush()
+    change_feed.record_object(db, change_feed.PRODUCT, change_feed.INSERT, db_product, db_product.product_id)
+    db.commit()
+    db.refresh(db_product)
+    return db_product
+
+@app.get("/products/", response_model=List[ProductsResponse])
+@query_budget(1)
+async def get_products(
+    skip: int = 0, 
+    limit: int = 100, 
+    search: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    query = db.query(Products)
+    
+    if search:
+        query = query.filter(
+            dialect.contains(Products.product_name, search) |
+            dialect.contains(Products.product_code, search)
+        )
+    
+    products = query.offset(skip).limit(limit).all()
+    return products
+
+@app.get("/products/browse", response_model=ProductBrowseResponse)
+@query_budget(2)
+async def browse_products(
+    group_name: Optional[str] = None,
+    sub_group: Optional[str] = None,
+    item: Optional[str] = None,
+    stock_keeping_unit: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    filters = {"group_name": group_name, "sub_group": sub_group, "item": item, "stock_keeping_unit": stock_keeping_unit}
+    return facets.browse(db, filters, after=after, limit=limit)
+
+# Party Products Routes
+@app.post("/parties/{party_id}/products/", response_model=PartyProductsResponse)
+@query_budget(7)
+async def add_party_product(
+    party_id: int, 
+    party_product: PartyProductsCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    # Check if product exists
+    if not repository.product_exists(db, party_product.product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    # Check if product already assigned to party
+    if repository.party_product_exists(db, party_id, party_product.product_id):
+        raise HTTPException(status_code=400, detail="Product already assigned to party")
+    
+    db_party_product = PartyProducts(**party_product.dict(), party_id=party_id)
+    db.add(db_party_product)
+    db.flush()
+    change_feed.record_object(db, change_feed.PARTY_PRODUCT, change_feed.INSERT, db_party_product, db_party_product.party_product_id, party_id)
+    db.commit()
+    db.refresh(db_party_product)
+    return db_party_product
+
+@app.get("/parties/{party_id}/products/", response_model=List[PartyProductsResponse])
+@query_budget(2)
+async def get_party_products(party_id: int, db: Session = Depends(get_db)):
+    party_products = db.query(PartyProducts).options(selectinload(PartyProducts.product)).filter(PartyProducts.party_id == party_id).all()
+    return party_products
+
+@app.delete("/parties/{party_id}/products/{product_id}")
+@query_budget(3)
+async def remove_party_product(party_id: int, product_id: int, db: Session = Depends(get_db)):
+    party_product = repository.get_party_product(db, party_id, product_id)
+    if not party_product:
+        raise HTTPException(status_code=404, detail="Party product not found")
+    
+    db.delete(party_product)
+    change_feed.record_change(db, change_feed.PARTY_PRODUCT, change_feed.DELETE, party_product.party_product_id, party_id)
+    db.commit()
+    return {"message": "Product removed from party successfully"}
+
+# Payment Terms Routes
+@app.post("/payment-terms/", response_model=PaymentTermsResponse)
+@query_budget(3)
+async def create_payment_term(term: PaymentTermsCreate, db: Session = Depends(get_db)):
+    db_term = PaymentTerms(**term.dict())
+    db.add(db_term)
+    db.flush()
+    change_feed.record_object(db, change_feed.PAYMENT_TERM, change_feed.INSERT, db_term, db_term.term_id)
+    audit.record(db, change_feed.PAYMENT_TERM, change_feed.INSERT, db_term.term_id, after=change_feed.snapshot(db_term))
+    db.commit()
+    db.refresh(db_term)
+    return db_term
+
+@app.get("/payment-terms/", response_model=List[PaymentTermsResponse])
+@query_budget(1)
+async def get_payment_terms(db: Session = Depends(get_db)):
+    terms = db.query(PaymentTerms).all()
+    return terms
+
+# Party Payment Terms Routes
+@app.post("/parties/{party_id}/payment-terms/", response_model=PartyPaymentTermsResponse)
+@query_budget(7)
+async def add_party_payment_term(
+    party_id: int, 
+    party_term: PartyPaymentTermsCreate, 
+    db: Session = Depends(get_db)
+):
+    # Check if party exists
+    if not repository.party_exists(db, party_id):
+        raise HTTPException(status_code=404, detail="Party not found")
+    
+    # Check if payment term exists
+    if not repository.payment_term_exists(db, party_term.term_id):
+        raise HTTPException(status_code=404, detail="Payment term not found")
+    
+    # Check if term already assigned to party
+    if repository.party_payment_term_exists(db, party_id, party_term.term_id):
+        raise HTTPException(status_code=400, detail="Payment term already assigned to party")
+    
+    db_party_term = PartyPaymentTerms(**party_term.dict(), party_id=party_id)
+    db.add(db_party_term)
+    db.flush()
+    change_feed.record_object(db, change_feed.PARTY_PAYMENT_TERM, change_feed.INSERT, db_party_term, db_party_term.party_term_id, party_id)
+    audit.record(db, change_feed.PARTY_PAYMENT_TERM, change_feed.INSERT, db_party_term.party_term_id, party_id, after=change_feed.snapshot(db_party_term))
+    db.commit()
+    db.refresh(db_party_term)
+    return db_party_term
+
+@app.get("/parties/{party_id}/payment-terms/", response_model=List[PartyPaymentTermsResponse])
+@query_budget(2)
+async def get_party_payment_terms(party_id: int, db: Session = Depends(get_db)):
+    party_terms = db.query(PartyPaymentTerms).options(selectinload(PartyPaymentTerms.payment_term)).filter(PartyPaymentTerms.party_id == party_id).all()
+    return party_terms
+
+# Change Feed Routes
+@app.get("/changes", response_model=ChangeFeedResponse)
+async def get_changes(
+    since: int = 0,
+    limit: Optional[int] = None,
+    entity: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return change_feed.read_changes(db, since=since, limit=limit, entity=entity)
+
+@app.post("/changes/compact", response_model=ChangeCompactionResponse, dependencies=[Depends(require_admin)])
+async def compact_changes(retention_days: Optional[int] = None, db: Session = Depends(get_db)):
+    removed = change_feed.compact_changes(db, retention_days=retention_days)
+    return {"removed": removed}
+
+# Audit Routes
+@app.get("/audit", response_model=AuditPageResponse, dependencies=[Depends(require_admin)])
+@query_budget(1)
+async def get_audit(
+    entity: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    party_id: Optional[int] = None,
+    before: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    return audit.read_audit(db, entity=entity, entity_id=entity_id, party_id=party_id, before=before, limit=limit)
+
+# Event Stream Routes
+@app.get("/events")
+async def stream_events(
+    request: Request,
+    topics: Optional[str] = None,
+    last_event_id: Optional[int] = Header(None),
+    since: Optional[int] = None
+):
+    topic_set = set(topics.split(",")) if topics else set()
+    unknown = topic_set - events.TOPICS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topics: {', '.join(sorted(unknown))}")
+    
+    # EventSource sends Last-Event-ID on reconnect; `since` covers clients that cannot set headers
+    resume_from = last_event_id if last_event_id is not None else since
+    return StreamingResponse(
+        events.stream(request, topic_set, resume_from, tenancy.current()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Background Job Routes
+@app.post("/jobs", response_model=JobResponse, dependencies=[Depends(require_admin)])
+async def create_job(job: JobCreate, db: Session = Depends(get_db)):
+    if job.job_type not in jobs.HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job.job_type}")
+    
+    db_job = jobs.create_job(db, job.job_type, job.params)
+    jobs.runner.submit(db_job.job_id, db_job.job_type)
+    return jobs.job_to_dict(db_job)
+
+@app.get("/jobs", response_model=List[JobResponse])
+async def get_jobs(
+    status: Optional[str] = None,
+    job_type: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 50,
+    db: Session = Depends(get_db)
+):
+    query = db.query(Job)
+    if status:
+        query = query.filter(Job.status == status)
+    if job_type:
+        query = query.filter(Job.job_type == job_type)
+    
+    return [jobs.job_to_dict(job) for job in query.order_by(Job.job_id.desc()).offset(skip).limit(limit).all()]
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.job_id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_to_dict(job)
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobResponse, dependencies=[Depends(require_admin)])
+async def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.job_id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_to_dict(jobs.cancel_job(db, job))
+
+@app.get("/jobs/{job_id}/output", dependencies=[Depends(require_admin)])
+async def get_job_output(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.job_id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    result = jobs.job_to_dict(job)["result"] or {}
+    if job.status != jobs.COMPLETED or not result.get("path"):
+        raise HTTPException(status_code=404, detail="Job has no output file")
+    return FileResponse(result["path"], filename=os.path.basename(result["path"]))
+
+# Billing Routes
+# A plain function so the NumPy work runs in the threadpool, off the event loop
+@app.post("/billing/payment-schedule", response_model=PaymentScheduleResponse)
+@query_budget(3)
+@admission.admission_class(admission.BULK)
+def payment_schedule(request: PaymentScheduleRequest):
+    if len(request.invoices) > settings.BILLING_MAX_INVOICES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BILLING_MAX_INVOICES} invoices per call")
+    
+    invoices = request.invoices
+    columns = billing.payment_schedule(
+        [invoice.party_id for invoice in invoices],
+        [invoice.invoice_date for invoice in invoices],
+        [invoice.amount for invoice in invoices]
+    )
+    # Rows are built straight from the computed columns; validating each one
+    # again through the response model would cost more than computing them
+    names = list(columns)
+    return JSONResponse({"schedule": [dict(zip(names, row)) for row in zip(*columns.values())]})
+
+# Read-only, and on the order service's hot path: admitted as a read
+@app.post("/credit/check", response_model=CreditCheckResponse)
+@query_budget(1)
+@admission.admission_class(admission.READ)
+def check_credit(request: CreditCheckRequest):
+    if len(request.checks) > settings.CREDIT_MAX_CHECKS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.CREDIT_MAX_CHECKS} checks per call")
+    
+    checks = request.checks
+    columns = credit.check_credit(
+        [check.party_id for check in checks],
+        [check.outstanding for check in checks],
+        [check.order_amount for check in checks],
+        [check.oldest_due_date for check in checks],
+        as_of=request.as_of
+    )
+    names = list(columns)
+    return JSONResponse({"decisions": [dict(zip(names, row)) for row in zip(*columns.values())]})
+
+# Batch Routes
+@app.post("/batch", response_model=BatchResponse)
+async def run_batch(batch_request: BatchRequest, request: Request):
+    if len(batch_request.operations) > settings.BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_OPERATIONS} operations per batch")
+    
+    committed, results = await batch_runner.run(request.scope, batch_request.operations, atomic=batch_request.atomic)
+    return {"committed": committed, "results": results}
+
+batch_runner = batch.BatchRunner(app)
+
+# Identifier Validation Routes
+@app.post("/validation/identifiers", response_model=IdentifierValidationResponse)
+@query_budget(0)
+@admission.admission_class(admission.BULK)
+def validate_identifiers(request: IdentifierValidationRequest):
+    if len(request.records) > settings.VALIDATION_MAX_RECORDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.VALIDATION_MAX_RECORDS} records per call")
+    
+    results = []
+    for record in request.records:
+        errors = identifiers.validate_record(record.model_dump())
+        results.append({
+            "valid": not errors,
+            "errors": [{"field": field, "message": message} for field, message in errors],
+            "bank_name": identifiers.bank_name(identifiers.normalize(record.ifsc_code)),
+        })
+    valid = sum(result["valid"] for result in results)
+    return JSONResponse({"valid": valid, "invalid": len(results) - valid, "results": results})
+
+# BI Export Routes
+@app.get("/exports/party-products", dependencies=[Depends(require_admin)])
+@admission.admission_class(admission.BULK)
+async def export_party_products(format: str = "parquet"):
+    if format not in bi_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}")
+    try:
+        bi_export.schema()
+    except bi_export.ExportUnavailable as exc:
+        raise HTTPException(status_code=501, detail=str(exc))
+    
+    extension, media_type = bi_export.FORMATS[format]
+    filename = f"party_products-{datetime.utcnow():%Y%m%dT%H%M%S}.{extension}"
+    return StreamingResponse(
+        bi_export.stream_snapshot(format, tenancy.current()),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Account Groups Routes
+@app.get("/account-groups/")
+@query_budget(1)
+async def get_account_groups(db: Session = Depends(get_db)):
+    groups = db.query(AccountGroups).all()
+    return groups
+
+# Master Types Routes
+@app.get("/master-types/")
+@query_budget(1)
+async def get_master_types(db: Session = Depends(get_db)):
+    types = db.query(MasterTypes).all()
+    return types
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=settings.HOST, port=settings.PORT)
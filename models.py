@@ -1,199 +1,306 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Date, DECIMAL, Text, ForeignKey, UniqueConstraint
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
-from datetime import datetime
-import os
-
-from config import settings
-
-# Create SQLAlchemy engine
-engine = create_engine(settings.get_database_url())
-
-# Create session maker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Create base class for models
-Base = declarative_base()
-
-# Database Models
-class PartyMaster(Base):
-    __tablename__ = "party_master"
-    
-    party_id = Column(Integer, primary_key=True, index=True)
-    party_code = Column(String(20), unique=True, nullable=False, index=True)
-    party_name = Column(String(100), nullable=False)
-    type_of_firm = Column(String(50), nullable=False)
-    email_id = Column(String(100), nullable=False)
-    mobile_number = Column(String(15), nullable=False)
-    gst_number = Column(String(20))
-    fssai_number = Column(String(20))
-    pan_number = Column(String(20), nullable=False)
-    tan_number = Column(String(20))
-    credit_limit = Column(DECIMAL(15,2))
-    credit_days = Column(Integer)
-    udyam_aadhar_number = Column(String(20))
-    court_case_pending = Column(Boolean, default=False)
-    billing_same_as_shipping = Column(Boolean, default=False)
-    turnover_declaration_certificate = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
-    # Relationships
-    addresses = relationship("PartyAddress", back_populates="party", cascade="all, delete-orphan")
-    contact_persons = relationship("ContactPerson", back_populates="party", cascade="all, delete-orphan")
-    account_details = relationship("PartyAccountDetails", back_populates="party", cascade="all, delete-orphan")
-    bank_details = relationship("BankDetails", back_populates="party", cascade="all, delete-orphan")
-    party_products = relationship("PartyProducts", back_populates="party", cascade="all, delete-orphan")
-    party_payment_terms = relationship("PartyPaymentTerms", back_populates="party", cascade="all, delete-orphan")
-
-class PartyAddress(Base):
-    __tablename__ = "party_address"
-    
-    address_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    shipping_address = Column(Text, nullable=False)
-    country = Column(String(50), nullable=False)
-    state = Column(String(50), nullable=False)
-    district = Column(String(50))
-    city = Column(String(50))
-    zip_code = Column(String(20), nullable=False)
-    is_primary = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party = relationship("PartyMaster", back_populates="addresses")
-
-class ContactPerson(Base):
-    __tablename__ = "contact_person"
-    
-    contact_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    name = Column(String(100), nullable=False)
-    mobile_number = Column(String(15), nullable=False)
-    email_id = Column(String(100))
-    designation = Column(String(50))
-    gender = Column(String(10))
-    birth_date = Column(Date)
-    address = Column(Text)
-    aadhar_number = Column(String(20))
-    pan_number = Column(String(20))
-    is_primary = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party = relationship("PartyMaster", back_populates="contact_persons")
-
-class PartyAccountDetails(Base):
-    __tablename__ = "party_account_details"
-    
-    account_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    account_name = Column(String(100), nullable=False)
-    account_type = Column(String(50), nullable=False)
-    main_group = Column(String(50), nullable=False)
-    group_name = Column(String(50), nullable=False)
-    remarks = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party = relationship("PartyMaster", back_populates="account_details")
-
-class BankDetails(Base):
-    __tablename__ = "bank_details"
-    
-    bank_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    bank_name = Column(String(100), nullable=False)
-    branch_name = Column(String(100), nullable=False)
-    account_holder_name = Column(String(100), nullable=False)
-    account_number = Column(String(30), nullable=False)
-    confirm_account_number = Column(String(30), nullable=False)
-    account_type = Column(String(30))
-    ifsc_code = Column(String(20), nullable=False)
-    bank_address = Column(Text)
-    cancelled_cheque_image = Column(Text)  # Store as base64 or file path
-    is_primary = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party = relationship("PartyMaster", back_populates="bank_details")
-
-class Products(Base):
-    __tablename__ = "products"
-    
-    product_id = Column(Integer, primary_key=True, index=True)
-    product_code = Column(String(20), unique=True, nullable=False, index=True)
-    product_name = Column(String(100), nullable=False)
-    group_name = Column(String(50), nullable=False)
-    sub_group = Column(String(50))
-    item = Column(String(50))
-    stock_keeping_unit = Column(String(50))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party_products = relationship("PartyProducts", back_populates="product")
-
-class PartyProducts(Base):
-    __tablename__ = "party_products"
-    
-    party_product_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    product_id = Column(Integer, ForeignKey("products.product_id"))
-    quantity = Column(Integer)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    party = relationship("PartyMaster", back_populates="party_products")
-    product = relationship("Products", back_populates="party_products")
-    
-    __table_args__ = (UniqueConstraint('party_id', 'product_id', name='unique_party_product'),)
-
-class PaymentTerms(Base):
-    __tablename__ = "payment_terms"
-    
-    term_id = Column(Integer, primary_key=True, index=True)
-    term_description = Column(String(100), nullable=False)
-    payment_days = Column(Integer, nullable=False)
-    cash_discount = Column(DECIMAL(5,2))
-    variable_days = Column(Integer)
-    sms_days = Column(Integer)
-    is_default = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationship
-    party_payment_terms = relationship("PartyPaymentTerms", back_populates="payment_term")
-
-class PartyPaymentTerms(Base):
-    __tablename__ = "party_payment_terms"
-    
-    party_term_id = Column(Integer, primary_key=True, index=True)
-    party_id = Column(Integer, ForeignKey("party_master.party_id"))
-    term_id = Column(Integer, ForeignKey("payment_terms.term_id"))
-    is_default = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    party = relationship("PartyMaster", back_populates="party_payment_terms")
-    payment_term = relationship("PaymentTerms", back_populates="party_payment_terms")
-    
-    __table_args__ = (UniqueConstraint('party_id', 'term_id', name='unique_party_term'),)
-
-class MasterTypes(Base):
-    __tablename__ = "master_types"
-    
-    type_id = Column(Integer, primary_key=True, index=True)
-    type_name = Column(String(50), unique=True, nullable=False)
-    description = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class AccountGroups(Base):
-    __tablename__ = "account_groups"
-    
-    group_id = Column(Integer, primary_key=True, index=True)
-    main_group = Column(String(50), nullable=False)
-    group_name = Column(String(50), nullable=False)
-    from_account_no = Column(String(20))
-    to_account_no = Column(String(20))
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    __table_args__ = (UniqueConstraint('main_group', 'group_name', name='unique_main_group'),)
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Boolean, Date, DECIMAL, Text, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, sessionmaker
+from datetime import datetime
+import os
+
+from config import settings
+from tenancy import EngineRegistry, TenantScoped, TenantSession
+
+# Create SQLAlchemy engine
+engine = create_engine(settings.get_database_url(), **settings.get_engine_options())
+
+if settings.is_sqlite():
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in settings.get_sqlite_pragmas():
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+        # Let SQLAlchemy issue BEGIN itself so transactions and savepoints behave as on PostgreSQL
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def _begin_sqlite(conn):
+        # Straight on the driver connection so query counters and timings skip it
+        conn.connection.driver_connection.execute("BEGIN")
+
+# Tenants with their own database or schema get their own engine (see tenancy.py)
+engines = EngineRegistry(engine)
+
+# Create session maker; sessions work for the current tenant unless given one
+SessionLocal = sessionmaker(class_=TenantSession, engines=engines, autocommit=False, autoflush=False)
+
+# Create base class for models
+Base = declarative_base()
+
+# Database Models
+class PartyMaster(TenantScoped, Base):
+    __tablename__ = "party_master"
+    
+    party_id = Column(Integer, primary_key=True, index=True)
+    party_code = Column(String(20), nullable=False)  # unique per tenant
+    party_name = Column(String(100), nullable=False)
+    type_of_firm = Column(String(50), nullable=False)
+    email_id = Column(String(100), nullable=False)
+    mobile_number = Column(String(15), nullable=False)
+    gst_number = Column(String(20))
+    fssai_number = Column(String(20))
+    pan_number = Column(String(20), nullable=False)
+    tan_number = Column(String(20))
+    credit_limit = Column(DECIMAL(15,2))
+    credit_days = Column(Integer)
+    udyam_aadhar_number = Column(String(20))
+    court_case_pending = Column(Boolean, default=False)
+    billing_same_as_shipping = Column(Boolean, default=False)
+    turnover_declaration_certificate = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)  # optimistic concurrency: every UPDATE checks and bumps it
+    
+    # Relationships (children are removed by ON DELETE CASCADE in the database)
+    addresses = relationship("PartyAddress", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    contact_persons = relationship("ContactPerson", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    account_details = relationship("PartyAccountDetails", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    bank_details = relationship("BankDetails", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    party_products = relationship("PartyProducts", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    party_payment_terms = relationship("PartyPaymentTerms", back_populates="party", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (UniqueConstraint('tenant_id', 'party_code', name='unique_tenant_party_code'),)
+    __mapper_args__ = {"version_id_col": version}
+
+class PartyAddress(TenantScoped, Base):
+    __tablename__ = "party_address"
+    
+    address_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"), index=True)
+    shipping_address = Column(Text, nullable=False)
+    country = Column(String(50), nullable=False)
+    state = Column(String(50), nullable=False)
+    district = Column(String(50))
+    city = Column(String(50))
+    zip_code = Column(String(20), nullable=False)
+    is_primary = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    
+    # Relationship
+    party = relationship("PartyMaster", back_populates="addresses")
+    
+    __mapper_args__ = {"version_id_col": version}
+
+class ContactPerson(TenantScoped, Base):
+    __tablename__ = "contact_person"
+    
+    contact_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"), index=True)
+    name = Column(String(100), nullable=False)
+    mobile_number = Column(String(15), nullable=False)
+    email_id = Column(String(100))
+    designation = Column(String(50))
+    gender = Column(String(10))
+    birth_date = Column(Date)
+    address = Column(Text)
+    aadhar_number = Column(String(20))
+    pan_number = Column(String(20))
+    is_primary = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    
+    # Relationship
+    party = relationship("PartyMaster", back_populates="contact_persons")
+    
+    __mapper_args__ = {"version_id_col": version}
+
+class PartyAccountDetails(TenantScoped, Base):
+    __tablename__ = "party_account_details"
+    
+    account_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"), index=True)
+    account_name = Column(String(100), nullable=False)
+    account_type = Column(String(50), nullable=False)
+    main_group = Column(String(50), nullable=False)
+    group_name = Column(String(50), nullable=False)
+    remarks = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    
+    # Relationship
+    party = relationship("PartyMaster", back_populates="account_details")
+    
+    __mapper_args__ = {"version_id_col": version}
+
+class BankDetails(TenantScoped, Base):
+    __tablename__ = "bank_details"
+    
+    bank_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"), index=True)
+    bank_name = Column(String(100), nullable=False)
+    branch_name = Column(String(100), nullable=False)
+    account_holder_name = Column(String(100), nullable=False)
+    account_number = Column(String(30), nullable=False)
+    confirm_account_number = Column(String(30), nullable=False)
+    account_type = Column(String(30))
+    ifsc_code = Column(String(20), nullable=False)
+    bank_address = Column(Text)
+    cancelled_cheque_image = Column(Text)  # Store as base64 or file path
+    is_primary = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    
+    # Relationship
+    party = relationship("PartyMaster", back_populates="bank_details")
+    
+    __mapper_args__ = {"version_id_col": version}
+
+class Products(TenantScoped, Base):
+    __tablename__ = "products"
+    
+    product_id = Column(Integer, primary_key=True, index=True)
+    product_code = Column(String(20), nullable=False)  # unique per tenant
+    product_name = Column(String(100), nullable=False)
+    group_name = Column(String(50), nullable=False)
+    sub_group = Column(String(50))
+    item = Column(String(50))
+    stock_keeping_unit = Column(String(50))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    party_products = relationship("PartyProducts", back_populates="product")
+    
+    # Facet browsing filters on a prefix of the hierarchy, or on the unit alone, within a tenant
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'product_code', name='unique_tenant_product_code'),
+        Index('ix_products_tenant_hierarchy', 'tenant_id', 'group_name', 'sub_group', 'item', 'stock_keeping_unit'),
+        Index('ix_products_tenant_unit', 'tenant_id', 'stock_keeping_unit', 'group_name'),
+    )
+
+class PartyProducts(TenantScoped, Base):
+    __tablename__ = "party_products"
+    
+    party_product_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"))  # leading column of the unique constraint
+    product_id = Column(Integer, ForeignKey("products.product_id"))
+    quantity = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    party = relationship("PartyMaster", back_populates="party_products")
+    product = relationship("Products", back_populates="party_products")
+    
+    __table_args__ = (UniqueConstraint('party_id', 'product_id', name='unique_party_product'),)
+
+class PaymentTerms(TenantScoped, Base):
+    __tablename__ = "payment_terms"
+    
+    term_id = Column(Integer, primary_key=True, index=True)
+    term_description = Column(String(100), nullable=False)
+    payment_days = Column(Integer, nullable=False)
+    cash_discount = Column(DECIMAL(5,2))
+    variable_days = Column(Integer)
+    sms_days = Column(Integer)
+    is_default = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    party_payment_terms = relationship("PartyPaymentTerms", back_populates="payment_term")
+
+class PartyPaymentTerms(TenantScoped, Base):
+    __tablename__ = "party_payment_terms"
+    
+    party_term_id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("party_master.party_id", ondelete="CASCADE"))  # leading column of the unique constraint
+    term_id = Column(Integer, ForeignKey("payment_terms.term_id"))
+    is_default = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    party = relationship("PartyMaster", back_populates="party_payment_terms")
+    payment_term = relationship("PaymentTerms", back_populates="party_payment_terms")
+    
+    __table_args__ = (UniqueConstraint('party_id', 'term_id', name='unique_party_term'),)
+
+class MasterTypes(TenantScoped, Base):
+    __tablename__ = "master_types"
+    
+    type_id = Column(Integer, primary_key=True, index=True)
+    type_name = Column(String(50), nullable=False)
+    description = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (UniqueConstraint('tenant_id', 'type_name', name='unique_tenant_type_name'),)
+
+class AccountGroups(TenantScoped, Base):
+    __tablename__ = "account_groups"
+    
+    group_id = Column(Integer, primary_key=True, index=True)
+    main_group = Column(String(50), nullable=False)
+    group_name = Column(String(50), nullable=False)
+    from_account_no = Column(String(20))
+    to_account_no = Column(String(20))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (UniqueConstraint('tenant_id', 'main_group', 'group_name', name='unique_main_group'),)
+
+class ChangeLog(TenantScoped, Base):
+    __tablename__ = "change_log"
+    
+    # Monotonic sequence used as the sync cursor
+    change_id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String(30), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    party_id = Column(Integer, index=True)
+    operation = Column(String(10), nullable=False)  # insert / update / delete
+    payload = Column(Text)  # JSON snapshot of the row after the change, empty for deletes
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index('ix_change_log_entity', 'entity', 'entity_id'),
+        Index('ix_change_log_tenant', 'tenant_id', 'change_id'),
+    )
+
+class AuditLog(TenantScoped, Base):
+    __tablename__ = "audit_log"
+    
+    audit_id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String(30), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    party_id = Column(Integer, index=True)
+    action = Column(String(10), nullable=False)  # insert / update / delete
+    actor = Column(String(100))
+    before = Column(Text)  # JSON snapshot of the row before the change, empty for inserts
+    after = Column(Text)  # JSON snapshot of the row after the change, empty for deletes
+    changed_at = Column(DateTime, nullable=False)  # commit time of the change, not of the flush
+    
+    __table_args__ = (
+        Index('ix_audit_log_entity', 'entity', 'entity_id'),
+        Index('ix_audit_log_tenant', 'tenant_id', 'audit_id'),
+    )
+
+class PartyCodeBlock(Base):
+    __tablename__ = "party_code_blocks"
+    __shared__ = True  # codes are allocated from one sequence for every tenant
+    
+    # The sequence behind block_id is the hi part of hi/lo party code allocation
+    block_id = Column(Integer, primary_key=True, index=True)
+    reserved_by = Column(String(100))  # host:pid of the worker that holds the block
+    reserved_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(TenantScoped, Base):
+    __tablename__ = "jobs"
+    __shared__ = True  # one queue in the main database; rows still belong to a tenant
+    
+    job_id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String(50), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued / running / completed / failed / cancelled
+    params = Column(Text)  # JSON
+    cursor = Column(Text)  # JSON checkpoint of the last committed chunk
+    processed = Column(Integer, default=0)
+    total = Column(Integer)
+    result = Column(Text)  # JSON
+    error = Column(Text)
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
@@ -0,0 +1,111 @@
+import os
+import re
+import socket
+import threading
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import engine, PartyCodeBlock
+
+# Session info key holding the blocks reserved in the session's transaction
+SESSION_BLOCKS = "party_code_blocks"
+
+
+class PartyCodeAllocator:
+    """Hands out unique party codes from blocks reserved in the database (hi/lo).
+
+    Each block costs one INSERT into ``party_code_blocks``, whose id sequence
+    provides the hi part; the codes inside a block are counted out in memory.
+    Block ``n`` covers ``start + (n - 1) * block_size`` up to the next block,
+    so codes never collide across workers and increase within each worker.
+    Codes left in a block when a worker stops are skipped, not reused.
+    """
+
+    def __init__(self, prefix=None, start=None, block_size=None):
+        self.prefix = settings.PARTY_CODE_PREFIX if prefix is None else prefix
+        self.start = settings.PARTY_CODE_START if start is None else start
+        self.block_size = block_size or settings.PARTY_CODE_BLOCK_SIZE
+        self.blocks_reserved = 0
+        self._block = [0, 0]  # next and end of the block shared by the worker
+        self._lock = threading.Lock()
+        self._pattern = re.compile(rf"{re.escape(self.prefix)}(\d+)")
+
+    def number(self, code):
+        """The number of a code in the range the allocator hands out, else None"""
+        match = self._pattern.fullmatch(code or "")
+        return int(match.group(1)) if match and int(match.group(1)) >= self.start else None
+
+    def owns(self, code):
+        """Whether ``code`` lies in the range the allocator hands out"""
+        return self.number(code) is not None
+
+    def block_of(self, code):
+        """Id of the block that hands out ``code``, which the allocator must own"""
+        return (self.number(code) - self.start) // self.block_size + 1
+
+    def _reserve_block(self, conn):
+        hi = conn.execute(
+            insert(PartyCodeBlock).values(reserved_by=f"{socket.gethostname()}:{os.getpid()}"[:100])
+            .returning(PartyCodeBlock.block_id)
+        ).scalar_one()
+        self.blocks_reserved += 1
+        start = self.start + (hi - 1) * self.block_size
+        return [start, start + self.block_size]
+
+    def _count_out(self, block, count):
+        stop = min(block[1], block[0] + count)
+        codes = [f"{self.prefix}{value}" for value in range(block[0], stop)]
+        block[0] = stop
+        return codes
+
+    def take(self, count, db=None):
+        """Allocate ``count`` codes, reserving as many blocks as that needs.
+
+        Blocks are reserved in a transaction of their own, so they stay taken
+        whatever the caller's transaction does. SQLite has one writer at a time,
+        though, and that connection would wait for the write lock ``db`` may
+        hold, so there a block is reserved in ``db``'s transaction instead. It
+        serves that session only until it commits and is dropped on rollback,
+        which gives the block back.
+        """
+        in_transaction = db is not None and settings.is_sqlite()
+        codes = []
+        while len(codes) < count:
+            if in_transaction:
+                block = db.info.setdefault(SESSION_BLOCKS, {}).get(self)
+                if block:
+                    codes.extend(self._count_out(block, count - len(codes)))
+            with self._lock:
+                codes.extend(self._count_out(self._block, count - len(codes)))
+                if len(codes) < count and not in_transaction:
+                    with engine.begin() as conn:
+                        self._block = self._reserve_block(conn)
+            if len(codes) < count and in_transaction:
+                # Outside the lock: the insert may wait for another session's transaction
+                db.info[SESSION_BLOCKS][self] = self._reserve_block(db.connection(bind_arguments={"mapper": PartyCodeBlock.__mapper__}))
+        return codes
+
+    def next_code(self, db=None):
+        return self.take(1, db)[0]
+
+    def _adopt(self, block):
+        # A committed session block keeps serving the worker once its own block runs out
+        with self._lock:
+            if self._block[0] >= self._block[1]:
+                self._block = block
+
+
+@event.listens_for(Session, "after_commit")
+def _adopt_session_blocks(session):
+    for allocator, block in session.info.pop(SESSION_BLOCKS, {}).items():
+        allocator._adopt(block)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_session_blocks(session):
+    session.info.pop(SESSION_BLOCKS, None)
+
+
+allocator = PartyCodeAllocator()
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from config import settings
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+SUFFIX = ".folded"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9]+")
+
+# Sampler of the request being served, seen by the worker threads it hands work to
+_sampler = contextvars.ContextVar("profile_sampler", default=None)
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Samples the stacks of the threads serving one request at a fixed interval.
+
+    The thread the sampler is made for is sampled throughout; worker threads
+    are added while they run the request's sync endpoint or dependencies.
+    Stacks are counted in the folded format ("root;caller;callee count") that
+    flamegraph.pl, speedscope and most flame graph viewers read.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def add_thread(self, thread_id):
+        with self._lock:
+            self.thread_ids.add(thread_id)
+
+    def remove_thread(self, thread_id):
+        with self._lock:
+            self.thread_ids.discard(thread_id)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                thread_ids = list(self.thread_ids)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _sampled_in_worker(call):
+    """Wrap a sync endpoint or dependency so the worker thread running it joins the request's sampler"""
+    @functools.wraps(call)
+    def run(*args, **kwargs):
+        sampler = _sampler.get()
+        if sampler is None:
+            return call(*args, **kwargs)
+        thread_id = threading.get_ident()
+        sampler.add_thread(thread_id)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            sampler.remove_thread(thread_id)
+    run.__profiled__ = True
+    return run
+
+
+def follow_threadpool(app):
+    """Let profiles follow requests into the threadpool.
+
+    FastAPI runs plain ``def`` endpoints and dependencies on worker threads,
+    out of sight of the event loop thread's stack. Their calls are wrapped so
+    the worker is sampled while it runs them for a profiled request.
+    Generator dependencies are left alone.
+    """
+    def wrap(dependant):
+        call = dependant.call
+        if inspect.isfunction(call) and not getattr(call, "__profiled__", False) and not (
+            inspect.iscoroutinefunction(call) or inspect.isgeneratorfunction(call) or inspect.isasyncgenfunction(call)
+        ):
+            dependant.call = _sampled_in_worker(call)
+        for sub_dependant in dependant.dependencies:
+            wrap(sub_dependant)
+
+    for route in app.routes:
+        dependant = getattr(route, "dependant", None)
+        if dependant is not None:
+            wrap(dependant)
+
+
+def profile_dir():
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    return settings.PROFILE_DIR
+
+
+def list_profiles():
+    """Stored profiles, newest first"""
+    directory = profile_dir()
+    profiles = []
+    for name in os.listdir(directory):
+        if not name.endswith(SUFFIX):
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        profiles.append({"name": name, "size": stat.st_size, "created_at": datetime.utcfromtimestamp(stat.st_mtime)})
+    profiles.sort(key=lambda profile: profile["name"], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, or None for names that are not listed profiles"""
+    if os.path.basename(name) != name or not name.endswith(SUFFIX):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def save_profile(scope, sampler, elapsed):
+    """Write a finished profile and drop the oldest ones beyond PROFILE_MAX_FILES"""
+    slug = _UNSAFE.sub("-", scope["path"]).strip("-")[:60] or "root"
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    name = f"{stamp}-{scope['method']}-{slug}-{int(elapsed * 1000)}ms{SUFFIX}"
+    with open(os.path.join(profile_dir(), name), "w") as output:
+        output.write(sampler.folded())
+
+    for profile in list_profiles()[settings.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(profile_dir(), profile["name"]))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+def requested(scope):
+    """Whether a request asked to be profiled (admin only) or was picked by sampling"""
+    headers = dict(scope["headers"])
+    flag = headers.get(PROFILE_HEADER, b"").decode("latin-1")
+    if not flag:
+        flag = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile", [""])[0]
+    if flag.lower() in ("1", "true", "yes"):
+        token = headers.get(ADMIN_TOKEN_HEADER)
+        return settings.check_admin_token(token.decode("latin-1") if token is not None else None)
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    """Runs a sampling profiler over selected requests.
+
+    A request is profiled when it sends ``X-Profile: 1`` (or ``?profile=1``)
+    together with a valid admin token, or when it is picked at random with
+    probability PROFILE_SAMPLE_RATE. The event loop thread serving it is
+    sampled every PROFILE_INTERVAL_MS, so requests running concurrently on the
+    same loop can show up in the profile too, and so are the worker threads
+    running its sync endpoint and dependencies (see ``follow_threadpool``).
+    The profile name is returned in the ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.PROFILE_ENABLED or not requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = Sampler(threading.get_ident(), settings.PROFILE_INTERVAL_MS / 1000)
+        name = None
+        started = time.perf_counter()
+        sampler.start()
+        token = _sampler.set(sampler)
+
+        async def profiled_send(message):
+            nonlocal name
+            if message["type"] == "http.response.start":
+                # The body is usually complete by now; later chunks are not profiled
+                await asyncio.to_thread(sampler.stop)
+                name = await asyncio.to_thread(save_profile, scope, sampler, time.perf_counter() - started)
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", name.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            _sampler.reset(token)
+            if name is None:
+                await asyncio.to_thread(sampler.stop)
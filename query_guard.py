@@ -0,0 +1,134 @@
+import contextvars
+import json
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("request_queries", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+@dataclass
+class RequestQueries:
+    """Statements issued while serving one request"""
+    path: str
+    count: int = 0
+    shapes: Counter = field(default_factory=Counter)
+
+    def repeated(self, threshold):
+        """Read shapes issued more than ``threshold`` times.
+
+        Only SELECTs count: an N+1 is a read pattern, while repeated INSERTs
+        of child rows are how some drivers execute one multi-row flush.
+        """
+        return {
+            shape: count for shape, count in self.shapes.items()
+            if count > threshold and shape.startswith("SELECT")
+        }
+
+
+def normalize(statement):
+    """Reduce a statement to its shape: literals and expanded IN lists collapse to one placeholder"""
+    statement = _WHITESPACE.sub(" ", statement.strip())
+    statement = _STRING.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(?)", statement)
+    return _NUMBER.sub("?", statement)
+
+
+def current():
+    """The statement tracker of the request being served, if any"""
+    return _current.get()
+
+
+def query_budget(max_queries):
+    """Declare how many statements a route may issue per request"""
+    def decorate(func):
+        func.__query_budget__ = max_queries
+        return func
+    return decorate
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _track_statement(conn, cursor, statement, parameters, context, executemany):
+    queries = _current.get()
+    if queries is not None:
+        queries.count += 1
+        queries.shapes[normalize(statement)] += 1
+
+
+class QueryGuardMiddleware:
+    """Counts statements per request and flags N+1 patterns and budget overruns.
+
+    ``QUERY_GUARD=log`` logs violations, ``QUERY_GUARD=raise`` replaces the
+    response with a 500 so the test suite fails on them. Both add
+    ``X-Query-Count`` (and ``X-Query-Budget`` when declared) headers.
+    """
+
+    def __init__(self, app, mode=None):
+        self.app = app
+        self.mode = mode or settings.QUERY_GUARD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(path=scope["path"])
+        token = _current.set(queries)
+        replaced = False
+
+        async def guarded_send(message):
+            nonlocal replaced
+            if replaced:
+                return
+            if message["type"] == "http.response.start":
+                violations, budget = self._check(scope, queries)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(queries.count).encode()))
+                if budget is not None:
+                    headers.append((b"x-query-budget", str(budget).encode()))
+                if violations and self.mode == "raise":
+                    replaced = True
+                    await self._send_violation(send, headers, violations)
+                    return
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, guarded_send)
+        finally:
+            _current.reset(token)
+
+    def _check(self, scope, queries):
+        route = scope.get("route")
+        route_path = getattr(route, "path", scope["path"])
+        budget = getattr(scope.get("endpoint"), "__query_budget__", None)
+
+        violations = []
+        if budget is not None and queries.count > budget:
+            violations.append(f"{queries.count} statements exceed the budget of {budget}")
+        for shape, count in queries.repeated(settings.QUERY_GUARD_REPEAT_THRESHOLD).items():
+            violations.append(f"possible N+1: statement issued {count} times: {shape[:200]}")
+
+        for violation in violations:
+            logger.warning("Query guard on %s %s: %s", scope["method"], route_path, violation)
+        return violations, budget
+
+    async def _send_violation(self, send, headers, violations):
+        body = json.dumps({"detail": "Query guard violation", "violations": violations}).encode()
+        headers = [(name, value) for name, value in headers if name.lower() not in (b"content-length", b"content-type")]
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": 500, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,110 @@
+"""Hot lookup queries built as cached lambda statements.
+
+``lambda_stmt`` builds and compiles each statement once per call site; later
+calls only extract the new parameter values and reuse the cached SQL instead
+of constructing a ``Query`` and compiling it again.
+
+Each lambda filters on the session's tenant itself. The session's own tenant
+option cannot be added to a lambda statement, which would keep the bound
+values of its first call, so ``TenantSession`` leaves statements executed
+with ``tenancy.LAMBDA_SCOPED`` alone.
+"""
+from sqlalchemy import lambda_stmt, select, exists
+
+from models import PartyMaster, PartyAccountDetails, Products, PaymentTerms, PartyProducts, PartyPaymentTerms
+import tenancy
+
+
+def _tenant(db):
+    tenant = getattr(db, "tenant", None) or tenancy.current()
+    if tenant == tenancy.ALL_TENANTS:
+        raise ValueError("Lookups work for one tenant, not ALL_TENANTS")
+    return tenant
+
+
+def _execute(db, stmt):
+    return db.execute(stmt, execution_options={tenancy.LAMBDA_SCOPED: True})
+
+
+def get_party(db, party_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(PartyMaster).where(PartyMaster.party_id == party_id, PartyMaster.tenant_id == tenant))
+    return _execute(db, stmt).scalars().first()
+
+
+def party_exists(db, party_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PartyMaster.party_id).where(
+        PartyMaster.party_id == party_id, PartyMaster.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def party_code_exists(db, party_code):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PartyMaster.party_id).where(
+        PartyMaster.party_code == party_code, PartyMaster.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def account_details_exist(db, party_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PartyAccountDetails.account_id).where(
+        PartyAccountDetails.party_id == party_id, PartyAccountDetails.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def product_exists(db, product_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(Products.product_id).where(
+        Products.product_id == product_id, Products.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def product_code_exists(db, product_code):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(Products.product_id).where(
+        Products.product_code == product_code, Products.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def payment_term_exists(db, term_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PaymentTerms.term_id).where(
+        PaymentTerms.term_id == term_id, PaymentTerms.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def get_party_product(db, party_id, product_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(PartyProducts).where(
+        PartyProducts.party_id == party_id,
+        PartyProducts.product_id == product_id,
+        PartyProducts.tenant_id == tenant
+    ))
+    return _execute(db, stmt).scalars().first()
+
+
+def party_product_exists(db, party_id, product_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PartyProducts.party_product_id).where(
+        PartyProducts.party_id == party_id,
+        PartyProducts.product_id == product_id,
+        PartyProducts.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
+
+
+def party_payment_term_exists(db, party_id, term_id):
+    tenant = _tenant(db)
+    stmt = lambda_stmt(lambda: select(exists(PartyPaymentTerms.party_term_id).where(
+        PartyPaymentTerms.party_id == party_id,
+        PartyPaymentTerms.term_id == term_id,
+        PartyPaymentTerms.tenant_id == tenant
+    )))
+    return _execute(db, stmt).scalar()
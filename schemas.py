@@ -1,259 +1,505 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime, date
-from typing import List, Optional
-
-# Party Address Schemas
-class PartyAddressBase(BaseModel):
-    shipping_address: str
-    country: str
-    state: str
-    district: Optional[str] = None
-    city: Optional[str] = None
-    zip_code: str
-    is_primary: bool = True
-
-class PartyAddressCreate(PartyAddressBase):
-    pass
-
-class PartyAddressResponse(PartyAddressBase):
-    address_id: int
-    party_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Contact Person Schemas
-class ContactPersonBase(BaseModel):
-    name: str
-    mobile_number: str
-    email_id: Optional[str] = None
-    designation: Optional[str] = None
-    gender: Optional[str] = None
-    birth_date: Optional[date] = None
-    address: Optional[str] = None
-    aadhar_number: Optional[str] = None
-    pan_number: Optional[str] = None
-    is_primary: bool = True
-
-class ContactPersonCreate(ContactPersonBase):
-    pass
-
-class ContactPersonResponse(ContactPersonBase):
-    contact_id: int
-    party_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Party Account Details Schemas
-class PartyAccountDetailsBase(BaseModel):
-    account_name: str
-    account_type: str
-    main_group: str
-    group_name: str
-    remarks: Optional[str] = None
-
-class PartyAccountDetailsCreate(PartyAccountDetailsBase):
-    pass
-
-class PartyAccountDetailsResponse(PartyAccountDetailsBase):
-    account_id: int
-    party_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Bank Details Schemas
-class BankDetailsBase(BaseModel):
-    bank_name: str
-    branch_name: str
-    account_holder_name: str
-    account_number: str
-    confirm_account_number: str
-    account_type: Optional[str] = None
-    ifsc_code: str
-    bank_address: Optional[str] = None
-    is_primary: bool = True
-
-class BankDetailsCreate(BankDetailsBase):
-    pass
-
-class BankDetailsResponse(BankDetailsBase):
-    bank_id: int
-    party_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Products Schemas
-class ProductsBase(BaseModel):
-    product_code: str
-    product_name: str
-    group_name: str
-    sub_group: Optional[str] = None
-    item: Optional[str] = None
-    stock_keeping_unit: Optional[str] = None
-
-class ProductsCreate(ProductsBase):
-    pass
-
-class ProductsResponse(ProductsBase):
-    product_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Party Products Schemas
-class PartyProductsBase(BaseModel):
-    product_id: int
-    quantity: Optional[int] = None
-
-class PartyProductsCreate(PartyProductsBase):
-    pass
-
-class PartyProductsResponse(PartyProductsBase):
-    party_product_id: int
-    party_id: int
-    created_at: datetime
-    product: ProductsResponse
-    
-    class Config:
-        from_attributes = True
-
-# Payment Terms Schemas
-class PaymentTermsBase(BaseModel):
-    term_description: str
-    payment_days: int
-    cash_discount: Optional[float] = None
-    variable_days: Optional[int] = None
-    sms_days: Optional[int] = None
-    is_default: bool = False
-
-class PaymentTermsCreate(PaymentTermsBase):
-    pass
-
-class PaymentTermsResponse(PaymentTermsBase):
-    term_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Party Payment Terms Schemas
-class PartyPaymentTermsBase(BaseModel):
-    term_id: int
-    is_default: bool = False
-
-class PartyPaymentTermsCreate(PartyPaymentTermsBase):
-    pass
-
-class PartyPaymentTermsResponse(PartyPaymentTermsBase):
-    party_term_id: int
-    party_id: int
-    created_at: datetime
-    payment_term: PaymentTermsResponse
-    
-    class Config:
-        from_attributes = True
-
-# Party Master Schemas
-class PartyMasterBase(BaseModel):
-    party_code: str
-    party_name: str
-    type_of_firm: str
-    email_id: str
-    mobile_number: str
-    gst_number: Optional[str] = None
-    fssai_number: Optional[str] = None
-    pan_number: str
-    tan_number: Optional[str] = None
-    credit_limit: Optional[float] = None
-    credit_days: Optional[int] = None
-    udyam_aadhar_number: Optional[str] = None
-    court_case_pending: bool = False
-    billing_same_as_shipping: bool = False
-    turnover_declaration_certificate: Optional[str] = None
-
-class PartyMasterCreate(PartyMasterBase):
-    addresses: Optional[List[PartyAddressCreate]] = []
-    contact_persons: Optional[List[ContactPersonCreate]] = []
-    account_details: Optional[PartyAccountDetailsCreate] = None
-    bank_details: Optional[BankDetailsCreate] = None
-
-class PartyMasterUpdate(BaseModel):
-    party_name: Optional[str] = None
-    type_of_firm: Optional[str] = None
-    email_id: Optional[str] = None
-    mobile_number: Optional[str] = None
-    gst_number: Optional[str] = None
-    fssai_number: Optional[str] = None
-    pan_number: Optional[str] = None
-    tan_number: Optional[str] = None
-    credit_limit: Optional[float] = None
-    credit_days: Optional[int] = None
-    udyam_aadhar_number: Optional[str] = None
-    court_case_pending: Optional[bool] = None
-    billing_same_as_shipping: Optional[bool] = None
-    turnover_declaration_certificate: Optional[str] = None
-
-class PartyMasterResponse(PartyMasterBase):
-    party_id: int
-    created_at: datetime
-    updated_at: datetime
-    addresses: List[PartyAddressResponse] = []
-    contact_persons: List[ContactPersonResponse] = []
-    account_details: Optional[PartyAccountDetailsResponse] = None
-    bank_details: Optional[BankDetailsResponse] = None
-    
-    class Config:
-        from_attributes = True
-
-class PartyMasterListResponse(BaseModel):
-    party_id: int
-    party_code: str
-    party_name: str
-    gst_number: Optional[str]
-    fssai_number: Optional[str]
-    contact_person: Optional[str]
-    mobile_number: str
-    location: Optional[str]
-    
-    class Config:
-        from_attributes = True
-
-# Master Types Schemas
-class MasterTypesBase(BaseModel):
-    type_name: str
-    description: Optional[str] = None
-
-class MasterTypesCreate(MasterTypesBase):
-    pass
-
-class MasterTypesResponse(MasterTypesBase):
-    type_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
-
-# Account Groups Schemas
-class AccountGroupsBase(BaseModel):
-    main_group: str
-    group_name: str
-    from_account_no: Optional[str] = None
-    to_account_no: Optional[str] = None
-
-class AccountGroupsCreate(AccountGroupsBase):
-    pass
-
-class AccountGroupsResponse(AccountGroupsBase):
-    group_id: int
-    created_at: datetime
-    
-    class Config:
-        from_attributes = True
+from pydantic import BaseModel, EmailStr, field_validator, model_validator
+from datetime import datetime, date
+from typing import Any, Dict, List, Optional
+
+import identifiers
+import gazetteer
+
+# Checks the PAN, GSTIN, IFSC and FSSAI fields of the schemas that write them.
+# Response schemas do not inherit it, so rows stored before it still read back.
+class IdentifierChecks(BaseModel):
+    @field_validator(*identifiers.CHECKS, check_fields=False)
+    @classmethod
+    def _check_identifier(cls, value, info):
+        if value is None:
+            return value
+        normalized = identifiers.normalize(value)
+        if normalized is None:
+            if cls.model_fields[info.field_name].is_required():
+                raise ValueError("must not be blank")
+            return None
+        message = identifiers.CHECKS[info.field_name](normalized)
+        if message:
+            raise ValueError(message)
+        return normalized
+    
+    @model_validator(mode="after")
+    def _check_gstin_pan(self):
+        gst_number, pan_number = getattr(self, "gst_number", None), getattr(self, "pan_number", None)
+        if gst_number and pan_number:
+            message = identifiers.gstin_error(gst_number, pan_number)
+            if message:
+                raise ValueError(message)
+        return self
+
+# Party Address Schemas
+class PartyAddressBase(BaseModel):
+    shipping_address: str
+    country: str
+    state: str
+    district: Optional[str] = None
+    city: Optional[str] = None
+    zip_code: str
+    is_primary: bool = True
+
+class PartyAddressCreate(PartyAddressBase):
+    @model_validator(mode="after")
+    def _normalize_place(self):
+        return gazetteer.normalize_address(self)
+
+class PartyAddressResponse(PartyAddressBase):
+    address_id: int
+    party_id: int
+    created_at: datetime
+    version: int
+    
+    class Config:
+        from_attributes = True
+
+class PinCodeResponse(BaseModel):
+    zip_code: str
+    city: str
+    district: str
+    state: str
+
+# Contact Person Schemas
+class ContactPersonBase(BaseModel):
+    name: str
+    mobile_number: str
+    email_id: Optional[str] = None
+    designation: Optional[str] = None
+    gender: Optional[str] = None
+    birth_date: Optional[date] = None
+    address: Optional[str] = None
+    aadhar_number: Optional[str] = None
+    pan_number: Optional[str] = None
+    is_primary: bool = True
+
+class ContactPersonCreate(ContactPersonBase):
+    pass
+
+class ContactPersonResponse(ContactPersonBase):
+    contact_id: int
+    party_id: int
+    created_at: datetime
+    version: int
+    
+    class Config:
+        from_attributes = True
+
+# Party Account Details Schemas
+class PartyAccountDetailsBase(BaseModel):
+    account_name: str
+    account_type: str
+    main_group: str
+    group_name: str
+    remarks: Optional[str] = None
+
+class PartyAccountDetailsCreate(PartyAccountDetailsBase):
+    pass
+
+class PartyAccountDetailsResponse(PartyAccountDetailsBase):
+    account_id: int
+    party_id: int
+    created_at: datetime
+    version: int
+    
+    class Config:
+        from_attributes = True
+
+# Bank Details Schemas
+class BankDetailsBase(BaseModel):
+    bank_name: str
+    branch_name: str
+    account_holder_name: str
+    account_number: str
+    confirm_account_number: str
+    account_type: Optional[str] = None
+    ifsc_code: str
+    bank_address: Optional[str] = None
+    is_primary: bool = True
+
+class BankDetailsCreate(IdentifierChecks, BankDetailsBase):
+    pass
+
+class BankDetailsResponse(BankDetailsBase):
+    bank_id: int
+    party_id: int
+    created_at: datetime
+    version: int
+    
+    class Config:
+        from_attributes = True
+
+# Products Schemas
+class ProductsBase(BaseModel):
+    product_code: str
+    product_name: str
+    group_name: str
+    sub_group: Optional[str] = None
+    item: Optional[str] = None
+    stock_keeping_unit: Optional[str] = None
+
+class ProductsCreate(ProductsBase):
+    pass
+
+class ProductsResponse(ProductsBase):
+    product_id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class ProductFacetValue(BaseModel):
+    value: str
+    count: int
+
+class ProductBrowseResponse(BaseModel):
+    products: List[ProductsResponse]
+    next_cursor: Optional[int] = None
+    total: int
+    facets: Dict[str, List[ProductFacetValue]]
+
+# Party Products Schemas
+class PartyProductsBase(BaseModel):
+    product_id: int
+    quantity: Optional[int] = None
+
+class PartyProductsCreate(PartyProductsBase):
+    pass
+
+class PartyProductsResponse(PartyProductsBase):
+    party_product_id: int
+    party_id: int
+    created_at: datetime
+    product: ProductsResponse
+    
+    class Config:
+        from_attributes = True
+
+# Payment Terms Schemas
+class PaymentTermsBase(BaseModel):
+    term_description: str
+    payment_days: int
+    cash_discount: Optional[float] = None
+    variable_days: Optional[int] = None
+    sms_days: Optional[int] = None
+    is_default: bool = False
+
+class PaymentTermsCreate(PaymentTermsBase):
+    pass
+
+class PaymentTermsResponse(PaymentTermsBase):
+    term_id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Billing Schemas
+class InvoiceTermsRequest(BaseModel):
+    party_id: int
+    invoice_date: date
+    amount: float
+
+class PaymentScheduleRequest(BaseModel):
+    invoices: List[InvoiceTermsRequest]
+
+class PaymentScheduleRow(BaseModel):
+    party_id: int
+    term_id: Optional[int] = None
+    due_date: Optional[date] = None
+    discount_until: Optional[date] = None
+    discount_amount: float
+    discounted_amount: float
+    reminder_date: Optional[date] = None
+    reason: Optional[str] = None  # unknown_party or no_payment_term when term_id is null
+
+class PaymentScheduleResponse(BaseModel):
+    schedule: List[PaymentScheduleRow]
+
+# Credit Check Schemas
+class CreditCheckItem(BaseModel):
+    party_id: int
+    outstanding: float = 0
+    order_amount: float
+    oldest_due_date: Optional[date] = None
+
+class CreditCheckRequest(BaseModel):
+    checks: List[CreditCheckItem]
+    as_of: Optional[date] = None
+
+class CreditDecision(BaseModel):
+    party_id: int
+    allowed: bool
+    reasons: List[str]
+    credit_limit: Optional[float] = None
+    available_credit: Optional[float] = None
+    overdue_days: Optional[int] = None
+
+class CreditCheckResponse(BaseModel):
+    decisions: List[CreditDecision]
+
+# Identifier Validation Schemas
+class IdentifierRecord(BaseModel):
+    gst_number: Optional[str] = None
+    pan_number: Optional[str] = None
+    ifsc_code: Optional[str] = None
+    fssai_number: Optional[str] = None
+    state: Optional[str] = None  # checked against the GSTIN state code when given
+
+class IdentifierValidationRequest(BaseModel):
+    records: List[IdentifierRecord]
+
+class IdentifierError(BaseModel):
+    field: str
+    message: str
+
+class IdentifierValidationResult(BaseModel):
+    valid: bool
+    errors: List[IdentifierError]
+    bank_name: Optional[str] = None
+
+class IdentifierValidationResponse(BaseModel):
+    valid: int
+    invalid: int
+    results: List[IdentifierValidationResult]
+
+# Batch Schemas
+class BatchOperation(BaseModel):
+    id: Optional[str] = None  # name used in "${id.field}" references; defaults to the position
+    method: str
+    path: str
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    atomic: bool = False
+
+class BatchResult(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: List[BatchResult]
+
+# Party Payment Terms Schemas
+class PartyPaymentTermsBase(BaseModel):
+    term_id: int
+    is_default: bool = False
+
+class PartyPaymentTermsCreate(PartyPaymentTermsBase):
+    pass
+
+class PartyPaymentTermsResponse(PartyPaymentTermsBase):
+    party_term_id: int
+    party_id: int
+    created_at: datetime
+    payment_term: PaymentTermsResponse
+    
+    class Config:
+        from_attributes = True
+
+# Party Master Schemas
+class PartyMasterBase(BaseModel):
+    party_code: str
+    party_name: str
+    type_of_firm: str
+    email_id: str
+    mobile_number: str
+    gst_number: Optional[str] = None
+    fssai_number: Optional[str] = None
+    pan_number: str
+    tan_number: Optional[str] = None
+    credit_limit: Optional[float] = None
+    credit_days: Optional[int] = None
+    udyam_aadhar_number: Optional[str] = None
+    court_case_pending: bool = False
+    billing_same_as_shipping: bool = False
+    turnover_declaration_certificate: Optional[str] = None
+
+class PartyMasterCreate(IdentifierChecks, PartyMasterBase):
+    party_code: Optional[str] = None  # assigned by the party code allocator when left out
+    addresses: Optional[List[PartyAddressCreate]] = []
+    contact_persons: Optional[List[ContactPersonCreate]] = []
+    account_details: Optional[PartyAccountDetailsCreate] = None
+    bank_details: Optional[BankDetailsCreate] = None
+
+class PartyMasterUpdate(IdentifierChecks):
+    party_name: Optional[str] = None
+    type_of_firm: Optional[str] = None
+    email_id: Optional[str] = None
+    mobile_number: Optional[str] = None
+    gst_number: Optional[str] = None
+    fssai_number: Optional[str] = None
+    pan_number: Optional[str] = None
+    tan_number: Optional[str] = None
+    credit_limit: Optional[float] = None
+    credit_days: Optional[int] = None
+    udyam_aadhar_number: Optional[str] = None
+    court_case_pending: Optional[bool] = None
+    billing_same_as_shipping: Optional[bool] = None
+    turnover_declaration_certificate: Optional[str] = None
+    version: Optional[int] = None  # version the change is based on (If-Match also works); a stale one gets 409
+
+# Children in an aggregate update: an id updates that child, no id adds a new one.
+# A child's version, when given, must still be current for its update to apply.
+# They are checked and normalized like the children of a new party.
+class PartyAddressUpdate(PartyAddressCreate):
+    address_id: Optional[int] = None
+    version: Optional[int] = None
+
+class ContactPersonUpdate(ContactPersonBase):
+    contact_id: Optional[int] = None
+    version: Optional[int] = None
+
+class PartyAccountDetailsUpdate(PartyAccountDetailsBase):
+    account_id: Optional[int] = None
+    version: Optional[int] = None
+
+class BankDetailsUpdate(IdentifierChecks, BankDetailsBase):
+    bank_id: Optional[int] = None
+    version: Optional[int] = None
+
+class PartyAggregateUpdate(PartyMasterUpdate):
+    addresses: Optional[List[PartyAddressUpdate]] = None
+    contact_persons: Optional[List[ContactPersonUpdate]] = None
+    account_details: Optional[List[PartyAccountDetailsUpdate]] = None
+    bank_details: Optional[List[BankDetailsUpdate]] = None
+
+class PartyMasterResponse(PartyMasterBase):
+    party_id: int
+    created_at: datetime
+    updated_at: datetime
+    version: int
+    addresses: List[PartyAddressResponse] = []
+    contact_persons: List[ContactPersonResponse] = []
+    account_details: List[PartyAccountDetailsResponse] = []
+    bank_details: List[BankDetailsResponse] = []
+    
+    class Config:
+        from_attributes = True
+
+class PartyMasterListResponse(BaseModel):
+    party_id: int
+    party_code: str
+    party_name: str
+    gst_number: Optional[str]
+    fssai_number: Optional[str]
+    contact_person: Optional[str]
+    mobile_number: str
+    location: Optional[str]
+    
+    class Config:
+        from_attributes = True
+
+class PartySuggestion(BaseModel):
+    party_id: int
+    party_code: str
+    party_name: str
+
+# Master Types Schemas
+class MasterTypesBase(BaseModel):
+    type_name: str
+    description: Optional[str] = None
+
+class MasterTypesCreate(MasterTypesBase):
+    pass
+
+class MasterTypesResponse(MasterTypesBase):
+    type_id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Account Groups Schemas
+class AccountGroupsBase(BaseModel):
+    main_group: str
+    group_name: str
+    from_account_no: Optional[str] = None
+    to_account_no: Optional[str] = None
+
+class AccountGroupsCreate(AccountGroupsBase):
+    pass
+
+class AccountGroupsResponse(AccountGroupsBase):
+    group_id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Change Feed Schemas
+class ChangeLogResponse(BaseModel):
+    change_id: int
+    entity: str
+    entity_id: int
+    party_id: Optional[int] = None
+    operation: str
+    data: Optional[dict] = None
+    created_at: datetime
+
+class ChangeFeedResponse(BaseModel):
+    changes: List[ChangeLogResponse]
+    next_cursor: int
+    has_more: bool
+
+class ChangeCompactionResponse(BaseModel):
+    removed: int
+
+# Audit Schemas
+class AuditLogResponse(BaseModel):
+    audit_id: int
+    entity: str
+    entity_id: int
+    party_id: Optional[int] = None
+    action: str
+    actor: Optional[str] = None
+    before: Optional[dict] = None
+    after: Optional[dict] = None
+    changed_at: datetime
+
+class AuditPageResponse(BaseModel):
+    entries: List[AuditLogResponse]
+    next_cursor: Optional[int] = None
+
+# Background Job Schemas
+class JobCreate(BaseModel):
+    job_type: str
+    params: dict = {}
+
+class JobResponse(BaseModel):
+    job_id: int
+    job_type: str
+    status: str
+    params: dict = {}
+    processed: int = 0
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# Bulk Operation Schemas
+class PartyFilter(BaseModel):
+    search: Optional[str] = None
+    state: Optional[str] = None
+    city: Optional[str] = None
+    type_of_firm: Optional[str] = None
+
+class PartyBulkDelete(BaseModel):
+    party_ids: Optional[List[int]] = None
+    filter: Optional[PartyFilter] = None
+
+class PartyBulkUpdate(BaseModel):
+    party_ids: Optional[List[int]] = None
+    filter: Optional[PartyFilter] = None
+    changes: PartyMasterUpdate
+
+class BulkOperationResponse(BaseModel):
+    affected: int
@@ -0,0 +1,194 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+from query_guard import normalize
+
+logger = logging.getLogger(__name__)
+
+_request_scope = contextvars.ContextVar("slow_query_scope", default=None)
+
+# Statements EXPLAIN understands
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# Bucket for statement shapes beyond SLOW_QUERY_MAX_STATEMENTS
+OTHER = "(other statements)"
+
+
+def redact(parameters):
+    """Keep the shape of bound parameters but hide their text values"""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (bool, int, float)):
+        return parameters
+    if isinstance(parameters, str):
+        return f"<str:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+def _route(scope):
+    """The route template serving a request, falling back to its path"""
+    if scope is None:
+        return None
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is not None and app is not None:
+        for route in app.router.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return f"{scope['method']} {route.path}"
+    return f"{scope['method']} {scope['path']}"
+
+
+class SlowQueryLog:
+    """Per-statement timing stats plus a ring buffer of the slowest executions"""
+
+    def __init__(self, threshold_ms=None, size=None, max_statements=None, explain_interval=None):
+        self.threshold_ms = settings.SLOW_QUERY_THRESHOLD_MS if threshold_ms is None else threshold_ms
+        self.max_statements = max_statements or settings.SLOW_QUERY_MAX_STATEMENTS
+        self.explain_interval = settings.SLOW_QUERY_EXPLAIN_INTERVAL if explain_interval is None else explain_interval
+        self._entries = deque(maxlen=size or settings.SLOW_QUERY_LOG_SIZE)
+        self._stats = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def observe(self, conn, statement, parameters, executemany, elapsed):
+        shape = normalize(statement)
+        elapsed_ms = elapsed * 1000
+        slow = elapsed_ms >= self.threshold_ms
+        with self._lock:
+            key = shape if shape in self._stats or len(self._stats) < self.max_statements else OTHER
+            stats = self._stats.setdefault(key, {"count": 0, "slow": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            if slow:
+                stats["slow"] += 1
+        if not slow:
+            return
+
+        route = _route(_request_scope.get())
+        plan = None if executemany else self._plan(conn, shape, statement, parameters)
+        entry = {
+            "at": datetime.utcnow(),
+            "route": route,
+            "duration_ms": round(elapsed_ms, 3),
+            "statement": shape,
+            "parameters": redact(parameters),
+            "plan": plan,
+        }
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning("Slow query (%.1f ms) on %s: %s", elapsed_ms, route or "no request", shape[:500])
+
+    def _plan(self, conn, shape, statement, parameters):
+        """EXPLAIN the statement, reusing a recent plan of the same shape"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._plans.get(shape)
+        if cached and now - cached[0] < self.explain_interval:
+            return cached[1]
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+
+        plan = explain(conn, statement, parameters)
+        with self._lock:
+            if len(self._plans) >= self.max_statements:
+                self._plans.clear()
+            self._plans[shape] = (now, plan)
+        return plan
+
+    def snapshot(self):
+        with self._lock:
+            entries = list(self._entries)
+            stats = [
+                {"statement": shape, **values, "total_ms": round(values["total_ms"], 3),
+                 "max_ms": round(values["max_ms"], 3), "avg_ms": round(values["total_ms"] / values["count"], 3)}
+                for shape, values in self._stats.items()
+            ]
+        stats.sort(key=lambda item: item["total_ms"], reverse=True)
+        return {"threshold_ms": self.threshold_ms, "queries": entries[::-1], "statements": stats}
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+            self._plans.clear()
+
+
+def explain(conn, statement, parameters):
+    """Plan a statement without running it, on the connection that just ran it.
+
+    A fresh DBAPI cursor is used so the original cursor's rows stay intact.
+    On PostgreSQL the EXPLAIN runs inside a savepoint: a failure would
+    otherwise abort the caller's transaction.
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        sql = f"EXPLAIN (ANALYZE off) {statement}"
+    elif dialect == "sqlite":
+        sql = f"EXPLAIN QUERY PLAN {statement}"
+    else:
+        return None
+
+    cursor = conn.connection.cursor()
+    try:
+        if dialect == "postgresql":
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(sql, parameters)
+            rows = cursor.fetchall()
+        except Exception as exc:
+            if dialect == "postgresql":
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return f"EXPLAIN failed: {exc}"
+        if dialect == "postgresql":
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return "\n".join(row[0] for row in rows)
+        return "\n".join(str(row[-1]) for row in rows)
+    except Exception as exc:
+        return f"EXPLAIN failed: {exc}"
+    finally:
+        cursor.close()
+
+
+log = SlowQueryLog()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if settings.SLOW_QUERY_ENABLED and context is not None:
+        context._slow_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_slow_query_started", None)
+    if started is not None:
+        log.observe(conn, statement, parameters, executemany, time.perf_counter() - started)
+
+
+class SlowQueryMiddleware:
+    """Makes the request being served known to slow query entries"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.SLOW_QUERY_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
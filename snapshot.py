@@ -0,0 +1,459 @@
+"""Point-in-time snapshot and restore of the master tables.
+
+    python snapshot.py create /backups/2025-01-15
+    python snapshot.py restore /backups/2025-01-15
+
+On PostgreSQL a snapshot is a binary ``COPY`` of each table, split into
+primary key ranges and run by several connections at once. Every connection
+imports the snapshot of one repeatable-read transaction
+(``pg_export_snapshot``), so all tables are read as of the same instant while
+writes carry on. Each chunk is a gzip file loadable on its own, and a
+``manifest.json`` lists them.
+
+A restore empties the master tables, drops their keys, foreign keys and
+indexes, loads the chunks in parallel, then builds the indexes and checks
+the constraints once over the loaded data and moves the id sequences past
+the restored ids and the party code blocks past the restored codes. Until
+then the DDL that puts the dropped keys back waits in ``rebuild.json``, and
+``restore --finish`` replays it after a restore that died. SQLite databases
+use JSON lines chunks instead of binary ``COPY``; a JSON lines snapshot
+(``--format jsonl``) restores into either database.
+
+Snapshots hold the rows of every tenant in the main database. Tenants with a
+database or schema of their own (TENANT_DATABASES) are not covered, so both
+commands refuse to run while any are configured.
+"""
+import argparse
+import gzip
+import json
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import Date, DateTime, Float, Numeric, func, insert, select, text
+
+from config import settings
+from models import (
+    AccountGroups, BankDetails, ContactPerson, MasterTypes, PartyAccountDetails, PartyAddress,
+    PartyCodeBlock, PartyMaster, PartyPaymentTerms, PartyProducts, PaymentTerms, Products, engine, engines,
+)
+import party_codes
+
+logger = logging.getLogger(__name__)
+
+# Parents before children
+MASTER_TABLES = tuple(model.__table__ for model in (
+    MasterTypes, AccountGroups, PaymentTerms, Products, PartyMaster, PartyAddress,
+    ContactPerson, PartyAccountDetails, BankDetails, PartyProducts, PartyPaymentTerms,
+))
+
+BINARY, JSONL = "binary", "jsonl"
+_EXTENSIONS = {BINARY: "bin.gz", JSONL: "jsonl.gz"}
+MANIFEST = "manifest.json"
+# DDL that puts back what a PostgreSQL restore dropped, until the restore is done
+REBUILD = "rebuild.json"
+
+# Bytes per read when streaming a chunk into COPY, rows per INSERT batch
+_READ_SIZE = 1 << 20
+_INSERT_BATCH = 5000
+
+
+class SnapshotError(RuntimeError):
+    """A snapshot cannot be taken or restored"""
+
+
+def _check_tenants():
+    dedicated = sorted(engines.databases)
+    if dedicated:
+        raise SnapshotError(f"Snapshots cover the main database only, not tenants with their own (TENANT_DATABASES): {', '.join(dedicated)}")
+
+
+def _primary_key(table):
+    return next(iter(table.primary_key.columns))
+
+
+def _ranges(connection, table, chunk_rows):
+    """Primary key ranges ``[low, high)`` of about ``chunk_rows`` rows each"""
+    key = _primary_key(table)
+    count, low, high = connection.execute(select(func.count(), func.min(key), func.max(key)).select_from(table)).one()
+    if not count:
+        return []
+    step = math.ceil((high - low + 1) / math.ceil(count / chunk_rows))
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def _chunk_select(table, columns, low, high):
+    key = _primary_key(table)
+    return f"SELECT {', '.join(columns)} FROM {table.name} WHERE {key.name} >= {int(low)} AND {key.name} < {int(high)}"
+
+
+# --- PostgreSQL binary COPY -------------------------------------------------
+
+def _copy_out(connection, sql, path, level):
+    cursor = connection.connection.cursor()
+    with gzip.open(path, "wb", compresslevel=level) as out:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(sql, out, size=_READ_SIZE)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                for data in copy:
+                    out.write(data)
+    return cursor.rowcount if cursor.rowcount >= 0 else None
+
+
+def _copy_in(connection, sql, path):
+    cursor = connection.connection.cursor()
+    with gzip.open(path, "rb") as source:
+        if hasattr(cursor, "copy_expert"):
+            cursor.copy_expert(sql, source, size=_READ_SIZE)
+        else:
+            with cursor.copy(sql) as copy:
+                while data := source.read(_READ_SIZE):
+                    copy.write(data)
+    return cursor.rowcount if cursor.rowcount >= 0 else None
+
+
+# --- JSON lines ---------------------------------------------------------------
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot store {type(value).__name__} in a snapshot")
+
+
+def _decoders(table, columns):
+    decoders = []
+    for name in columns:
+        column_type = table.columns[name].type
+        if isinstance(column_type, DateTime):
+            decoders.append(datetime.fromisoformat)
+        elif isinstance(column_type, Date):
+            decoders.append(date.fromisoformat)
+        elif isinstance(column_type, Float):
+            decoders.append(float)
+        elif isinstance(column_type, Numeric):
+            decoders.append(Decimal)
+        else:
+            decoders.append(None)
+    return decoders
+
+
+def _write_jsonl(connection, sql, path, level):
+    rows = 0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=level) as out:
+        for row in connection.execute(text(sql).execution_options(yield_per=_INSERT_BATCH)):
+            out.write(json.dumps(list(row), default=_encode, separators=(",", ":")))
+            out.write("\n")
+            rows += 1
+    return rows
+
+
+def _read_jsonl(connection, table, columns, path):
+    decoders = _decoders(table, columns)
+    statement = insert(table)
+    rows, batch = 0, []
+    with gzip.open(path, "rt", encoding="utf-8") as source:
+        for line in source:
+            values = json.loads(line)
+            batch.append({
+                name: value if decode is None or value is None else decode(value)
+                for name, value, decode in zip(columns, values, decoders)
+            })
+            if len(batch) == _INSERT_BATCH:
+                connection.execute(statement, batch)
+                rows, batch = rows + len(batch), []
+    if batch:
+        connection.execute(statement, batch)
+        rows += len(batch)
+    return rows
+
+
+# --- Snapshot -----------------------------------------------------------------
+
+def create_snapshot(directory, workers=None, format=None):
+    """Write the master tables to ``directory`` as of one point in time; returns the manifest"""
+    _check_tenants()
+    workers = workers or settings.SNAPSHOT_WORKERS
+    postgres = not settings.is_sqlite()
+    format = format or (BINARY if postgres else JSONL)
+    if format not in _EXTENSIONS:
+        raise SnapshotError(f"Unknown snapshot format {format!r}")
+    if format == BINARY and not postgres:
+        raise SnapshotError("Binary snapshots need PostgreSQL; use --format jsonl")
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        raise SnapshotError(f"{directory} already holds a snapshot")
+    level = settings.SNAPSHOT_COMPRESSION_LEVEL
+    manifest = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "dialect": engine.dialect.name,
+        "format": format,
+        "tables": {},
+    }
+
+    def export(connection, table, number, low, high):
+        columns = manifest["tables"][table.name]["columns"]
+        name = f"{table.name}/{number:05d}.{_EXTENSIONS[format]}"
+        sql = _chunk_select(table, columns, low, high)
+        if format == BINARY:
+            rows = _copy_out(connection, f"COPY ({sql}) TO STDOUT (FORMAT binary)", os.path.join(directory, name), level)
+        else:
+            rows = _write_jsonl(connection, sql, os.path.join(directory, name), level)
+        return table.name, name, rows
+
+    def export_in_snapshot(snapshot_id, work):
+        options = {"isolation_level": "REPEATABLE READ", "postgresql_readonly": True}
+        with engine.connect().execution_options(**options) as connection, connection.begin():
+            # SET takes no bind parameters under psycopg 3, and the id is ours (hex digits and dashes)
+            connection.exec_driver_sql(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'")
+            return export(connection, *work)
+
+    for table in MASTER_TABLES:
+        os.makedirs(os.path.join(directory, table.name), exist_ok=True)
+        manifest["tables"][table.name] = {"columns": [column.name for column in table.columns], "rows": 0, "chunks": []}
+
+    options = {"isolation_level": "REPEATABLE READ", "postgresql_readonly": True} if postgres else {}
+    with engine.connect().execution_options(**options) as connection, connection.begin():
+        if postgres:
+            snapshot_id = connection.execute(text("SELECT pg_export_snapshot()")).scalar()
+        work = [
+            (table, number, low, high)
+            for table in MASTER_TABLES
+            for number, (low, high) in enumerate(_ranges(connection, table, settings.SNAPSHOT_CHUNK_ROWS))
+        ]
+        if postgres and workers > 1:
+            # The exporting transaction stays open until every worker is done
+            with ThreadPoolExecutor(workers, thread_name_prefix="snapshot") as pool:
+                done = list(pool.map(lambda item: export_in_snapshot(snapshot_id, item), work))
+        else:
+            done = [export(connection, *item) for item in work]
+
+    for table_name, name, rows in done:
+        entry = manifest["tables"][table_name]
+        entry["chunks"].append(name)
+        entry["rows"] = None if rows is None or entry["rows"] is None else entry["rows"] + rows
+    with open(os.path.join(directory, MANIFEST), "w") as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+# --- Restore ------------------------------------------------------------------
+
+_PG_CONSTRAINTS = """
+    SELECT conrelid::regclass::text, quote_ident(conname), contype, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE conrelid = ANY(CAST(:tables AS regclass[])) AND contype IN ('p', 'u', 'f')
+"""
+_PG_INDEXES = """
+    SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid)
+    FROM pg_index
+    WHERE indrelid = ANY(CAST(:tables AS regclass[]))
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid)
+"""
+
+
+def _pg_drop(connection, names, directory):
+    """Drop the foreign keys, indexes and keys of the tables; returns the DDL that rebuilds them.
+
+    The DDL is written to ``rebuild.json`` in the snapshot directory before
+    anything is dropped, so a restore that dies midway can still be finished
+    with ``python snapshot.py restore --finish``.
+    """
+    constraints = connection.execute(text(_PG_CONSTRAINTS), {"tables": names}).all()
+    indexes = connection.execute(text(_PG_INDEXES), {"tables": names}).all()
+    foreign = [row for row in constraints if row[2] == "f"]
+    keys = [row for row in constraints if row[2] != "f"]
+    # Keys first so the foreign keys have something to reference
+    rebuild = (
+        [f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}" for table, name, _, definition in keys]
+        + [definition for _, definition in indexes]
+        + [f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}" for table, name, _, definition in foreign]
+    )
+    path = os.path.join(directory, REBUILD)
+    with open(f"{path}.tmp", "w") as handle:
+        json.dump({"tables": names, "statements": rebuild}, handle, indent=2)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(f"{path}.tmp", path)
+    logger.info("Keys and indexes of the master tables are rebuilt from %s", path)
+
+    for table, name, _, _ in foreign:
+        connection.exec_driver_sql(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    for name, _ in indexes:
+        connection.exec_driver_sql(f"DROP INDEX {name}")
+    for table, name, _, _ in keys:
+        connection.exec_driver_sql(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    return rebuild
+
+
+def _pg_reset_sequences(connection):
+    for table in MASTER_TABLES:
+        key = _primary_key(table).name
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence(:table, :key), COALESCE(MAX({key}), 1), MAX({key}) IS NOT NULL) "
+            f"FROM {table.name}"
+        ), {"table": table.name, "key": key})
+
+
+def _reserve_restored_codes(connection):
+    """Move the party code block sequence past the codes of the restored parties.
+
+    Blocks are numbered by this database's own sequence, which knows nothing
+    of the codes handed out where the snapshot was taken.
+    """
+    allocator = party_codes.allocator
+    codes = connection.execute(
+        select(PartyMaster.party_code).where(PartyMaster.party_code.like(f"{allocator.prefix}%"))
+    ).scalars()
+    block_id = max((allocator.block_of(code) for code in codes if allocator.owns(code)), default=0)
+    if block_id <= (connection.execute(select(func.max(PartyCodeBlock.block_id))).scalar() or 0):
+        return
+    connection.execute(insert(PartyCodeBlock).values(block_id=block_id, reserved_by="snapshot restore"))
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT setval(pg_get_serial_sequence('party_code_blocks', 'block_id'), :block_id)"),
+                           {"block_id": block_id})
+
+
+def _load(connection, manifest, directory, table_name, name):
+    table = next(table for table in MASTER_TABLES if table.name == table_name)
+    columns = manifest["tables"][table_name]["columns"]
+    unknown = set(columns) - set(table.columns.keys())
+    if unknown:
+        raise SnapshotError(f"{table_name} has no column {', '.join(sorted(unknown))}")
+    path = os.path.join(directory, name)
+    if manifest["format"] == BINARY:
+        return _copy_in(connection, f"COPY {table_name} ({', '.join(columns)}) FROM STDIN (FORMAT binary)", path)
+    return _read_jsonl(connection, table, columns, path)
+
+
+def restore_snapshot(directory, workers=None):
+    """Replace the master tables with the snapshot in ``directory``; returns rows loaded per table"""
+    _check_tenants()
+    workers = workers or settings.SNAPSHOT_WORKERS
+    with open(os.path.join(directory, MANIFEST)) as handle:
+        manifest = json.load(handle)
+    if manifest["format"] == BINARY and settings.is_sqlite():
+        raise SnapshotError("Binary snapshots restore into PostgreSQL only")
+    if os.path.exists(os.path.join(directory, REBUILD)):
+        raise SnapshotError(f"An earlier restore from {directory} did not finish; run restore --finish first")
+    work = [(table_name, name) for table_name, entry in manifest["tables"].items() for name in entry["chunks"]]
+    loaded = {table.name: 0 for table in MASTER_TABLES}
+
+    if settings.is_sqlite():
+        # One transaction: foreign keys are checked at commit, indexes rebuilt once at the end
+        names = ", ".join(f"'{table.name}'" for table in MASTER_TABLES)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("PRAGMA defer_foreign_keys = ON")
+            indexes = connection.exec_driver_sql(
+                f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({names})"
+            ).all()
+            for name, _ in indexes:
+                connection.exec_driver_sql(f'DROP INDEX "{name}"')
+            for table in reversed(MASTER_TABLES):
+                connection.execute(table.delete())
+            for table_name, name in work:
+                loaded[table_name] += _load(connection, manifest, directory, table_name, name)
+            for _, sql in indexes:
+                connection.exec_driver_sql(sql)
+            _reserve_restored_codes(connection)
+        return loaded
+
+    names = [table.name for table in MASTER_TABLES]
+    try:
+        with engine.begin() as connection:
+            rebuild = _pg_drop(connection, names, directory)
+            connection.exec_driver_sql(f"TRUNCATE {', '.join(names)}")
+    except BaseException:
+        # Rolled back, so nothing was dropped
+        if os.path.exists(os.path.join(directory, REBUILD)):
+            os.remove(os.path.join(directory, REBUILD))
+        raise
+
+    def load(item):
+        with engine.begin() as connection:
+            return item[0], _load(connection, manifest, directory, *item)
+
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="restore") as pool:
+            for table_name, rows in pool.map(load, work):
+                loaded[table_name] = None if rows is None or loaded[table_name] is None else loaded[table_name] + rows
+    except BaseException:
+        finish_restore(directory)
+        raise
+
+    with engine.begin() as connection:
+        for statement in rebuild:
+            connection.exec_driver_sql(statement)
+        _pg_reset_sequences(connection)
+        _reserve_restored_codes(connection)
+        for name in names:
+            connection.exec_driver_sql(f"ANALYZE {name}")
+    os.remove(os.path.join(directory, REBUILD))
+    return loaded
+
+
+def finish_restore(directory):
+    """Put back the keys, foreign keys and indexes a failed PostgreSQL restore dropped.
+
+    The tables are emptied first: an empty table with its constraints is
+    better than half a snapshot without them. Restore again afterwards.
+    """
+    path = os.path.join(directory, REBUILD)
+    if not os.path.exists(path):
+        raise SnapshotError(f"No unfinished restore from {directory}")
+    with open(path) as handle:
+        pending = json.load(handle)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"TRUNCATE {', '.join(pending['tables'])}")
+        for statement in pending["statements"]:
+            connection.exec_driver_sql(statement)
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot or restore the master tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="write a snapshot of the master tables")
+    create.add_argument("directory")
+    create.add_argument("--format", choices=sorted(_EXTENSIONS), help="binary (PostgreSQL, default there) or jsonl")
+    create.add_argument("--workers", type=int, help=f"parallel connections (default {settings.SNAPSHOT_WORKERS})")
+    restore = commands.add_parser("restore", help="replace the master tables with a snapshot")
+    restore.add_argument("directory")
+    restore.add_argument("--workers", type=int, help=f"parallel connections (default {settings.SNAPSHOT_WORKERS})")
+    restore.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    restore.add_argument("--finish", action="store_true",
+                         help="empty the tables and put back the keys and indexes of a restore that died")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    target = engine.url.render_as_string(hide_password=True)
+    started = time.perf_counter()
+    try:
+        if args.command == "create":
+            manifest = create_snapshot(args.directory, args.workers, args.format)
+            counts = {name: entry["rows"] for name, entry in manifest["tables"].items()}
+        elif args.finish:
+            finish_restore(args.directory)
+            print(f"Keys and indexes of the master tables of {target} rebuilt; the tables are empty, restore again")
+            return
+        else:
+            if not args.yes and input(f"Replace the master tables of {target}? [y/N] ").strip().lower() != "y":
+                sys.exit("Restore cancelled")
+            counts = restore_snapshot(args.directory, args.workers)
+    except SnapshotError as exc:
+        sys.exit(str(exc))
+
+    for name, rows in counts.items():
+        print(f"  {name}: {'?' if rows is None else rows} rows")
+    verb = "Snapshot of" if args.command == "create" else "Restored into"
+    print(f"{verb} {target} in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Tenants: the distributor company a request works for, and where its data lives.
+
+Tenant-owned tables carry a ``tenant_id`` column (``TenantScoped``), and
+codes are unique per tenant rather than globally. ``TenantMiddleware`` takes
+the tenant of each request from TENANT_HEADER (DEFAULT_TENANT without one)
+and ``TenantSession`` keeps every session to that tenant: ORM selects,
+updates and deletes get a ``tenant_id`` criterion through
+``with_loader_criteria``, and new rows are stamped with the tenant. Lambda
+statements carry their own criterion and are executed with ``LAMBDA_SCOPED``.
+
+Tenants live in the main database unless TENANT_DATABASES gives them their
+own PostgreSQL database or schema. Those get an engine of their own with a
+pool of at most TENANT_POOL_SIZE + TENANT_MAX_OVERFLOW connections, so a busy
+tenant waits on its own pool instead of starving everyone else's.
+"""
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import Column, String, create_engine, event
+from sqlalchemy.orm import Session, with_loader_criteria
+from sqlalchemy.schema import CreateSchema
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+
+from config import settings
+
+_tenant = contextvars.ContextVar("tenant", default=None)
+
+# Session tenant for bookkeeping across tenants: no scoping, main database
+ALL_TENANTS = "*"
+
+_SCHEMA_PREFIX = "schema:"
+
+# Execution option of lambda statements that filter on the tenant themselves
+LAMBDA_SCOPED = "tenant_scoped_lambda"
+
+
+def current():
+    """Tenant of the running request or job"""
+    return _tenant.get() or settings.DEFAULT_TENANT
+
+
+@contextmanager
+def use(tenant):
+    """Run a block (a background job, a seeding script) as ``tenant``"""
+    token = _tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+class TenantScoped:
+    """Mixin for tables whose rows belong to one tenant"""
+    tenant_id = Column(String(50), nullable=False, default=current)
+
+
+def is_shared(model):
+    """Models kept in the main database for every tenant (``__shared__ = True``)"""
+    return getattr(model, "__shared__", False)
+
+
+class EngineRegistry:
+    """The engine each tenant's sessions use.
+
+    Tenants in TENANT_DATABASES get a dedicated engine, created on first use;
+    everyone else shares the main one.
+    """
+
+    def __init__(self, shared, databases=None):
+        self.shared = shared
+        self.databases = settings.get_tenant_databases() if databases is None else databases
+        if self.databases and shared.dialect.name != "postgresql":
+            raise ValueError("TENANT_DATABASES needs PostgreSQL")
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant):
+        target = self.databases.get(tenant)
+        if target is None:
+            return self.shared
+        with self._lock:
+            engine = self._engines.get(tenant)
+            if engine is None:
+                engine = self._engines[tenant] = self._create(target)
+            return engine
+
+    def _create(self, target):
+        url = self.shared.url.render_as_string(hide_password=False) if target.startswith(_SCHEMA_PREFIX) else target
+        engine = create_engine(
+            url,
+            pool_size=settings.TENANT_POOL_SIZE,
+            max_overflow=settings.TENANT_MAX_OVERFLOW,
+            pool_timeout=settings.TENANT_POOL_TIMEOUT,
+            **settings.get_engine_options(url),
+        )
+        if target.startswith(_SCHEMA_PREFIX):
+            # Unqualified table names resolve to the tenant's schema
+            return engine.execution_options(schema_translate_map={None: target[len(_SCHEMA_PREFIX):]})
+        return engine
+
+    def dedicated(self):
+        """``(tenant, engine)`` for every tenant with its own database or schema"""
+        return [(tenant, self.get(tenant)) for tenant in self.databases]
+
+    def create_all(self, base):
+        """Create the tenant tables of ``base`` in every dedicated database or schema"""
+        tables = [mapper.local_table for mapper in base.registry.mappers if not is_shared(mapper.class_)]
+        for tenant, engine in self.dedicated():
+            target = self.databases[tenant]
+            if target.startswith(_SCHEMA_PREFIX):
+                with engine.begin() as connection:
+                    connection.execute(CreateSchema(target[len(_SCHEMA_PREFIX):], if_not_exists=True))
+            base.metadata.create_all(bind=engine, tables=tables)
+
+    def dispose(self, close=True):
+        self.shared.dispose(close=close)
+        with self._lock:
+            engines = list(self._engines.values())
+        for engine in engines:
+            engine.dispose(close=close)
+
+
+class TenantSession(Session):
+    """Session that works for one tenant.
+
+    The tenant is the running request's or job's unless given. Statements go
+    to the tenant's engine (``__shared__`` models always to the main one) and
+    only see the tenant's rows; ``ALL_TENANTS`` turns both off.
+    """
+
+    def __init__(self, *args, tenant=None, engines=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tenant = tenant or current()
+        self.engines = engines
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.engines is None:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        if self.tenant == ALL_TENANTS or (mapper is not None and is_shared(mapper.class_)):
+            return self.engines.shared
+        return self.engines.get(self.tenant)
+
+
+@event.listens_for(TenantSession, "do_orm_execute")
+def _scope_to_tenant(state):
+    tenant = state.session.tenant
+    if tenant == ALL_TENANTS or not (state.is_select or state.is_update or state.is_delete):
+        return
+    # Column and relationship loads follow from an already scoped parent row
+    if state.is_column_load or state.is_relationship_load:
+        return
+    if isinstance(state.statement, StatementLambdaElement):
+        # Options on the lambda itself would keep the bound values of its first call
+        if not state.execution_options.get(LAMBDA_SCOPED):
+            raise ValueError("Lambda statements must filter on the tenant themselves (see repository.py)")
+        return
+    state.statement = state.statement.options(
+        with_loader_criteria(TenantScoped, lambda cls: cls.tenant_id == tenant, include_aliases=True)
+    )
+
+
+@event.listens_for(TenantSession, "before_flush")
+def _stamp_tenant(session, flush_context, instances):
+    if session.tenant == ALL_TENANTS:
+        return
+    for obj in session.new:
+        if isinstance(obj, TenantScoped) and obj.tenant_id is None:
+            obj.tenant_id = session.tenant
+
+
+class PerTenant:
+    """One instance of an in-memory cache per tenant, made on first use"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant=None):
+        tenant = tenant or current()
+        with self._lock:
+            instance = self._instances.get(tenant)
+            if instance is None:
+                instance = self._instances[tenant] = self._factory(tenant)
+            return instance
+
+    def listener(self, method):
+        """Event broker listener handing each tenant's events to ``method`` of its instance"""
+        def dispatch(batch):
+            by_tenant = {}
+            for event in batch:
+                by_tenant.setdefault(event.tenant_id, []).append(event)
+            with self._lock:
+                targets = [(self._instances.get(tenant), events) for tenant, events in by_tenant.items()]
+            # Tenants without an instance yet read everything when it is made
+            for instance, events in targets:
+                if instance is not None:
+                    getattr(instance, method)(events)
+        return dispatch
+
+
+class TenantMiddleware:
+    """Sets the tenant of each request from TENANT_HEADER; unknown tenants get a 400"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.TENANT_HEADER.lower().encode()
+        self.tenants = frozenset(settings.get_tenants())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        value = next((value.decode("latin-1").strip() for name, value in scope["headers"] if name == self.header), "")
+        tenant = value or settings.DEFAULT_TENANT
+        if tenant not in self.tenants:
+            body = json.dumps({"detail": f"Unknown tenant: {tenant[:50]}"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 400,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = _tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _tenant.reset(token)
@@ -1,377 +1,1672 @@
-import requests
-import json
-from datetime import datetime, date
-
-# API base URL
-BASE_URL = "http://localhost:8000"
-
-def test_health_check():
-    """Test the health check endpoint"""
-    print("Testing health check...")
-    try:
-        response = requests.get(f"{BASE_URL}/health")
-        if response.status_code == 200:
-            print("✅ Health check passed")
-            print(f"Response: {response.json()}")
-        else:
-            print(f"❌ Health check failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API. Make sure the server is running.")
-
-def test_create_party():
-    """Test creating a party with all details"""
-    print("\nTesting party creation...")
-    party_data = {
-        "party_code": "SNET345",
-        "party_name": "LALIT KIRANA (MOTALA)",
-        "type_of_firm": "Sole Proprietorship",
-        "email_id": "lalitkiranastore@gmail.com",
-        "mobile_number": "868-333-4878",
-        "gst_number": "24AABCU9603R1ZV",
-        "fssai_number": "11518041000578",
-        "pan_number": "ABCDE1234F",
-        "tan_number": None,
-        "credit_limit": 500000.00,
-        "credit_days": 30,
-        "udyam_aadhar_number": None,
-        "court_case_pending": False,
-        "billing_same_as_shipping": False,
-        "turnover_declaration_certificate": None,
-        "addresses": [
-            {
-                "shipping_address": "201, Shree Sai Heights, Near Athwa Gate, Ring Road, Surat, Gujarat - 395001",
-                "country": "India",
-                "state": "Gujarat",
-                "district": "Surat",
-                "city": "Surat",
-                "zip_code": "395001",
-                "is_primary": True
-            }
-        ],
-        "contact_persons": [
-            {
-                "name": "Rajesh Sharma",
-                "mobile_number": "888-333-4878",
-                "email_id": "lalitkiranastore@gmail.com",
-                "designation": "Sales Manager",
-                "gender": "Male",
-                "birth_date": "1990-06-12",
-                "address": "101, Green Park Society, Adajan, Surat, Gujarat - 395009",
-                "aadhar_number": None,
-                "pan_number": None,
-                "is_primary": True
-            }
-        ],
-        "account_details": {
-            "account_name": "S MAHABOOB BASHA (CHAGALAMARI)",
-            "account_type": "Transport",
-            "main_group": "Cash & Cash Equivalents",
-            "group_name": "Current Assets",
-            "remarks": "Regular Inventories required."
-        },
-        "bank_details": {
-            "bank_name": "State Bank of India",
-            "branch_name": "Ring Road Branch",
-            "account_holder_name": "Vikram Shah",
-            "account_number": "123456789012",
-            "confirm_account_number": "123456789012",
-            "account_type": "Savings",
-            "ifsc_code": "SBIN0001234",
-            "bank_address": "15, Ring Road, Surat, Gujarat - 395001",
-            "is_primary": True
-        }
-    }
-    
-    try:
-        response = requests.post(f"{BASE_URL}/parties/", json=party_data)
-        if response.status_code == 200:
-            print("✅ Party created successfully")
-            party = response.json()
-            print(f"Created party ID: {party['party_id']}")
-            return party["party_id"]
-        else:
-            print(f"❌ Party creation failed: {response.status_code}")
-            print(f"Error: {response.text}")
-            return None
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-        return None
-
-def test_get_parties():
-    """Test getting all parties"""
-    print("\nTesting get all parties...")
-    try:
-        response = requests.get(f"{BASE_URL}/parties/")
-        if response.status_code == 200:
-            parties = response.json()
-            print(f"✅ Retrieved {len(parties)} parties")
-            for party in parties:
-                print(f"  - {party['party_code']}: {party['party_name']} ({party['mobile_number']})")
-        else:
-            print(f"❌ Get parties failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_get_party(party_id):
-    """Test getting a specific party"""
-    print(f"\nTesting get party {party_id}...")
-    try:
-        response = requests.get(f"{BASE_URL}/parties/{party_id}")
-        if response.status_code == 200:
-            party = response.json()
-            print("✅ Party retrieved successfully")
-            print(f"Party: {party['party_name']} ({party['party_code']})")
-            print(f"Addresses: {len(party['addresses'])}")
-            print(f"Contact Persons: {len(party['contact_persons'])}")
-        else:
-            print(f"❌ Get party failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_update_party(party_id):
-    """Test updating a party"""
-    print(f"\nTesting update party {party_id}...")
-    update_data = {
-        "credit_limit": 750000.00,
-        "credit_days": 45,
-        "court_case_pending": True
-    }
-    
-    try:
-        response = requests.put(f"{BASE_URL}/parties/{party_id}", json=update_data)
-        if response.status_code == 200:
-            party = response.json()
-            print("✅ Party updated successfully")
-            print(f"Updated credit limit: {party['credit_limit']}")
-            print(f"Updated credit days: {party['credit_days']}")
-        else:
-            print(f"❌ Update party failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_add_party_address(party_id):
-    """Test adding an address to a party"""
-    print(f"\nTesting add address to party {party_id}...")
-    address_data = {
-        "shipping_address": "301, Business Park, Near Railway Station, Mumbai, Maharashtra - 400001",
-        "country": "India",
-        "state": "Maharashtra",
-        "district": "Mumbai",
-        "city": "Mumbai",
-        "zip_code": "400001",
-        "is_primary": False
-    }
-    
-    try:
-        response = requests.post(f"{BASE_URL}/parties/{party_id}/addresses/", json=address_data)
-        if response.status_code == 200:
-            address = response.json()
-            print("✅ Address added successfully")
-            print(f"Address ID: {address['address_id']}")
-        else:
-            print(f"❌ Add address failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_add_contact_person(party_id):
-    """Test adding a contact person to a party"""
-    print(f"\nTesting add contact person to party {party_id}...")
-    contact_data = {
-        "name": "Priya Patel",
-        "mobile_number": "987-654-3210",
-        "email_id": "priya.patel@example.com",
-        "designation": "Accounts Manager",
-        "gender": "Female",
-        "birth_date": "1985-03-15",
-        "address": "202, Sunshine Apartments, Bandra West, Mumbai - 400050",
-        "aadhar_number": None,
-        "pan_number": None,
-        "is_primary": False
-    }
-    
-    try:
-        response = requests.post(f"{BASE_URL}/parties/{party_id}/contacts/", json=contact_data)
-        if response.status_code == 200:
-            contact = response.json()
-            print("✅ Contact person added successfully")
-            print(f"Contact ID: {contact['contact_id']}")
-        else:
-            print(f"❌ Add contact person failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_get_products():
-    """Test getting all products"""
-    print("\nTesting get all products...")
-    try:
-        response = requests.get(f"{BASE_URL}/products/")
-        if response.status_code == 200:
-            products = response.json()
-            print(f"✅ Retrieved {len(products)} products")
-            for product in products:
-                print(f"  - {product['product_code']}: {product['product_name']}")
-        else:
-            print(f"❌ Get products failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_add_party_product(party_id):
-    """Test adding a product to a party"""
-    print(f"\nTesting add product to party {party_id}...")
-    
-    # First get available products
-    try:
-        products_response = requests.get(f"{BASE_URL}/products/")
-        if products_response.status_code == 200:
-            products = products_response.json()
-            if products:
-                product_id = products[0]['product_id']
-                party_product_data = {
-                    "product_id": product_id,
-                    "quantity": 25
-                }
-                
-                response = requests.post(f"{BASE_URL}/parties/{party_id}/products/", json=party_product_data)
-                if response.status_code == 200:
-                    party_product = response.json()
-                    print("✅ Product added to party successfully")
-                    print(f"Party Product ID: {party_product['party_product_id']}")
-                else:
-                    print(f"❌ Add product to party failed: {response.status_code}")
-            else:
-                print("⚠️ No products available to add")
-        else:
-            print(f"❌ Get products failed: {products_response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_get_payment_terms():
-    """Test getting all payment terms"""
-    print("\nTesting get all payment terms...")
-    try:
-        response = requests.get(f"{BASE_URL}/payment-terms/")
-        if response.status_code == 200:
-            terms = response.json()
-            print(f"✅ Retrieved {len(terms)} payment terms")
-            for term in terms:
-                print(f"  - {term['term_description']} ({term['payment_days']} days)")
-        else:
-            print(f"❌ Get payment terms failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_add_party_payment_term(party_id):
-    """Test adding a payment term to a party"""
-    print(f"\nTesting add payment term to party {party_id}...")
-    
-    # First get available payment terms
-    try:
-        terms_response = requests.get(f"{BASE_URL}/payment-terms/")
-        if terms_response.status_code == 200:
-            terms = terms_response.json()
-            if terms:
-                term_id = terms[0]['term_id']
-                party_term_data = {
-                    "term_id": term_id,
-                    "is_default": True
-                }
-                
-                response = requests.post(f"{BASE_URL}/parties/{party_id}/payment-terms/", json=party_term_data)
-                if response.status_code == 200:
-                    party_term = response.json()
-                    print("✅ Payment term added to party successfully")
-                    print(f"Party Term ID: {party_term['party_term_id']}")
-                else:
-                    print(f"❌ Add payment term to party failed: {response.status_code}")
-            else:
-                print("⚠️ No payment terms available to add")
-        else:
-            print(f"❌ Get payment terms failed: {terms_response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_get_master_types():
-    """Test getting master types"""
-    print("\nTesting get master types...")
-    try:
-        response = requests.get(f"{BASE_URL}/master-types/")
-        if response.status_code == 200:
-            types = response.json()
-            print(f"✅ Retrieved {len(types)} master types")
-            for type_item in types:
-                print(f"  - {type_item['type_name']}")
-        else:
-            print(f"❌ Get master types failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_get_account_groups():
-    """Test getting account groups"""
-    print("\nTesting get account groups...")
-    try:
-        response = requests.get(f"{BASE_URL}/account-groups/")
-        if response.status_code == 200:
-            groups = response.json()
-            print(f"✅ Retrieved {len(groups)} account groups")
-            for group in groups:
-                print(f"  - {group['main_group']} > {group['group_name']}")
-        else:
-            print(f"❌ Get account groups failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def test_search_parties():
-    """Test searching parties"""
-    print("\nTesting search parties...")
-    try:
-        response = requests.get(f"{BASE_URL}/parties/?search=LALIT")
-        if response.status_code == 200:
-            parties = response.json()
-            print(f"✅ Search returned {len(parties)} parties")
-            for party in parties:
-                print(f"  - {party['party_name']} ({party['party_code']})")
-        else:
-            print(f"❌ Search parties failed: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        print("❌ Could not connect to the API")
-
-def main():
-    print("🚀 Starting NETAGE BI Party Master API Test Suite")
-    print("=" * 70)
-    
-    # Test health check
-    test_health_check()
-    
-    # Test party operations
-    party_id = test_create_party()
-    
-    if party_id:
-        test_get_parties()
-        test_get_party(party_id)
-        test_update_party(party_id)
-        test_add_party_address(party_id)
-        test_add_contact_person(party_id)
-        test_search_parties()
-    
-    # Test product operations
-    test_get_products()
-    if party_id:
-        test_add_party_product(party_id)
-    
-    # Test payment terms operations
-    test_get_payment_terms()
-    if party_id:
-        test_add_party_payment_term(party_id)
-    
-    # Test master data
-    test_get_master_types()
-    test_get_account_groups()
-    
-    print("\n" + "=" * 70)
-    print("🏁 Test suite completed!")
-    print("\n📚 API Documentation available at:")
-    print("   - Swagger UI: http://localhost:8000/docs")
-    print("   - ReDoc: http://localhost:8000/redoc")
-
-if __name__ == "__main__":
-    main()
+import requests
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, date
+
+# API base URL
+BASE_URL = "http://localhost:8000"
+
+class InProcessRequests:
+    """Stands in for the requests module and sends calls to the app in this process"""
+    exceptions = requests.exceptions
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def __getattr__(self, method):
+        return getattr(self.client, method)
+
+_in_process = None
+
+# India Post directory layout, for the gazetteer of the in-process app
+SAMPLE_PIN_CODES = """officename,pincode,Taluk,Districtname,statename
+Surat H.O,395001,SURAT CITY,SURAT,GUJARAT
+Nanpura S.O,395001,SURAT CITY,SURAT,GUJARAT
+Mumbai G.P.O.,400001,MUMBAI,MUMBAI,MAHARASHTRA
+Srinagar G.P.O.,190001,SRINAGAR,SRINAGAR,JAMMU AND KASHMIR
+"""
+
+def use_in_process_app():
+    """Run the suite through FastAPI's in-process client instead of a running server.
+
+    Unless DATABASE_URL is set, the app gets a throwaway SQLite database, so the
+    run needs no network or PostgreSQL server. Query guard violations fail the
+    offending requests.
+    """
+    global requests, BASE_URL, _in_process
+    directory = tempfile.mkdtemp(prefix="netage-test-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'netage.db')}")
+    os.environ.setdefault("QUERY_GUARD", "raise")
+    os.environ.setdefault("TENANTS", "acme")
+    os.environ.setdefault("JOB_OUTPUT_DIR", os.path.join(directory, "job_output"))
+    os.environ.setdefault("PROFILE_DIR", os.path.join(directory, "profiles"))
+    os.environ.setdefault("GAZETTEER_PATH", os.path.join(directory, "pincodes.gaz"))
+    os.environ.setdefault("GAZETTEER_NORMALIZE", "True")
+    os.environ.setdefault("BULK_CHUNK_SIZE", "2")  # bulk operations page through several chunks
+    
+    import gazetteer
+    if not os.path.exists(os.environ["GAZETTEER_PATH"]):
+        sample = os.path.join(directory, "pincodes.csv")
+        with open(sample, "w") as handle:
+            handle.write(SAMPLE_PIN_CODES)
+        gazetteer.build(gazetteer.read_csv(sample), os.environ["GAZETTEER_PATH"])
+    
+    from fastapi.testclient import TestClient
+    import init_db
+    import main as app_module
+    
+    init_db.create_tables()
+    init_db.insert_sample_data()
+    client = TestClient(app_module.app)
+    client.__enter__()  # runs the startup hooks (job runner, audit writer, event broker)
+    
+    _in_process = (client, directory)
+    requests = InProcessRequests(client)
+    BASE_URL = str(client.base_url)
+
+def stop_in_process_app():
+    global _in_process
+    if _in_process:
+        client, directory = _in_process
+        client.__exit__(None, None, None)
+        shutil.rmtree(directory, ignore_errors=True)
+        _in_process = None
+
+def check_query_budget(response):
+    """Report routes that issued more statements than their declared budget.
+
+    The server only sends these headers when started with QUERY_GUARD=log or
+    QUERY_GUARD=raise.
+    """
+    count = response.headers.get("X-Query-Count")
+    budget = response.headers.get("X-Query-Budget")
+    if count is None or budget is None:
+        return True
+    if int(count) > int(budget):
+        print(f"❌ Query budget exceeded: {count} statements (budget {budget})")
+        return False
+    print(f"✅ Query budget respected: {count}/{budget} statements")
+    return True
+
+def create_test_party(party_name, headers=None, **fields):
+    """Create a throwaway party with one address, contact and bank account; returns it or None"""
+    party_data = {
+        "party_name": party_name,
+        "type_of_firm": "Partnership",
+        "email_id": "testparty@example.com",
+        "mobile_number": "9876543210",
+        "pan_number": "AAHFS4321K",
+        "addresses": [{"shipping_address": "12, Ring Road, Surat", "country": "India", "state": "Gujarat",
+                       "city": "Surat", "zip_code": "395001", "is_primary": True}],
+        "contact_persons": [{"name": "Test Contact", "mobile_number": "9825054321", "is_primary": True}],
+        "bank_details": {"bank_name": "State Bank of India", "branch_name": "Ring Road", "account_holder_name": party_name,
+                         "account_number": "123456789012", "confirm_account_number": "123456789012",
+                         "ifsc_code": "SBIN0001234", "is_primary": True},
+        **fields
+    }
+    response = requests.post(f"{BASE_URL}/parties/", json=party_data, headers=headers)
+    if response.status_code != 200:
+        print(f"❌ Creating test party {party_name} failed: {response.status_code} {response.text}")
+        return None
+    return response.json()
+
+def read_party_changes(*party_ids):
+    """Every change feed entry of the parties, after waiting for recent changes to settle"""
+    time.sleep(2.5)  # CHANGE_FEED_SETTLE_SECONDS holds back the newest entries
+    changes, since = [], 0
+    while True:
+        feed = requests.get(f"{BASE_URL}/changes", params={"since": since, "limit": 500}).json()
+        changes += [change for change in feed["changes"] if change["party_id"] in party_ids]
+        since = feed["next_cursor"]
+        if not feed["has_more"]:
+            return changes
+
+def test_health_check():
+    """Test the health check endpoint"""
+    print("Testing health check...")
+    try:
+        response = requests.get(f"{BASE_URL}/health")
+        if response.status_code == 200:
+            print("✅ Health check passed")
+            print(f"Response: {response.json()}")
+        else:
+            print(f"❌ Health check failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API. Make sure the server is running.")
+
+def test_create_party():
+    """Test creating a party with all details"""
+    print("\nTesting party creation...")
+    party_data = {
+        "party_code": "SNET345",
+        "party_name": "LALIT KIRANA (MOTALA)",
+        "type_of_firm": "Sole Proprietorship",
+        "email_id": "lalitkiranastore@gmail.com",
+        "mobile_number": "868-333-4878",
+        "gst_number": "24AABCU9603R1ZT",
+        "fssai_number": "11518041000578",
+        "pan_number": "AABCU9603R",
+        "tan_number": None,
+        "credit_limit": 500000.00,
+        "credit_days": 30,
+        "udyam_aadhar_number": None,
+        "court_case_pending": False,
+        "billing_same_as_shipping": False,
+        "turnover_declaration_certificate": None,
+        "addresses": [
+            {
+                "shipping_address": "201, Shree Sai Heights, Near Athwa Gate, Ring Road, Surat, Gujarat - 395001",
+                "country": "India",
+                "state": "Gujarat",
+                "district": "Surat",
+                "city": "Surat",
+                "zip_code": "395001",
+                "is_primary": True
+            }
+        ],
+        "contact_persons": [
+            {
+                "name": "Rajesh Sharma",
+                "mobile_number": "888-333-4878",
+                "email_id": "lalitkiranastore@gmail.com",
+                "designation": "Sales Manager",
+                "gender": "Male",
+                "birth_date": "1990-06-12",
+                "address": "101, Green Park Society, Adajan, Surat, Gujarat - 395009",
+                "aadhar_number": None,
+                "pan_number": None,
+                "is_primary": True
+            }
+        ],
+        "account_details": {
+            "account_name": "S MAHABOOB BASHA (CHAGALAMARI)",
+            "account_type": "Transport",
+            "main_group": "Cash & Cash Equivalents",
+            "group_name": "Current Assets",
+            "remarks": "Regular Inventories required."
+        },
+        "bank_details": {
+            "bank_name": "State Bank of India",
+            "branch_name": "Ring Road Branch",
+            "account_holder_name": "Vikram Shah",
+            "account_number": "123456789012",
+            "confirm_account_number": "123456789012",
+            "account_type": "Savings",
+            "ifsc_code": "SBIN0001234",
+            "bank_address": "15, Ring Road, Surat, Gujarat - 395001",
+            "is_primary": True
+        }
+    }
+    
+    try:
+        response = requests.post(f"{BASE_URL}/parties/", json=party_data)
+        if response.status_code == 200:
+            print("✅ Party created successfully")
+            party = response.json()
+            print(f"Created party ID: {party['party_id']}")
+            return party["party_id"]
+        else:
+            print(f"❌ Party creation failed: {response.status_code}")
+            print(f"Error: {response.text}")
+            return None
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+        return None
+
+def test_create_party_without_code():
+    """Test that a party created without a code gets one from the allocator"""
+    print("\nTesting party code allocation...")
+    party_data = {
+        "party_name": "SHREE TRADERS (SURAT)",
+        "type_of_firm": "Partnership",
+        "email_id": "shreetraders@example.com",
+        "mobile_number": "9876543210",
+        "pan_number": "AAHFS4321K"
+    }
+    
+    try:
+        codes = []
+        for _ in range(2):
+            response = requests.post(f"{BASE_URL}/parties/", json=party_data)
+            if response.status_code != 200:
+                print(f"❌ Party creation without code failed: {response.status_code}")
+                print(f"Error: {response.text}")
+                return
+            codes.append(response.json()["party_code"])
+        
+        if all(code.startswith("SNET") for code in codes) and codes[0] != codes[1]:
+            print(f"✅ Party codes allocated: {', '.join(codes)}")
+        else:
+            print(f"❌ Unexpected party codes: {codes}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_party_codes_in_batch():
+    """Test that codes from the allocator's range are rejected and that blocks can be reserved in an atomic batch (in-process app only)"""
+    print("\nTesting party code allocation in a batch...")
+    if not _in_process:
+        print("⚠️ The party code allocator is swapped in-process; skipped without --in-process")
+        return
+    import party_codes
+    
+    party = {"party_name": "BLOCK TRADERS (SURAT)", "type_of_firm": "Partnership",
+             "email_id": "blocktraders@example.com", "mobile_number": "9876543210", "pan_number": "AAHFS4321K"}
+    response = requests.post(f"{BASE_URL}/parties/", json={**party, "party_code": "SNET1000005"})
+    if response.status_code == 400:
+        print("✅ Party code from the allocator's range rejected")
+    else:
+        print(f"❌ Party code from the allocator's range not rejected: {response.status_code}")
+    
+    # A fresh allocator has no block, so the second party reserves one after the first has written
+    shared, party_codes.allocator = party_codes.allocator, party_codes.PartyCodeAllocator()
+    try:
+        operations = [
+            {"method": "POST", "path": "/parties/", "body": {**party, "party_code": f"BLOCK{int(time.time())}"}},
+            {"method": "POST", "path": "/parties/", "body": party},
+        ]
+        started = time.monotonic()
+        body = requests.post(f"{BASE_URL}/batch", json={"operations": operations, "atomic": True}).json()
+        elapsed = time.monotonic() - started
+        code = body["results"][1]["body"].get("party_code", "")
+        if body["committed"] and code.startswith("SNET") and elapsed < 2:
+            print(f"✅ Atomic batch reserved a party code block in {elapsed:.2f}s: {code}")
+        else:
+            print(f"❌ Party code block not reserved in the batch after {elapsed:.2f}s: {body['results']}")
+    finally:
+        party_codes.allocator = shared
+
+def test_validate_identifiers():
+    """Test batch identifier validation and rejection of a party with a bad GSTIN"""
+    print("\nTesting identifier validation...")
+    records = [
+        {"gst_number": "24aabcu9603r1zt", "pan_number": "AABCU9603R", "ifsc_code": "SBIN0001234",
+         "fssai_number": "11518041000578", "state": "Gujarat"},
+        {"gst_number": "24AABCU9603R1ZV", "pan_number": "ABCDE1234F", "ifsc_code": "SBIN001234"},
+        {"gst_number": "24AABCU9603R1ZT", "pan_number": "AAHFS4321K", "state": "Maharashtra"},
+    ]
+    try:
+        response = requests.post(f"{BASE_URL}/validation/identifiers", json={"records": records})
+        if response.status_code != 200:
+            print(f"❌ Identifier validation failed: {response.status_code}")
+            print(f"Error: {response.text}")
+            return
+        body = response.json()
+        fields = [[error["field"] for error in result["errors"]] for result in body["results"]]
+        if (body["valid"] == 1 and fields[0] == [] and body["results"][0]["bank_name"] == "State Bank of India"
+                and fields[1] == ["pan_number", "gst_number", "ifsc_code"] and fields[2] == ["gst_number"]):
+            print(f"✅ Identifiers validated: {body['valid']} valid, {body['invalid']} invalid")
+        else:
+            print(f"❌ Unexpected validation results: {body}")
+        
+        party_data = {
+            "party_name": "BAD GST TRADERS", "type_of_firm": "Partnership", "email_id": "badgst@example.com",
+            "mobile_number": "9876543210", "pan_number": "AAHFS4321K", "gst_number": "24AABCU9603R1ZT"
+        }
+        response = requests.post(f"{BASE_URL}/parties/", json=party_data)
+        if response.status_code == 422:
+            print("✅ Party with a GSTIN of another PAN rejected")
+        else:
+            print(f"❌ Party with a mismatched GSTIN answered {response.status_code}")
+        
+        # A GSTIN sent alone is compared with the PAN already stored
+        party = create_test_party("GST UPDATE TRADERS")
+        if party:
+            party_id = party["party_id"]
+            try:
+                for method in (requests.put, requests.patch):
+                    response = method(f"{BASE_URL}/parties/{party_id}", json={"gst_number": "24AABCU9603R1ZT"})
+                    if response.status_code == 422:
+                        print(f"✅ {method.__name__.upper()} of a GSTIN of another PAN rejected")
+                    else:
+                        print(f"❌ {method.__name__.upper()} of a mismatched GSTIN answered {response.status_code}")
+                response = requests.put(f"{BASE_URL}/parties/{party_id}", json={"gst_number": "24AAHFS4321K1Z8"})
+                if response.status_code == 200 and response.json()["gst_number"] == "24AAHFS4321K1Z8":
+                    print("✅ GSTIN of the stored PAN accepted")
+                else:
+                    print(f"❌ GSTIN of the stored PAN answered {response.status_code}: {response.text}")
+            finally:
+                requests.delete(f"{BASE_URL}/parties/{party_id}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_parties():
+    """Test getting all parties"""
+    print("\nTesting get all parties...")
+    try:
+        response = requests.get(f"{BASE_URL}/parties/")
+        if response.status_code == 200:
+            parties = response.json()
+            print(f"✅ Retrieved {len(parties)} parties")
+            check_query_budget(response)
+            for party in parties:
+                print(f"  - {party['party_code']}: {party['party_name']} ({party['mobile_number']})")
+        else:
+            print(f"❌ Get parties failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_party(party_id):
+    """Test getting a specific party"""
+    print(f"\nTesting get party {party_id}...")
+    try:
+        response = requests.get(f"{BASE_URL}/parties/{party_id}")
+        if response.status_code == 200:
+            party = response.json()
+            print("✅ Party retrieved successfully")
+            check_query_budget(response)
+            print(f"Party: {party['party_name']} ({party['party_code']})")
+            print(f"Addresses: {len(party['addresses'])}")
+            print(f"Contact Persons: {len(party['contact_persons'])}")
+        else:
+            print(f"❌ Get party failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_update_party(party_id):
+    """Test updating a party"""
+    print(f"\nTesting update party {party_id}...")
+    update_data = {
+        "credit_limit": 750000.00,
+        "credit_days": 45,
+        "court_case_pending": True
+    }
+    
+    try:
+        response = requests.put(f"{BASE_URL}/parties/{party_id}", json=update_data)
+        if response.status_code == 200:
+            party = response.json()
+            print("✅ Party updated successfully")
+            print(f"Updated credit limit: {party['credit_limit']}")
+            print(f"Updated credit days: {party['credit_days']}")
+        else:
+            print(f"❌ Update party failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_party_versioning(party_id):
+    """Test that a party update based on an old version gets a 409"""
+    print(f"\nTesting party versioning for party {party_id}...")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/parties/{party_id}")
+        etag = response.headers.get("ETag")
+        version = response.json()["version"]
+        if etag != f'"{version}"':
+            print(f"❌ Party ETag {etag} does not match version {version}")
+            return
+        
+        response = requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_days": 60}, headers={"If-Match": etag})
+        if response.status_code != 200 or response.json()["version"] != version + 1:
+            print(f"❌ Update with current version failed: {response.status_code}")
+            return
+        print(f"✅ Update with current version moved party to version {version + 1}")
+        
+        # A second update based on the same (now stale) version
+        response = requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_days": 30}, headers={"If-Match": etag})
+        if response.status_code == 409 and response.json()["current"]["version"] == version + 1:
+            print("✅ Stale update rejected with the current party")
+        else:
+            print(f"❌ Stale update not rejected: {response.status_code}")
+        
+        response = requests.patch(f"{BASE_URL}/parties/{party_id}", json={"credit_days": 30, "version": version})
+        if response.status_code == 409:
+            print("✅ Stale aggregate update rejected")
+        else:
+            print(f"❌ Stale aggregate update not rejected: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_party_aggregate_update():
+    """Test inserting, updating and deleting children in one PATCH, and rejection of foreign or repeated child ids"""
+    print("\nTesting aggregate party update...")
+    try:
+        party = create_test_party("AGGREGATE TRADERS (SURAT)")
+        if party is None:
+            return
+        party_id = party["party_id"]
+        address = party["addresses"][0]
+        update = {
+            "credit_days": 21,
+            # The stored address moves to a Mumbai PIN code, a second one is added, and every contact goes
+            "addresses": [
+                {**address, "zip_code": "400001", "district": None, "city": None, "state": "Gujarat"},
+                {"shipping_address": "4, Station Road, Surat", "country": "India", "state": "Gujarat", "zip_code": "395001", "is_primary": False},
+            ],
+            "contact_persons": [],
+        }
+        response = requests.patch(f"{BASE_URL}/parties/{party_id}", json=update)
+        if response.status_code != 200:
+            print(f"❌ Aggregate update failed: {response.status_code} {response.text}")
+            return
+        updated = response.json()
+        addresses = {item["address_id"]: item for item in updated["addresses"]}
+        moved = addresses.get(address["address_id"])
+        added = [item for item in updated["addresses"] if item["address_id"] != address["address_id"]]
+        if (moved and (moved["city"], moved["district"], moved["state"]) == ("Mumbai", "Mumbai", "Maharashtra")
+                and moved["version"] == address["version"] + 1 and len(added) == 1 and added[0]["district"] == "Surat"):
+            print("✅ Address updated and normalized from its new PIN code, second address inserted")
+        else:
+            print(f"❌ Unexpected addresses after aggregate update: {updated['addresses']}")
+        if updated["contact_persons"] == [] and updated["credit_days"] == 21 and updated["version"] == party["version"] + 1:
+            print("✅ Contacts left out of the list deleted, party fields updated")
+        else:
+            print(f"❌ Unexpected party after aggregate update: {updated}")
+        if updated["bank_details"] == party["bank_details"] and updated["account_details"] == party["account_details"]:
+            print("✅ Collections left out of the update untouched")
+        else:
+            print(f"❌ Collections left out changed: {party['bank_details']} -> {updated['bank_details']}")
+        
+        other = create_test_party("AGGREGATE OTHER TRADERS")
+        if other is None:
+            return
+        foreign = {"addresses": [{**other["addresses"][0], "city": "Surat"}]}
+        repeated = {"addresses": [moved, {**moved, "shipping_address": "Another road"}]}
+        statuses = [requests.patch(f"{BASE_URL}/parties/{party_id}", json=body).status_code for body in (foreign, repeated)]
+        after = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        if statuses == [400, 400] and after["version"] == updated["version"]:
+            print("✅ Another party's child id and a repeated child id rejected without changes")
+        else:
+            print(f"❌ Foreign and repeated child ids answered {statuses}")
+        for created in (party, other):
+            requests.delete(f"{BASE_URL}/parties/{created['party_id']}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_add_party_address(party_id):
+    """Test adding an address to a party"""
+    print(f"\nTesting add address to party {party_id}...")
+    address_data = {
+        "shipping_address": "301, Business Park, Near Railway Station, Mumbai, Maharashtra - 400001",
+        "country": "India",
+        "state": "Maharashtra",
+        "district": "Mumbai",
+        "city": "Mumbai",
+        "zip_code": "400001",
+        "is_primary": False
+    }
+    
+    try:
+        response = requests.post(f"{BASE_URL}/parties/{party_id}/addresses/", json=address_data)
+        if response.status_code == 200:
+            address = response.json()
+            print("✅ Address added successfully")
+            print(f"Address ID: {address['address_id']}")
+        else:
+            print(f"❌ Add address failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_add_contact_person(party_id):
+    """Test adding a contact person to a party"""
+    print(f"\nTesting add contact person to party {party_id}...")
+    contact_data = {
+        "name": "Priya Patel",
+        "mobile_number": "987-654-3210",
+        "email_id": "priya.patel@example.com",
+        "designation": "Accounts Manager",
+        "gender": "Female",
+        "birth_date": "1985-03-15",
+        "address": "202, Sunshine Apartments, Bandra West, Mumbai - 400050",
+        "aadhar_number": None,
+        "pan_number": None,
+        "is_primary": False
+    }
+    
+    try:
+        response = requests.post(f"{BASE_URL}/parties/{party_id}/contacts/", json=contact_data)
+        if response.status_code == 200:
+            contact = response.json()
+            print("✅ Contact person added successfully")
+            print(f"Contact ID: {contact['contact_id']}")
+        else:
+            print(f"❌ Add contact person failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_products():
+    """Test getting all products"""
+    print("\nTesting get all products...")
+    try:
+        response = requests.get(f"{BASE_URL}/products/")
+        if response.status_code == 200:
+            products = response.json()
+            print(f"✅ Retrieved {len(products)} products")
+            for product in products:
+                print(f"  - {product['product_code']}: {product['product_name']}")
+        else:
+            print(f"❌ Get products failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_browse_products():
+    """Test faceted product browsing and that new products update the facet counts"""
+    print("\nTesting product browse...")
+    try:
+        url = f"{BASE_URL}/products/browse?group_name=CHANA"
+        response = requests.get(url)
+        if response.status_code != 200:
+            print(f"❌ Browse products failed: {response.status_code}")
+            return
+        before = response.json()
+        check_query_budget(response)
+        print(f"✅ Browse returned {before['total']} products in group CHANA")
+        for facet, values in before["facets"].items():
+            print(f"  - {facet}: " + ", ".join(f"{v['value']} ({v['count']})" for v in values))
+        
+        product = {
+            "product_code": f"T{int(time.time() * 1000) % 10**12}",
+            "product_name": "BESAN 50 KG TEST PACK",
+            "group_name": "CHANA",
+            "sub_group": "CHANA",
+            "item": "BESAN SINGLE",
+            "stock_keeping_unit": "50 KG"
+        }
+        response = requests.post(f"{BASE_URL}/products/", json=product)
+        if response.status_code != 200:
+            print(f"❌ Create product failed: {response.status_code}")
+            return
+        
+        after = requests.get(url).json()
+        units = {v["value"]: v["count"] for v in after["facets"]["stock_keeping_unit"]}
+        if after["total"] == before["total"] + 1 and units.get("50 KG", 0) >= 1:
+            print("✅ Facet counts include the new product")
+        else:
+            print(f"❌ Facet counts not updated: {before['total']} -> {after['total']}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_add_party_product(party_id):
+    """Test adding a product to a party"""
+    print(f"\nTesting add product to party {party_id}...")
+    
+    # First get available products
+    try:
+        products_response = requests.get(f"{BASE_URL}/products/")
+        if products_response.status_code == 200:
+            products = products_response.json()
+            if products:
+                product_id = products[0]['product_id']
+                party_product_data = {
+                    "product_id": product_id,
+                    "quantity": 25
+                }
+                
+                response = requests.post(f"{BASE_URL}/parties/{party_id}/products/", json=party_product_data)
+                if response.status_code == 200:
+                    party_product = response.json()
+                    print("✅ Product added to party successfully")
+                    print(f"Party Product ID: {party_product['party_product_id']}")
+                else:
+                    print(f"❌ Add product to party failed: {response.status_code}")
+            else:
+                print("⚠️ No products available to add")
+        else:
+            print(f"❌ Get products failed: {products_response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_payment_terms():
+    """Test getting all payment terms"""
+    print("\nTesting get all payment terms...")
+    try:
+        response = requests.get(f"{BASE_URL}/payment-terms/")
+        if response.status_code == 200:
+            terms = response.json()
+            print(f"✅ Retrieved {len(terms)} payment terms")
+            for term in terms:
+                print(f"  - {term['term_description']} ({term['payment_days']} days)")
+        else:
+            print(f"❌ Get payment terms failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_add_party_payment_term(party_id):
+    """Test adding a payment term to a party"""
+    print(f"\nTesting add payment term to party {party_id}...")
+    
+    # First get available payment terms
+    try:
+        terms_response = requests.get(f"{BASE_URL}/payment-terms/")
+        if terms_response.status_code == 200:
+            terms = terms_response.json()
+            if terms:
+                term_id = terms[0]['term_id']
+                party_term_data = {
+                    "term_id": term_id,
+                    "is_default": True
+                }
+                
+                response = requests.post(f"{BASE_URL}/parties/{party_id}/payment-terms/", json=party_term_data)
+                if response.status_code == 200:
+                    party_term = response.json()
+                    print("✅ Payment term added to party successfully")
+                    print(f"Party Term ID: {party_term['party_term_id']}")
+                else:
+                    print(f"❌ Add payment term to party failed: {response.status_code}")
+            else:
+                print("⚠️ No payment terms available to add")
+        else:
+            print(f"❌ Get payment terms failed: {terms_response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_payment_schedule(party_id):
+    """Test due dates and discounts computed from the party's default payment term"""
+    print("\nTesting payment schedule...")
+    try:
+        links = requests.get(f"{BASE_URL}/parties/{party_id}/payment-terms/").json()
+        default = next((link["payment_term"] for link in links if link["is_default"]), None)
+        if default is None:
+            print("⚠️ Party has no default payment term")
+            return
+        
+        invoices = [{"party_id": party_id, "invoice_date": "2025-01-10", "amount": 10000.0}] * 3
+        invoices.append({"party_id": 999999999, "invoice_date": "2025-01-10", "amount": 10000.0})
+        response = requests.post(f"{BASE_URL}/billing/payment-schedule", json={"invoices": invoices})
+        if response.status_code != 200:
+            print(f"❌ Payment schedule failed: {response.status_code}")
+            print(f"Error: {response.text}")
+            return
+        check_query_budget(response)
+        
+        row = response.json()["schedule"][0]
+        expected_due = date.fromordinal(date(2025, 1, 10).toordinal() + default["payment_days"]).isoformat()
+        expected_discount = round(10000.0 * (default["cash_discount"] or 0) / 100, 2)
+        if row["term_id"] == default["term_id"] and row["due_date"] == expected_due and row["discount_amount"] == expected_discount:
+            print(f"✅ Invoice due {row['due_date']}, discount {row['discount_amount']} until {row['discount_until']}, reminder {row['reminder_date']}")
+        else:
+            print(f"❌ Unexpected schedule row: {row}")
+        
+        # A party that does not exist gets no term instead of the global default
+        unknown = response.json()["schedule"][-1]
+        if unknown["reason"] == "unknown_party" and unknown["term_id"] is None and unknown["due_date"] is None:
+            print("✅ Unknown party marked unknown_party")
+        else:
+            print(f"❌ Unknown party got a term: {unknown}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_credit_check(party_id):
+    """Test batch credit decisions, including a credit limit changed between calls"""
+    print("\nTesting credit check...")
+    try:
+        def check(checks):
+            response = requests.post(f"{BASE_URL}/credit/check", json={"checks": checks, "as_of": "2025-03-01"})
+            if response.status_code != 200:
+                print(f"❌ Credit check failed: {response.status_code}")
+                print(f"Error: {response.text}")
+                return None
+            check_query_budget(response)
+            return response.json()["decisions"]
+        
+        requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_limit": 100000.00, "credit_days": 30})
+        decisions = check([
+            {"party_id": party_id, "outstanding": 40000.0, "order_amount": 10000.0, "oldest_due_date": "2025-02-15"},
+            {"party_id": party_id, "outstanding": 95000.0, "order_amount": 10000.0, "oldest_due_date": "2025-01-01"},
+            {"party_id": 999999999, "order_amount": 10.0},
+        ])
+        if decisions is None:
+            return
+        allowed, denied, unknown = decisions
+        if (allowed["allowed"] and allowed["available_credit"] == 50000.0
+                and denied["reasons"] == ["credit_limit_exceeded", "credit_days_exceeded"]
+                and unknown["reasons"] == ["unknown_party"]):
+            print(f"✅ Credit decisions: {[decision['reasons'] or 'allowed' for decision in decisions]}")
+        else:
+            print(f"❌ Unexpected credit decisions: {decisions}")
+        
+        # A lowered limit applies to the very next check
+        requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_limit": 20000.00})
+        decisions = check([{"party_id": party_id, "outstanding": 40000.0, "order_amount": 10000.0}])
+        if decisions and decisions[0]["reasons"] == ["credit_limit_exceeded"]:
+            print("✅ Updated credit limit applied without reload")
+        elif decisions:
+            print(f"❌ Credit check used a stale limit: {decisions[0]}")
+        
+        requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_limit": 750000.00, "credit_days": 45})
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_credit_table_reload(party_id):
+    """Test that a credit table reload does not hold up party changes and keeps those that arrive meanwhile (in-process app only)"""
+    print("\nTesting credit table reload...")
+    if not _in_process:
+        print("⚠️ The credit table is reloaded in-process; skipped without --in-process")
+        return
+    import threading
+    import credit
+    import events
+    
+    table = credit.CreditTable(reload_seconds=3600)
+    table.get()
+    change = events.Event.from_change(0, "party", party_id, party_id, "update", {"credit_limit": 1234.0, "credit_days": 5})
+    applied = threading.Thread(target=table.apply_events, args=([change],))
+    waited = []
+    load = table._load
+    
+    def slow_load():
+        arrays = load()
+        # A party change commits while the reload is reading
+        applied.start()
+        applied.join(2)
+        waited.append(applied.is_alive())
+        return arrays
+    
+    table._load, table._loaded_at = slow_load, 0.0
+    table.get()
+    applied.join()
+    known, limits, _, days = credit.party_limits([party_id], tables=table.get())
+    if waited != [False]:
+        print("❌ Party change waited for the credit table reload")
+    elif not (known[0] and limits[0] == 123400 and days[0] == 5):
+        print(f"❌ Change made during the reload was lost: {limits[0]} paise, {days[0]} days")
+    else:
+        print("✅ Credit table reloaded without holding up a party change, which was kept")
+
+def test_batch():
+    """Test creating a party with its children in one atomic batch, and rollback of a failed batch"""
+    print("\nTesting batch operations...")
+    try:
+        products = requests.get(f"{BASE_URL}/products/").json()[:3]
+        terms = requests.get(f"{BASE_URL}/payment-terms/").json()[:1]
+        party = {
+            "party_name": "BATCH KIRANA (SURAT)", "type_of_firm": "Sole Proprietorship",
+            "email_id": "batchkirana@example.com", "mobile_number": "9825012345", "pan_number": "AAHFS4321K"
+        }
+        address = {"shipping_address": "5, Station Road, Surat", "country": "India", "state": "Gujarat",
+                   "city": "Surat", "zip_code": "395001"}
+        operations = [
+            {"id": "party", "method": "POST", "path": "/parties/", "body": party},
+            {"method": "POST", "path": "/parties/${party.party_id}/addresses/", "body": address},
+            {"method": "POST", "path": "/parties/${party.party_id}/addresses/", "body": {**address, "is_primary": False}},
+            {"method": "POST", "path": "/parties/${party.party_id}/contacts/", "body": {"name": "Batch Contact", "mobile_number": "9825054321"}},
+        ]
+        operations += [
+            {"method": "POST", "path": "/parties/${party.party_id}/products/", "body": {"product_id": product["product_id"], "quantity": 5}}
+            for product in products
+        ]
+        operations += [
+            {"method": "POST", "path": "/parties/${party.party_id}/payment-terms/", "body": {"term_id": term["term_id"], "is_default": True}}
+            for term in terms
+        ]
+        operations.append({"method": "GET", "path": "/parties/${party.party_id}"})
+        
+        response = requests.post(f"{BASE_URL}/batch", json={"operations": operations, "atomic": True})
+        if response.status_code != 200:
+            print(f"❌ Batch failed: {response.status_code}")
+            print(f"Error: {response.text}")
+            return
+        body = response.json()
+        statuses = [result["status"] for result in body["results"]]
+        created = body["results"][-1]["body"]
+        if body["committed"] and all(status == 200 for status in statuses) and len(created["addresses"]) == 2:
+            print(f"✅ Atomic batch of {len(operations)} operations created party {created['party_code']}")
+        else:
+            print(f"❌ Unexpected batch results: {statuses} {body['results'][-1]}")
+        
+        # A failing operation rolls back the party created earlier in the same batch
+        operations = [
+            {"id": "party", "method": "POST", "path": "/parties/", "body": {**party, "party_name": "BATCH ROLLBACK TRADERS"}},
+            {"method": "POST", "path": "/parties/${party.party_id}/products/", "body": {"product_id": 999999999, "quantity": 1}},
+            {"method": "GET", "path": "/parties/${party.party_id}"},
+        ]
+        body = requests.post(f"{BASE_URL}/batch", json={"operations": operations, "atomic": True}).json()
+        statuses = [result["status"] for result in body["results"]]
+        leftovers = requests.get(f"{BASE_URL}/parties/", params={"search": "BATCH ROLLBACK"}).json()
+        if not body["committed"] and statuses[0] == 200 and statuses[2] == 424 and not leftovers:
+            print(f"✅ Failed atomic batch rolled back: {statuses}")
+        else:
+            print(f"❌ Failed batch was not rolled back: {statuses}, {len(leftovers)} parties left")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_master_types():
+    """Test getting master types"""
+    print("\nTesting get master types...")
+    try:
+        response = requests.get(f"{BASE_URL}/master-types/")
+        if response.status_code == 200:
+            types = response.json()
+            print(f"✅ Retrieved {len(types)} master types")
+            for type_item in types:
+                print(f"  - {type_item['type_name']}")
+        else:
+            print(f"❌ Get master types failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_account_groups():
+    """Test getting account groups"""
+    print("\nTesting get account groups...")
+    try:
+        response = requests.get(f"{BASE_URL}/account-groups/")
+        if response.status_code == 200:
+            groups = response.json()
+            print(f"✅ Retrieved {len(groups)} account groups")
+            for group in groups:
+                print(f"  - {group['main_group']} > {group['group_name']}")
+        else:
+            print(f"❌ Get account groups failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_pin_code_lookup(party_id):
+    """Test PIN code lookups and address normalization from the gazetteer"""
+    print("\nTesting PIN code gazetteer...")
+    try:
+        response = requests.get(f"{BASE_URL}/pincodes/395001")
+        if response.status_code == 404 and "configured" in response.text:
+            print("⚠️ No PIN code gazetteer configured on the server")
+            return
+        place = response.json()
+        if response.status_code == 200 and place["district"] == "Surat" and place["state"] == "Gujarat":
+            print(f"✅ 395001 is {place['city']}, {place['district']}, {place['state']}")
+        else:
+            print(f"❌ PIN code lookup failed: {response.status_code} {response.text}")
+        
+        response = requests.get(f"{BASE_URL}/pincodes/999999")
+        if response.status_code != 404:
+            print(f"❌ Unknown PIN code answered {response.status_code}")
+        
+        address_data = {
+            "shipping_address": "12, Fort Market, Mumbai", "country": "India",
+            "state": "maharashtra", "zip_code": "400001", "is_primary": False
+        }
+        response = requests.post(f"{BASE_URL}/parties/{party_id}/addresses/", json=address_data)
+        address = response.json()
+        if response.status_code == 200 and (address["city"], address["district"], address["state"]) == ("Mumbai", "Mumbai", "Maharashtra"):
+            print("✅ Address place normalized from its PIN code")
+        else:
+            print(f"❌ Address not normalized: {response.status_code} {response.text}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_broken_gazetteer(party_id):
+    """Test that a missing or broken gazetteer file stops startup and leaves addresses alone (in-process app only)"""
+    print("\nTesting broken PIN code gazetteer...")
+    if not _in_process:
+        print("⚠️ The gazetteer file is swapped in-process; skipped without --in-process")
+        return
+    import asyncio
+    import gazetteer
+    import main as app_module
+    from config import settings
+    
+    with open(settings.GAZETTEER_PATH, "rb") as handle:
+        built = handle.read()
+    broken = {"missing": None, "empty": b"", "truncated": built[:len(built) // 2], "garbage": b"x" * len(built)}
+    saved = (settings.GAZETTEER_PATH, gazetteer._gazetteer, gazetteer._error)
+    try:
+        for name, content in broken.items():
+            settings.GAZETTEER_PATH = os.path.join(_in_process[1], f"broken-{name.replace(' ', '-')}.gaz")
+            if content is not None:
+                with open(settings.GAZETTEER_PATH, "wb") as handle:
+                    handle.write(content)
+            gazetteer._gazetteer = gazetteer._error = None
+            try:
+                asyncio.run(app_module.open_gazetteer())
+                print(f"❌ Startup accepted a {name} gazetteer file")
+                continue
+            except gazetteer.GazetteerUnavailable:
+                pass
+            address_data = {"shipping_address": "7, Ring Road, Surat", "country": "India",
+                            "state": "gujarat", "zip_code": "395001", "is_primary": False}
+            response = requests.post(f"{BASE_URL}/parties/{party_id}/addresses/", json=address_data)
+            lookup = requests.get(f"{BASE_URL}/pincodes/395001")
+            if response.status_code == 200 and response.json()["state"] == "gujarat" and lookup.status_code == 404:
+                print(f"✅ {name.capitalize()} gazetteer file stops startup; addresses are kept as given")
+            else:
+                print(f"❌ {name.capitalize()} gazetteer file: address {response.status_code}, lookup {lookup.status_code}")
+    finally:
+        settings.GAZETTEER_PATH, gazetteer._gazetteer, gazetteer._error = saved
+
+def test_search_parties():
+    """Test searching parties"""
+    print("\nTesting search parties...")
+    try:
+        response = requests.get(f"{BASE_URL}/parties/?search=LALIT")
+        if response.status_code == 200:
+            parties = response.json()
+            print(f"✅ Search returned {len(parties)} parties")
+            check_query_budget(response)
+            for party in parties:
+                print(f"  - {party['party_name']} ({party['party_code']})")
+        else:
+            print(f"❌ Search parties failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_suggest_parties():
+    """Test typeahead suggestions by name, later name word and code prefix"""
+    print("\nTesting party suggestions...")
+    try:
+        for query in ("lalit kir", "KIRANA", "snet34"):
+            response = requests.get(f"{BASE_URL}/parties/suggest", params={"q": query, "limit": 5})
+            if response.status_code != 200:
+                print(f"❌ Suggest '{query}' failed: {response.status_code}")
+                continue
+            suggestions = response.json()
+            if any(party["party_code"] == "SNET345" for party in suggestions):
+                print(f"✅ Suggest '{query}' returned {len(suggestions)} parties")
+                check_query_budget(response)
+            else:
+                print(f"❌ Suggest '{query}' did not return SNET345: {suggestions}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_tenant_isolation(party_id):
+    """Test that a second tenant reuses a party code without seeing the first tenant's parties"""
+    print("\nTesting tenant isolation...")
+    try:
+        acme = {"X-Tenant-ID": "acme"}
+        party = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        if requests.get(f"{BASE_URL}/parties/", headers=acme).status_code == 400:
+            print("⚠️ Tenant 'acme' is not configured on this server (set TENANTS=acme)")
+            return
+        
+        response = requests.post(f"{BASE_URL}/parties/", headers=acme, json={
+            "party_code": party["party_code"], "party_name": "ACME KIRANA (SURAT)", "type_of_firm": "Sole Proprietorship",
+            "email_id": "acmekirana@example.com", "mobile_number": "9825011111", "pan_number": "AAHFA1234K"
+        })
+        if response.status_code != 200:
+            print(f"❌ Tenant acme could not reuse party code {party['party_code']}: {response.status_code} {response.text}")
+            return
+        acme_party = response.json()
+        print(f"✅ Tenant acme created party {acme_party['party_id']} with the same code {party['party_code']}")
+        
+        response = requests.get(f"{BASE_URL}/parties/{party_id}", headers=acme)
+        if response.status_code == 404:
+            print("✅ Another tenant's party is not found")
+        else:
+            print(f"❌ Tenant acme read another tenant's party: {response.status_code}")
+        
+        # Lookups by id are cached lambda statements: tenants take turns, so a
+        # tenant criterion bound on the first call would let the other read
+        statuses = [
+            requests.get(f"{BASE_URL}/parties/{lookup_id}", headers=headers).status_code
+            for lookup_id in (acme_party["party_id"], party_id) for headers in ({}, acme, {}, acme)
+        ]
+        if statuses == [404, 200, 404, 200, 200, 404, 200, 404]:
+            print("✅ Cached lookups by id stay within each tenant")
+        else:
+            print(f"❌ Cached lookups by id crossed tenants: {statuses}")
+        
+        if _in_process:
+            from sqlalchemy import lambda_stmt, select
+            from models import SessionLocal, PartyMaster
+            with SessionLocal(tenant="acme") as db:
+                try:
+                    db.execute(lambda_stmt(lambda: select(PartyMaster).where(PartyMaster.party_id == party_id))).first()
+                    print("❌ Lambda statement without a tenant criterion executed")
+                except ValueError:
+                    print("✅ Lambda statement without a tenant criterion refused")
+        
+        found = requests.get(f"{BASE_URL}/parties/", params={"search": party["party_code"]}, headers=acme).json()
+        if [found_party["party_id"] for found_party in found] == [acme_party["party_id"]]:
+            print("✅ Search only returns the tenant's own parties")
+        else:
+            print(f"❌ Tenant acme search returned {found}")
+        
+        # The tenant's typeahead index is built on its first lookup
+        for _ in range(50):
+            response = requests.get(f"{BASE_URL}/parties/suggest", params={"q": party["party_code"]}, headers=acme)
+            if response.status_code != 503:
+                break
+            time.sleep(0.1)
+        if response.status_code == 200 and [found_party["party_id"] for found_party in response.json()] == [acme_party["party_id"]]:
+            print("✅ Suggestions only return the tenant's own parties")
+        elif response.status_code == 404:
+            print("⚠️ Typeahead is disabled")
+        else:
+            print(f"❌ Tenant acme suggestions returned {response.status_code} {response.text}")
+        
+        response = requests.get(f"{BASE_URL}/parties/", headers={"X-Tenant-ID": "no-such-tenant"})
+        if response.status_code == 400:
+            print("✅ Unknown tenant rejected")
+        else:
+            print(f"❌ Unknown tenant got {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_export_party_products():
+    """Test the columnar party-product export in both formats"""
+    print("\nTesting party-product export...")
+    try:
+        for fmt, magic in (("parquet", b"PAR1"), ("arrow", b"ARROW1")):
+            response = requests.get(f"{BASE_URL}/exports/party-products?format={fmt}")
+            if response.status_code == 501:
+                print("⚠️ Export unavailable: pyarrow is not installed on the server")
+                return
+            if response.status_code != 200:
+                print(f"❌ {fmt} export failed: {response.status_code}")
+            elif response.content.startswith(magic) and response.content.endswith(magic):
+                print(f"✅ {fmt} export returned {len(response.content)} bytes")
+            else:
+                print(f"❌ {fmt} export is not a valid {fmt} file")
+        
+        if _in_process:
+            # A client that goes away after the first chunk still gets the writer closed
+            import bi_export
+            writers, make_writer = [], bi_export._writer
+            bi_export._writer = lambda *args: writers.append(make_writer(*args)) or writers[-1]
+            try:
+                stream = bi_export.stream_snapshot("parquet")
+                next(stream)
+                stream.close()
+            finally:
+                bi_export._writer = make_writer
+            if writers and not writers[0].is_open:
+                print("✅ Export writer closed when the stream was abandoned")
+            else:
+                print("❌ Export writer left open when the stream was abandoned")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_changes():
+    """Test reading the change feed"""
+    print("\nTesting change feed...")
+    try:
+        response = requests.get(f"{BASE_URL}/changes?since=0&limit=50")
+        if response.status_code == 200:
+            feed = response.json()
+            print(f"✅ Retrieved {len(feed['changes'])} changes (next cursor: {feed['next_cursor']})")
+            for change in feed["changes"][:10]:
+                print(f"  - #{change['change_id']} {change['operation']} {change['entity']} {change['entity_id']}")
+        else:
+            print(f"❌ Get changes failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_delete_party():
+    """Test that deleting a party leaves a tombstone for it and for each cascaded child"""
+    print("\nTesting delete party...")
+    try:
+        party = create_test_party("DELETED TRADERS (SURAT)")
+        if party is None:
+            return
+        party_id = party["party_id"]
+        children = {("address", address["address_id"]) for address in party["addresses"]}
+        children |= {("contact", contact["contact_id"]) for contact in party["contact_persons"]}
+        children |= {("bank_details", bank["bank_id"]) for bank in party["bank_details"]}
+        
+        response = requests.delete(f"{BASE_URL}/parties/{party_id}")
+        if response.status_code != 200:
+            print(f"❌ Delete party failed: {response.status_code}")
+            return
+        if requests.get(f"{BASE_URL}/parties/{party_id}").status_code != 404:
+            print("❌ Deleted party is still found")
+            return
+        
+        tombstones = {(change["entity"], change["entity_id"]) for change in read_party_changes(party_id) if change["operation"] == "delete"}
+        if ("party", party_id) in tombstones and children <= tombstones:
+            print(f"✅ Party {party_id} deleted with tombstones for its {len(children)} children")
+        else:
+            print(f"❌ Missing tombstones: {sorted(children | {('party', party_id)} - tombstones)}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+class ConnectedRequest:
+    """Stands in for the request of an event stream client that stays connected"""
+    async def is_disconnected(self):
+        return False
+
+def test_event_stream(party_id):
+    """Test live events, replay after a reconnect, resets and late commits of the event stream (in-process app only)"""
+    print("\nTesting event stream...")
+    if not _in_process:
+        print("⚠️ The event stream is read in-process; skipped without --in-process")
+        return
+    import asyncio
+    import events
+    import tenancy
+    
+    async def next_event(stream):
+        while True:
+            chunk = await asyncio.wait_for(anext(stream), 5)
+            if not chunk.startswith((":", "retry:")):
+                return chunk
+    
+    def party_event(chunk):
+        data = json.loads(chunk.split("data: ", 1)[1])
+        return data["entity"] == "party" and data["entity_id"] == party_id
+    
+    async def run():
+        stream = events.stream(ConnectedRequest(), {"parties"})
+        await anext(stream)  # subscribes before the retry hint
+        party = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_days": party["credit_days"]})
+        chunk = await next_event(stream)
+        while not party_event(chunk):
+            chunk = await next_event(stream)
+        await stream.aclose()
+        if not chunk.startswith("id: "):
+            print(f"❌ Live event without an id: {chunk!r}")
+            return
+        event_id = int(chunk.split("\n", 1)[0][4:])
+        print(f"✅ Live event {event_id} for party {party_id}")
+        
+        # A reconnect with Last-Event-ID replays what came after it
+        stream = events.stream(ConnectedRequest(), {"parties"}, event_id - 1)
+        replayed = await next_event(stream)
+        await stream.aclose()
+        if replayed == chunk:
+            print("✅ Reconnect replayed the missed event")
+        else:
+            print(f"❌ Reconnect replayed {replayed!r}")
+        
+        # A client older than the replay buffer gets a reset, and a late commit arrives without an id
+        tenant = tenancy.current()
+        small = events.LocalBroker(buffer_size=2)
+        small.publish([events.Event(change_id, "parties", "party", change_id, change_id, "update", tenant_id=tenant) for change_id in (1, 2, 3)])
+        app_broker, events.broker = events.broker, small
+        try:
+            stream = events.stream(ConnectedRequest(), None, 0)
+            await anext(stream)
+            reset = await next_event(stream)
+            small.publish([events.Event(5, "parties", "party", 5, 5, "update", tenant_id=tenant)])
+            small.publish([events.Event(4, "parties", "party", 4, 4, "update", tenant_id=tenant)])
+            newer, late = await next_event(stream), await next_event(stream)
+            await stream.aclose()
+        finally:
+            events.broker = app_broker
+        if reset == events.RESET and small.replay(2, tenant=tenant) is None and [event.id for event in small.replay(3, tenant=tenant)] == [5, 4]:
+            print("✅ Client too far behind got a reset")
+        else:
+            print(f"❌ Expected a reset, got {reset!r}")
+        if newer.startswith("id: 5\n") and late.startswith("event: parties") and '"entity_id": 4' in late:
+            print("✅ Late commit delivered without moving the resume point back")
+        else:
+            print(f"❌ Unexpected events after the reset: {newer!r} {late!r}")
+    
+    try:
+        asyncio.run(run())
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_change_log_broker_gaps():
+    """Test that the database broker picks up a change committed after one with a higher id (in-process app only)"""
+    print("\nTesting change log broker...")
+    if not _in_process:
+        print("⚠️ The change log is read in-process; skipped without --in-process")
+        return
+    from sqlalchemy import delete, func, select
+    import events
+    import tenancy
+    from models import ChangeLog, SessionLocal
+    
+    broker = events.ChangeLogBroker()
+    broker.read_new(tenancy.ALL_TENANTS)
+    with SessionLocal() as db:
+        latest = db.execute(select(func.max(ChangeLog.change_id))).scalar() or 0
+        try:
+            # Change latest + 1 commits after latest + 2 was already read
+            db.add(ChangeLog(change_id=latest + 2, entity="probe", entity_id=2, operation="update"))
+            db.commit()
+            first = [event.id for event in broker.read_new(tenancy.ALL_TENANTS)]
+            db.add(ChangeLog(change_id=latest + 1, entity="probe", entity_id=1, operation="update"))
+            db.commit()
+            second = [event.id for event in broker.read_new(tenancy.ALL_TENANTS)]
+        finally:
+            db.execute(delete(ChangeLog).where(ChangeLog.entity == "probe"))
+            db.commit()
+    if first == [latest + 2] and second == [latest + 1]:
+        print("✅ Change committed out of id order was picked up")
+    else:
+        print(f"❌ Broker read {first} then {second}, expected [{latest + 2}] then [{latest + 1}]")
+
+def test_change_feed_slow_commit(party_id):
+    """Test that a transaction committing long after a faster one still reaches a reader of the change feed (in-process app only)"""
+    print("\nTesting change feed with a slow transaction...")
+    if not _in_process:
+        print("⚠️ The slow transaction runs in-process; skipped without --in-process")
+        return
+    from sqlalchemy import delete
+    import change_feed
+    from models import ChangeLog, SessionLocal
+    
+    def read_from(since):
+        time.sleep(2.5)  # CHANGE_FEED_SETTLE_SECONDS
+        changes = []
+        while True:
+            feed = requests.get(f"{BASE_URL}/changes", params={"since": since, "limit": 500}).json()
+            changes += feed["changes"]
+            since = feed["next_cursor"]
+            if not feed["has_more"]:
+                return changes, since
+    
+    try:
+        with SessionLocal() as slow:
+            change_feed.record_changes(slow, [("probe", change_feed.UPDATE, 1, None, None)])
+            # A faster transaction commits and is read past while the slow one is still open
+            party = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+            requests.put(f"{BASE_URL}/parties/{party_id}", json={"credit_days": party["credit_days"]})
+            _, cursor = read_from(0)
+            slow.commit()
+        changes, _ = read_from(cursor)
+        if [change["entity_id"] for change in changes if change["entity"] == "probe"] == [1]:
+            print("✅ Change of a transaction that committed after the settle window was read")
+        else:
+            print(f"❌ Change of the slow transaction was skipped: {changes}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+    finally:
+        with SessionLocal() as db:
+            db.execute(delete(ChangeLog).where(ChangeLog.entity == "probe"))
+            db.commit()
+
+def test_profile_sync_route():
+    """Test that profiling a sync (threadpool) route captures the frames of its handler"""
+    print("\nTesting request profiling of a sync route...")
+    records = [{"gst_number": "24AABCU9603R1ZT", "pan_number": "AABCU9603R", "ifsc_code": "SBIN0001234"}] * 20000
+    try:
+        response = requests.post(f"{BASE_URL}/validation/identifiers", json={"records": records}, headers={"X-Profile": "1"})
+        name = response.headers.get("X-Profile-Id")
+        if response.status_code != 200 or not name:
+            print(f"❌ Profiled request failed or was not profiled: {response.status_code}")
+            return
+        profile = requests.get(f"{BASE_URL}/admin/profiles/{name}").text
+        handler = [line for line in profile.splitlines() if "validate_identifiers (main.py" in line]
+        if handler:
+            print(f"✅ Profile {name} has {sum(int(line.rsplit(' ', 1)[1]) for line in handler)} samples inside the sync handler")
+        else:
+            print(f"❌ Profile {name} has no frames of the sync handler ({len(profile.splitlines())} stacks)")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_admission_cancellation():
+    """Test that queued requests cancelled by a client disconnect give their slots back (in-process app only)"""
+    print("\nTesting admission control cancellation...")
+    if not _in_process:
+        print("⚠️ Admission limiters are exercised in-process; skipped without --in-process")
+        return
+    import asyncio
+    import admission
+    
+    async def run():
+        limiter = admission.ClassLimiter("test", 1, 5, 0.5)
+        await limiter.acquire()
+        
+        # Cancelled while still queued
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        limiter.release()
+        
+        # Cancelled just as the slot is handed over: either the cancellation
+        # wins and the slot is passed on, or the request got in and releases it when done
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        queued.cancel()
+        if (await asyncio.gather(queued, return_exceptions=True))[0] is None:
+            limiter.release()
+        
+        # Both slots came back: the next request is admitted without waiting
+        try:
+            await asyncio.wait_for(limiter.acquire(), 0.1)
+        except (asyncio.TimeoutError, admission.Rejected):
+            return None
+        limiter.release()
+        return limiter.stats()
+    
+    stats = asyncio.run(run())
+    if stats and stats["in_flight"] == 0 and stats["queue_depth"] == 0:
+        print("✅ Cancelled requests released their admission slots")
+    else:
+        print(f"❌ Admission slots leaked by cancelled requests: {stats}")
+
+def test_bulk_delete_parties():
+    """Test that a filtered bulk delete removes exactly the matching parties and their children"""
+    print("\nTesting bulk delete...")
+    address = {"shipping_address": "7, Market Yard, Deletepur", "country": "India", "state": "Karnataka",
+               "city": "Deletepur", "zip_code": "560001", "is_primary": True}
+    try:
+        matched = [create_test_party(f"BULKDEL TRADERS {number}", addresses=[address]) for number in range(3)]
+        kept = create_test_party("BULKDEL TRADERS 3", addresses=[{**address, "city": "Keeppur"}])
+        if None in matched or kept is None:
+            return
+        
+        response = requests.post(f"{BASE_URL}/parties/bulk-delete", json={"filter": {"search": "BULKDEL", "city": "Deletepur"}})
+        if response.status_code != 200 or response.json()["affected"] != len(matched):
+            print(f"❌ Bulk delete failed: {response.status_code} {response.text}")
+            return
+        
+        left = [party["party_id"] for party in requests.get(f"{BASE_URL}/parties/", params={"search": "BULKDEL"}).json()]
+        if left == [kept["party_id"]]:
+            print(f"✅ Bulk delete removed the {len(matched)} matching parties and kept party {kept['party_id']}")
+        else:
+            print(f"❌ Parties left after bulk delete: {left}, expected [{kept['party_id']}]")
+        
+        children = sum(
+            len(requests.get(f"{BASE_URL}/parties/{party['party_id']}/{path}/").json())
+            for party in matched for path in ("addresses", "contacts", "bank-details")
+        )
+        survivor = requests.get(f"{BASE_URL}/parties/{kept['party_id']}").json()
+        if children == 0 and len(survivor["addresses"]) == 1 and len(survivor["bank_details"]) == 1:
+            print("✅ Children of deleted parties cascaded, the kept party still has its own")
+        else:
+            print(f"❌ {children} children of deleted parties left, kept party has {survivor}")
+        requests.delete(f"{BASE_URL}/parties/{kept['party_id']}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_bulk_update_parties():
+    """Test that a filtered bulk update changes, versions and records exactly the matching parties"""
+    print("\nTesting bulk update...")
+    address = {"shipping_address": "9, Market Yard, Updatepur", "country": "India", "state": "Karnataka",
+               "city": "Updatepur", "zip_code": "560001", "is_primary": True}
+    acme = {"X-Tenant-ID": "acme"}
+    try:
+        matched = [create_test_party(f"BULKUPD TRADERS {number}", addresses=[address], credit_days=30) for number in range(3)]
+        kept = create_test_party("BULKUPD TRADERS 3", addresses=[{**address, "city": "Steadypur"}], credit_days=30)
+        # Same name and city in another tenant
+        other_tenant = None
+        if requests.get(f"{BASE_URL}/parties/", headers=acme).status_code == 200:
+            other_tenant = create_test_party("BULKUPD TRADERS 4", headers=acme, addresses=[address], credit_days=30)
+        if None in matched or kept is None:
+            return
+        
+        response = requests.patch(f"{BASE_URL}/parties/bulk", json={
+            "filter": {"search": "BULKUPD", "city": "Updatepur"}, "changes": {"credit_days": 75}
+        })
+        if response.status_code != 200 or response.json()["affected"] != len(matched):
+            print(f"❌ Bulk update failed: {response.status_code} {response.text}")
+            return
+        
+        updated = [requests.get(f"{BASE_URL}/parties/{party['party_id']}").json() for party in matched]
+        if all(after["credit_days"] == 75 and after["version"] == before["version"] + 1 for before, after in zip(matched, updated)):
+            print(f"✅ Bulk update applied to {len(matched)} parties and bumped their versions")
+        else:
+            print(f"❌ Unexpected parties after bulk update: {updated}")
+        
+        untouched = [(kept, requests.get(f"{BASE_URL}/parties/{kept['party_id']}").json())]
+        if other_tenant:
+            untouched.append((other_tenant, requests.get(f"{BASE_URL}/parties/{other_tenant['party_id']}", headers=acme).json()))
+        if all(after["credit_days"] == 30 and after["version"] == before["version"] for before, after in untouched):
+            print(f"✅ {len(untouched)} parties outside the filter or tenant untouched")
+        else:
+            print(f"❌ Parties outside the filter or tenant changed: {untouched}")
+        
+        party_ids = [party["party_id"] for party in matched]
+        updates = [
+            change["party_id"] for change in read_party_changes(*party_ids, kept["party_id"])
+            if change["operation"] == "update" and change["data"]["credit_days"] == 75
+        ]
+        audited = [
+            entry["party_id"] for party_id in party_ids + [kept["party_id"]]
+            for entry in requests.get(f"{BASE_URL}/audit", params={"party_id": party_id, "entity": "party"}).json()["entries"]
+            if entry["action"] == "update" and entry["before"]["credit_days"] == 30 and entry["after"]["credit_days"] == 75
+        ]
+        if sorted(updates) == party_ids and sorted(audited) == party_ids:
+            print("✅ One change feed entry and one audit entry per updated party")
+        else:
+            print(f"❌ Change feed entries for {updates}, audit entries for {audited}, expected {party_ids}")
+        
+        requests.post(f"{BASE_URL}/parties/bulk-delete", json={"filter": {"search": "BULKUPD"}})
+        if other_tenant:
+            requests.delete(f"{BASE_URL}/parties/{other_tenant['party_id']}", headers=acme)
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_slow_query_log(party_id):
+    """Test that slow statements are logged with redacted parameters and a plan, without touching the request's transaction (in-process app only)"""
+    print("\nTesting slow query log...")
+    if not _in_process:
+        print("⚠️ The slow query threshold is lowered in-process; skipped without --in-process")
+        return
+    import slow_query
+    try:
+        party = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        mobile_number = "9825099999" if party["mobile_number"] != "9825099999" else "9825088888"
+        threshold = slow_query.log.threshold_ms
+        slow_query.log.threshold_ms = 0  # every statement counts as slow
+        slow_query.log.reset()
+        try:
+            response = requests.put(f"{BASE_URL}/parties/{party_id}", json={"mobile_number": mobile_number})
+        finally:
+            slow_query.log.threshold_ms = threshold
+        
+        log = requests.get(f"{BASE_URL}/admin/slow-queries").json()
+        updates = [
+            entry for entry in log["queries"]
+            if entry["route"] == "PUT /parties/{party_id}" and entry["statement"].upper().startswith("UPDATE PARTY_MASTER")
+        ]
+        if not updates:
+            print(f"❌ No slow query entry for the party UPDATE: {[entry['statement'][:60] for entry in log['queries']]}")
+        elif mobile_number in json.dumps(log) or "<str:10>" not in json.dumps(updates[0]["parameters"]):
+            print(f"❌ Slow query parameters not redacted: {updates[0]['parameters']}")
+        elif not updates[0]["plan"] or updates[0]["plan"].startswith("EXPLAIN failed"):
+            print(f"❌ No plan for the slow UPDATE: {updates[0]['plan']}")
+        else:
+            print(f"✅ Slow UPDATE logged with redacted parameters {updates[0]['parameters']} and its plan")
+        
+        after = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        if response.status_code == 200 and after["mobile_number"] == mobile_number and after["version"] == party["version"] + 1:
+            print("✅ Update committed normally while its statements were explained")
+        else:
+            print(f"❌ Update affected by the slow query log: {response.status_code}, {after['mobile_number']}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_get_audit(party_id):
+    """Test reading the audit trail of a party"""
+    print("\nTesting audit trail...")
+    try:
+        # Audit entries are written in the background shortly after each commit
+        time.sleep(2)
+        response = requests.get(f"{BASE_URL}/audit?party_id={party_id}&limit=20")
+        if response.status_code == 200:
+            page = response.json()
+            print(f"✅ Retrieved {len(page['entries'])} audit entries")
+            for entry in page["entries"][:10]:
+                print(f"  - #{entry['audit_id']} {entry['action']} {entry['entity']} {entry['entity_id']} by {entry['actor'] or 'unknown'}")
+        else:
+            print(f"❌ Get audit trail failed: {response.status_code}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_background_job():
+    """Test running a background job and polling its progress"""
+    print("\nTesting background job...")
+    try:
+        response = requests.post(f"{BASE_URL}/jobs", json={"job_type": "generate_parties", "params": {"count": 5}})
+        if response.status_code != 200:
+            print(f"❌ Create job failed: {response.status_code}")
+            return
+        job_id = response.json()["job_id"]
+        
+        for _ in range(30):
+            job = requests.get(f"{BASE_URL}/jobs/{job_id}").json()
+            if job["status"] in ("completed", "failed", "cancelled"):
+                break
+            time.sleep(0.5)
+        
+        if job["status"] == "completed":
+            print(f"✅ Job {job_id} completed ({job['processed']}/{job['total']})")
+        else:
+            print(f"❌ Job {job_id} ended as {job['status']}: {job['error']}")
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def test_snapshot_restore(party_id):
+    """Test a snapshot and restore round trip of the master tables (in-process app only)"""
+    print("\nTesting snapshot and restore...")
+    if not _in_process:
+        print("⚠️ Snapshots run against the database directly; skipped without --in-process")
+        return
+    import party_codes
+    import snapshot
+    from models import engine, engines, PartyCodeBlock
+    acme = {"X-Tenant-ID": "acme"}
+    try:
+        tenant_party = create_test_party("SNAPSHOT TENANT TRADERS", headers=acme)
+        coded_party = create_test_party("SNAPSHOT CODED TRADERS")  # code from the allocator
+        if tenant_party is None or coded_party is None:
+            return
+        before = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        tenant_before = requests.get(f"{BASE_URL}/parties/{tenant_party['party_id']}", headers=acme).json()
+        directory = os.path.join(_in_process[1], f"snapshot-{time.time_ns()}")
+        manifest = snapshot.create_snapshot(directory)
+        rows = manifest["tables"]["party_master"]["rows"]
+        loaded = snapshot.restore_snapshot(directory)
+        after = requests.get(f"{BASE_URL}/parties/{party_id}").json()
+        tenant_after = requests.get(f"{BASE_URL}/parties/{tenant_party['party_id']}", headers=acme).json()
+        elsewhere = requests.get(f"{BASE_URL}/parties/{tenant_party['party_id']}")
+        if loaded["party_master"] != rows or not rows:
+            print(f"❌ Restore loaded {loaded['party_master']} of {rows} parties")
+        elif after != before:
+            print(f"❌ Party {party_id} changed by the round trip: {before} != {after}")
+        elif tenant_after != tenant_before or elsewhere.status_code != 404:
+            print(f"❌ Tenant party changed by the round trip: {tenant_before} != {tenant_after}, default tenant got {elsewhere.status_code}")
+        else:
+            print(f"✅ Snapshot of {sum(entry['rows'] for entry in manifest['tables'].values())} rows restored, tenant rows included")
+        
+        # Into a database whose allocator never handed out the restored codes, with a restarted API
+        with engine.begin() as connection:
+            connection.execute(PartyCodeBlock.__table__.delete())
+        snapshot.restore_snapshot(directory)
+        shared, party_codes.allocator = party_codes.allocator, party_codes.PartyCodeAllocator()
+        try:
+            response = requests.post(f"{BASE_URL}/parties/", json={
+                "party_name": "AFTER RESTORE TRADERS", "type_of_firm": "Partnership",
+                "email_id": "afterrestore@example.com", "mobile_number": "9876543210", "pan_number": "AAHFS4321K"
+            })
+        finally:
+            party_codes.allocator = shared
+        if response.status_code == 200 and response.json()["party_code"] != coded_party["party_code"]:
+            print(f"✅ Party created after the restore got a fresh code {response.json()['party_code']}")
+            requests.delete(f"{BASE_URL}/parties/{response.json()['party_id']}")
+        else:
+            print(f"❌ Party code after the restore: {response.status_code} {response.text[:200]}")
+        
+        with open(os.path.join(directory, snapshot.REBUILD), "w") as handle:
+            handle.write("{}")
+        try:
+            snapshot.restore_snapshot(directory)
+            print("❌ Restore ran over an unfinished one")
+        except snapshot.SnapshotError:
+            print("✅ Restore refused until an unfinished one is finished")
+        requests.delete(f"{BASE_URL}/parties/{tenant_party['party_id']}", headers=acme)
+        requests.delete(f"{BASE_URL}/parties/{coded_party['party_id']}")
+        
+        # Tenants with a database of their own would be left out
+        databases, engines.databases = engines.databases, {"acme": "schema:acme"}
+        try:
+            snapshot.create_snapshot(os.path.join(_in_process[1], f"snapshot-{time.time_ns()}"))
+            print("❌ Snapshot taken with a dedicated tenant database configured")
+        except snapshot.SnapshotError as exc:
+            print(f"✅ Snapshot refused: {exc}")
+        finally:
+            engines.databases = databases
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to the API")
+
+def main():
+    print("🚀 Starting NETAGE BI Party Master API Test Suite")
+    print("=" * 70)
+    
+    # Test health check
+    test_health_check()
+    
+    # Test party operations
+    party_id = test_create_party()
+    test_create_party_without_code()
+    test_party_codes_in_batch()
+    test_validate_identifiers()
+    
+    if party_id:
+        test_get_parties()
+        test_get_party(party_id)
+        test_update_party(party_id)
+        test_party_versioning(party_id)
+        test_party_aggregate_update()
+        test_add_party_address(party_id)
+        test_add_contact_person(party_id)
+        test_pin_code_lookup(party_id)
+        test_broken_gazetteer(party_id)
+        test_search_parties()
+        test_suggest_parties()
+    
+    # Test product operations
+    test_get_products()
+    test_browse_products()
+    if party_id:
+        test_add_party_product(party_id)
+    
+    # Test payment terms operations
+    test_get_payment_terms()
+    if party_id:
+        test_add_party_payment_term(party_id)
+        test_payment_schedule(party_id)
+        test_credit_check(party_id)
+        test_credit_table_reload(party_id)
+    
+    # Test batch operations
+    test_batch()
+    
+    # Test BI export
+    test_export_party_products()
+    
+    # Test master data
+    test_get_master_types()
+    test_get_account_groups()
+    
+    # Test change feed
+    test_get_changes()
+    test_delete_party()
+    test_bulk_delete_parties()
+    test_bulk_update_parties()
+    
+    # Test event stream
+    if party_id:
+        test_event_stream(party_id)
+    test_change_log_broker_gaps()
+    if party_id:
+        test_change_feed_slow_commit(party_id)
+    
+    # Test slow query log
+    if party_id:
+        test_slow_query_log(party_id)
+    
+    # Test request profiling
+    test_profile_sync_route()
+    
+    # Test admission control
+    test_admission_cancellation()
+    
+    # Test audit trail
+    if party_id:
+        test_get_audit(party_id)
+    
+    # Test background jobs
+    test_background_job()
+    
+    # Test tenant isolation
+    if party_id:
+        test_tenant_isolation(party_id)
+    
+    # Test snapshot and restore
+    if party_id:
+        test_snapshot_restore(party_id)
+    
+    print("\n" + "=" * 70)
+    print("🏁 Test suite completed!")
+    print("\n📚 API Documentation available at:")
+    print("   - Swagger UI: http://localhost:8000/docs")
+    print("   - ReDoc: http://localhost:8000/redoc")
+
+if __name__ == "__main__":
+    if "--in-process" in sys.argv:
+        use_in_process_app()
+        try:
+            main()
+        finally:
+            stop_in_process_app()
+        sys.exit(0)
+    main()
@@ -0,0 +1,225 @@
+import heapq
+import logging
+import re
+import threading
+from bisect import bisect_left, insort
+
+from sqlalchemy import select
+
+from config import settings
+from models import SessionLocal, PartyMaster
+import change_feed
+import events
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+_SEPARATORS = re.compile(r"[^0-9A-Z]+")
+
+# Between the key and the party id of an index entry; sorts before any key character
+_SEP = "\x00"
+
+
+def normalize(text):
+    """Upper-case a name or query and reduce punctuation runs to single spaces"""
+    return _SEPARATORS.sub(" ", (text or "").upper()).strip()
+
+
+def entry_keys(party_code, party_name, max_words=None):
+    """Keys a party is found under: its code, its name and the name from each later word"""
+    max_words = max_words or settings.TYPEAHEAD_MAX_WORDS
+    keys = {normalize(party_code)}
+    words = normalize(party_name).split(" ")
+    for start in range(min(len(words), max_words)):
+        keys.add(" ".join(words[start:]))
+    keys.discard("")
+    return frozenset(keys)
+
+
+def _party_id(entry):
+    return int(entry[entry.rindex(_SEP) + 1:])
+
+
+class PrefixIndex:
+    """In-memory prefix index over party names and codes.
+
+    Entries are ``"KEY\\0party_id"`` strings in sorted lists, so a lookup is a
+    bisect to the first key starting with the query and a short forward scan.
+    New entries go into a small sorted delta list that a background thread
+    merges into the main list once it grows past TYPEAHEAD_MERGE_THRESHOLD.
+    Entries of renamed and deleted parties are only marked stale; lookups skip
+    them and the next merge drops them.
+    """
+
+    def __init__(self, tenant=None, max_words=None, merge_threshold=None):
+        self.tenant = tenant
+        self.max_words = max_words or settings.TYPEAHEAD_MAX_WORDS
+        self.merge_threshold = merge_threshold or settings.TYPEAHEAD_MERGE_THRESHOLD
+        self.ready = False
+        self._main = []
+        self._delta = []
+        self._merging = []  # delta being folded into the main list, still searched
+        self._parties = {}  # party_id -> (party_code, party_name, entries)
+        self._stale = set()
+        self._dropping = set()  # stale entries the running merge removes
+        self._queued = []
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._parties)
+
+    def _entries(self, party_id, party_code, party_name):
+        return frozenset(f"{key}{_SEP}{party_id}" for key in entry_keys(party_code, party_name, self.max_words))
+
+    def load(self, rows):
+        """Replace the index with ``(party_id, party_code, party_name)`` rows"""
+        parties = {}
+        entries = []
+        for party_id, party_code, party_name in rows:
+            party_entries = self._entries(party_id, party_code, party_name)
+            parties[party_id] = (party_code, party_name, party_entries)
+            entries.extend(party_entries)
+        entries.sort()
+        with self._lock:
+            self._main, self._delta, self._merging = entries, [], []
+            self._parties, self._stale, self._dropping = parties, set(), set()
+            queued, self._queued = self._queued, []
+            self.ready = True
+        # Changes committed while loading; replaying ones the load already saw is harmless
+        for batch in queued:
+            self.apply_events(batch)
+
+    def upsert(self, party_id, party_code, party_name):
+        entries = self._entries(party_id, party_code, party_name)
+        with self._lock:
+            current = self._parties.get(party_id)
+            old_entries = current[2] if current else frozenset()
+            self._parties[party_id] = (party_code, party_name, entries)
+            for entry in entries - old_entries:
+                insort(self._delta, entry)
+                self._stale.discard(entry)
+                self._dropping.discard(entry)
+            self._stale.update(old_entries - entries)
+            merge = len(self._delta) > self.merge_threshold or len(self._stale) > self.merge_threshold
+        if merge:
+            self._merge_soon()
+
+    def remove(self, party_id):
+        with self._lock:
+            current = self._parties.pop(party_id, None)
+            if current:
+                self._stale.update(current[2])
+            merge = len(self._stale) > self.merge_threshold
+        if merge:
+            self._merge_soon()
+
+    def _merge_soon(self):
+        # Off the committing request; a merge already running picks up the rest next time
+        if not self._merge_lock.locked():
+            threading.Thread(target=self.merge, name="typeahead-merge", daemon=True).start()
+
+    def merge(self):
+        """Fold the delta into the main list and drop stale entries.
+
+        The merged list is built outside the index lock so lookups carry on;
+        entries added or marked stale meanwhile wait for the next merge.
+        heapq.merge runs in Python rather than holding the GIL for one long
+        C-level sort, so other threads keep being served while a
+        million-party index is merged.
+        """
+        with self._merge_lock:
+            with self._lock:
+                main, self._merging, self._delta = self._main, self._delta, []
+                dropping, self._dropping, self._stale = self._stale, self._stale, set()
+            entries, previous = [], None
+            for entry in heapq.merge(main, self._merging):
+                # A stale entry made current again is in the delta too, so drop repeats
+                if entry != previous and entry not in dropping:
+                    entries.append(entry)
+                previous = entry
+            with self._lock:
+                self._main, self._merging, self._dropping = entries, [], set()
+
+    def _is_current(self, entry):
+        return entry not in self._stale and entry not in self._dropping
+
+    def _scan(self, entries, prefix, limit, found):
+        """Add up to ``limit`` current matches from one sorted list to ``found``"""
+        position = bisect_left(entries, prefix)
+        added = 0
+        # Stale entries are skipped, but never scan without bound
+        for entry in entries[position:position + limit * 20]:
+            if added >= limit or not entry.startswith(prefix):
+                break
+            party_id = _party_id(entry)
+            if self._is_current(entry) and (party_id not in found or entry < found[party_id]):
+                found[party_id] = entry
+                added += 1
+
+    def suggest(self, query, limit=None):
+        """Parties whose code or name (from any of its first words) starts with ``query``"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit or settings.TYPEAHEAD_LIMIT, settings.TYPEAHEAD_MAX_LIMIT)
+        with self._lock:
+            found = {}
+            for entries in (self._main, self._merging, self._delta):
+                self._scan(entries, prefix, limit, found)
+            matches = sorted(found.items(), key=lambda item: item[1])[:limit]
+            parties = [(party_id, self._parties[party_id]) for party_id, _ in matches]
+        return [
+            {"party_id": party_id, "party_code": party_code, "party_name": party_name}
+            for party_id, (party_code, party_name, _) in parties
+        ]
+
+    def apply_events(self, batch):
+        """Follow committed party changes (an event broker listener)"""
+        batch = [event for event in batch if event.entity == change_feed.PARTY]
+        if not batch:
+            return
+        with self._lock:
+            if not self.ready:
+                self._queued.append(batch)
+                return
+        for event in batch:
+            if event.operation == change_feed.DELETE:
+                self.remove(event.entity_id)
+            elif event.data and "party_name" in event.data:
+                self.upsert(event.entity_id, event.data["party_code"], event.data["party_name"])
+
+    def build(self):
+        """Load every party of the index's tenant from the database"""
+        with SessionLocal(tenant=self.tenant) as db:
+            rows = db.execute(
+                select(PartyMaster.party_id, PartyMaster.party_code, PartyMaster.party_name)
+                .execution_options(yield_per=10000)
+            )
+            self.load(rows)
+        logger.info("Typeahead index of tenant %s loaded with %d parties", self.tenant, len(self))
+
+
+def _start_index(tenant):
+    """A tenant's index, built in the background"""
+    index = PrefixIndex(tenant)
+
+    def build():
+        try:
+            index.build()
+        except Exception:
+            logger.exception("Could not build the typeahead index of tenant %s", tenant)
+
+    threading.Thread(target=build, name="typeahead-build", daemon=True).start()
+    return index
+
+
+# One index per tenant, built on the tenant's first lookup
+indexes = tenancy.PerTenant(_start_index)
+
+
+def start():
+    """Follow party changes and build the indexes of the known tenants in the background"""
+    events.broker.add_listener(indexes.listener("apply_events"))
+    for tenant in settings.get_tenants():
+        indexes.get(tenant)